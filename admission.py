@@ -0,0 +1,136 @@
+"""Admission control for inference calls shared by many Streamlit sessions.
+
+At most ``max_concurrent`` inference calls run at once; up to ``max_queue``
+more wait in FIFO order and can report their position and an estimated wait.
+Anything beyond that is rejected straight away with Overloaded, so a burst is
+shed in milliseconds instead of every request timing out together.
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", "16"))
+INFERENCE_QUEUE_TIMEOUT = float(os.environ.get("INFERENCE_QUEUE_TIMEOUT", "30"))
+# Smoothing of the service-time estimate used for the wait shown to users
+SERVICE_TIME_ALPHA = 0.2
+
+
+class Overloaded(RuntimeError):
+    pass
+
+
+class QueueTimeout(Overloaded):
+    pass
+
+
+class _Ticket:
+    __slots__ = ("admitted",)
+
+    def __init__(self, admitted=False):
+        self.admitted = admitted
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent=1, max_queue=INFERENCE_QUEUE_SIZE, timeout=INFERENCE_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.running = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timeouts = 0
+        self.service_time = None
+        self._waiting = deque()
+        self._condition = threading.Condition()
+
+    def _enqueue(self):
+        with self._condition:
+            if self.running < self.max_concurrent and not self._waiting:
+                self.running += 1
+                self.admitted += 1
+                return _Ticket(admitted=True)
+            if len(self._waiting) >= self.max_queue:
+                self.shed += 1
+                raise Overloaded(f"{self.running} inference calls running and {len(self._waiting)} queued")
+            ticket = _Ticket()
+            self._waiting.append(ticket)
+            return ticket
+
+    def _release(self, service_seconds=None):
+        with self._condition:
+            self.running -= 1
+            if service_seconds is not None:
+                self.service_time = service_seconds if self.service_time is None else (
+                    SERVICE_TIME_ALPHA * service_seconds + (1 - SERVICE_TIME_ALPHA) * self.service_time
+                )
+            while self._waiting and self.running < self.max_concurrent:
+                self._waiting.popleft().admitted = True
+                self.running += 1
+                self.admitted += 1
+            self._condition.notify_all()
+
+    def _abandon(self, ticket):
+        # The waiter gave up (timeout or a Streamlit rerun); hand its place on if it was just admitted
+        with self._condition:
+            if ticket.admitted:
+                self._release()
+            else:
+                self._waiting.remove(ticket)
+
+    def estimated_wait(self, position):
+        # Rounds of max_concurrent calls ahead of us, each taking about one service time
+        return math.ceil(position / self.max_concurrent) * (self.service_time or 1.0)
+
+    @contextmanager
+    def slot(self, on_wait=None, poll_interval=0.25):
+        """Hold one inference slot for the duration of the block.
+
+        on_wait(position, estimated_wait_seconds) is called every poll_interval
+        while queued. Raises Overloaded when the queue is full and QueueTimeout
+        after waiting longer than the controller's timeout.
+        """
+        ticket = self._enqueue()
+        enqueued = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        try:
+            with self._condition:
+                while not ticket.admitted:
+                    if time.monotonic() >= deadline:
+                        self.timeouts += 1
+                        raise QueueTimeout(f"no inference slot free after {self.timeout:g}s")
+                    if on_wait is not None:
+                        position = self._waiting.index(ticket) + 1
+                        self._condition.release()
+                        try:
+                            on_wait(position, self.estimated_wait(position))
+                        finally:
+                            self._condition.acquire()
+                        if ticket.admitted:
+                            break
+                    self._condition.wait(min(poll_interval, max(0.0, deadline - time.monotonic())))
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        metrics.observe("admission_wait", time.perf_counter() - enqueued)
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - started)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "running": self.running,
+                "queued": len(self._waiting),
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "timeouts": self.timeouts,
+                "service_time": self.service_time,
+            }
@@ -1,13 +1,43 @@
+import hashlib
+import logging
+import os
+import time
+from contextlib import contextmanager
 import streamlit as st
 import numpy as np
-from PIL import Image
-import requests
-import os
-import tensorflow as tf
-from tensorflow.keras.applications.resnet50 import preprocess_input
-from tensorflow.keras.models import load_model
-import plotly.express as px
-import pandas as pd
+from PIL import UnidentifiedImageError
+import metrics
+from admission import AdmissionController, Overloaded
+from charts import CHART_RENDERER, _chart_spec, create_prediction_chart, prediction_chart_spec, timeline_chart_spec
+from classifier import (
+    CLASS_NAMES, IMAGE_SIZE, INFERENCE_CONCURRENCY, MAX_BATCH_SIZE,
+    ImageTooLargeError, batch_pool, fill_batch, load_image, supports_embeddings
+)
+from embedding_index import (
+    EMBEDDING_INDEX_DIR, NEAR_DUPLICATE_REUSE, RECORD_UPLOADS, SEEN_INDEX_MAX_ROWS, EmbeddingIndex, color_signature,
+    dhash
+)
+from live import VIDEO_TYPES, FrameScheduler, PredictionSmoother, classify_video, open_video
+from memory_guard import MemoryGuard
+from model_loader import BackgroundModelLoader
+from prediction_cache import CACHE_DIR, CACHE_DISK_MAX_ENTRIES, PredictionCache, cache_key, content_digest
+from prediction_history import PredictionHistory
+from preview import PreviewCache, encode_preview
+from tiling import PLATTER_SIZE, detect, overlay
+from worker_pool import INFERENCE_WORKERS
+
+# Preview uploads are decoded at roughly this size instead of full camera resolution
+PREVIEW_SIZE = (1024, 1024)
+THUMBNAIL_SIZE = (320, 320)
+# The single-image preview fills half the page; this is sharp there even on a high-density phone screen
+PREVIEW_DISPLAY_SIZE = (800, 800)
+SIMILAR_SNACKS = 4
+BUSY_MESSAGE = "The classifier is overloaded right now, please try again in a moment."
+SINGLE_MODE, BATCH_MODE, LIVE_MODE = "Single image", "Batch (multiple images)", "Live (camera or video)"
+PLATTER_MODE = "Platter (several snacks)"
+
+# TensorFlow is imported lazily, only once an image arrives; Plotly and pandas only with CHART_RENDERER=plotly
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
 
 # Configure page
 st.set_page_config(
@@ -17,6 +47,13 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource
+def get_model_loader():
+    # Mulai download/load/warm-up model di background begitu server menyala
+    return BackgroundModelLoader().start()
+
+get_model_loader()
+
 # Custom CSS for better styling
 st.markdown("""
 <style>
@@ -102,17 +139,6 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# URL ke model ResNet50 (.keras)
-MODEL_URL = "https://huggingface.co/zakialfadilah/best_model_resnet50/resolve/main/best_model_resnet50.keras"
-MODEL_PATH = "best_model_resnet50.keras"
-
-# Daftar kelas
-CLASS_NAMES = [
-    "kembang_goyang", "kerak_telor", "kue_cente", "kue_cubit", "kue_cucur",
-    "kue_gemblong", "kue_lumpur", "kue_pancong", "kue_rangi", "kue_wajik",
-    "ongol_ongol", "putu_mayang", "selendang_mayang", "uli_bakar"
-]
-
 # Additional information for snack classes
 EXTRA_INFO = {
     "kembang_goyang": {
@@ -416,56 +442,502 @@ In folklore, "Mayang" is described as something wavy, coiled, and beautiful, lik
 
 }
 
-@st.cache_resource
 def download_and_load_model():
-    if not os.path.exists(MODEL_PATH):
-        with st.spinner("Downloading AI model... Please wait"):
-            try:
-                response = requests.get(MODEL_URL)
-                response.raise_for_status()
-                with open(MODEL_PATH, 'wb') as f:
-                    f.write(response.content)
-                st.success("Model downloaded successfully!")
-            except Exception as e:
-                st.error(f"Error downloading model: {str(e)}")
-                return None
-    
-    try:
-        model = load_model(MODEL_PATH)
-        return model
-    except Exception as e:
-        st.error(f"Error loading model: {str(e)}")
+    loader = get_model_loader().start()
+    if not loader.ready:
+        message = "Downloading AI model... Please wait" if loader.downloading else "Loading AI model..."
+        with st.spinner(message):
+            progress_bar = st.progress(0.0) if loader.downloading else None
+            while not loader.wait(timeout=0.25):
+                done, total = loader.download_progress
+                if progress_bar is not None and total:
+                    progress_bar.progress(done / total, text=f"{done / 1e6:.0f} MB of {total / 1e6:.0f} MB")
+            if progress_bar is not None:
+                progress_bar.empty()
+
+    if loader.error is not None:
+        st.error(f"Error loading model: {str(loader.error)}")
+        return None, None
+    # Read once: a hot-swap may replace the model at any moment, and model and model_id must match
+    active = loader.active
+    return active.model, active.model_id
+
+@st.cache_resource
+def get_prediction_cache():
+    return PredictionCache()
+
+@st.cache_resource
+def get_embedding_cache():
+    # Supaya panel "similar snacks" tetap muncul saat prediksi diambil dari cache; 8 KB each, so fewer on disk
+    return PredictionCache(cache_dir=os.path.join(CACHE_DIR, "embeddings") if CACHE_DIR else None,
+                           disk_max_entries=CACHE_DISK_MAX_ENTRIES // 10)
+
+@st.cache_resource
+def get_prediction_history():
+    return PredictionHistory()
+
+@st.cache_resource
+def get_preview_cache():
+    return PreviewCache()
+
+@st.cache_resource
+def get_memory_guard():
+    # Dilepas berurutan saat RSS proses melewati budget
+    guard = MemoryGuard(tf_ready=lambda: get_model_loader().ready)
+    guard.add_releaser("prediction cache (memory tier)", get_prediction_cache().clear)
+    guard.add_releaser("embedding cache (memory tier)", get_embedding_cache().clear)
+    guard.add_releaser("chart specs", _chart_spec.cache_clear)
+    guard.add_releaser("encoded previews", get_preview_cache().clear)
+    guard.add_releaser("idle batch buffers", batch_pool.trim)
+    return guard
+
+def shrink_live_video(result):
+    # Every other point of the timeline; the chart barely changes
+    if len(result["timestamps"]) < 2:
         return None
+    return {**result, "timestamps": result["timestamps"][::2].copy(), "smoothed": result["smoothed"][::2].copy()}
+
+# The platter result is recomputed on the next rerun when dropped
+SESSION_SHRINKERS = {"live_video": shrink_live_video, "platter": lambda result: None}
+
+def preview_size(size=PREVIEW_DISPLAY_SIZE):
+    # st.image keeps its copy for the session; never bigger than the page shows it, smaller under pressure
+    return THUMBNAIL_SIZE if get_memory_guard().under_pressure(st.session_state) else size
+
+def preview_bytes(digest, image, size=PREVIEW_DISPLAY_SIZE):
+    # Encoded once per upload; reruns send the same JPEG bytes, which st.image passes through as they are
+    return get_preview_cache().get_or_encode(digest, preview_size(size), image)
 
-def predict_image(model, image):
+@st.cache_resource
+def get_admission_controller():
+    return AdmissionController(INFERENCE_CONCURRENCY or INFERENCE_WORKERS or 1)
+
+@contextmanager
+def inference_slot(message="Analyzing your image..."):
+    # Tampilkan posisi antrean selama menunggu, spinner begitu giliran kita
+    status = st.empty()
+    def show_queue(position, wait_seconds):
+        status.info(f"⏳ The classifier is busy: you are number {position} in the queue, "
+                    f"about {wait_seconds:.0f}s to go")
     try:
-        image = image.resize((256, 256))
-        image_array = np.array(image)
-        image_array = np.expand_dims(image_array, axis=0)
-        image_array = preprocess_input(image_array)
-        prediction = model.predict(image_array)[0]
-        return prediction
+        with get_admission_controller().slot(show_queue):
+            status.empty()
+            with st.spinner(message):
+                yield
+    finally:
+        status.empty()
+
+@st.cache_resource
+def get_embedding_indexes(model_id):
+    # Galeri referensi berlabel (dibangun lewat embedding_index.py) dan upload yang sudah pernah dilihat
+    gallery = EmbeddingIndex(os.path.join(EMBEDDING_INDEX_DIR, "gallery"))
+    if gallery.model_id not in (None, model_id):
+        logging.getLogger(__name__).warning("gallery index was built with %s, not %s; ignoring it",
+                                            gallery.model_id, model_id)
+        gallery = None
+    seen_dir = os.path.join(EMBEDDING_INDEX_DIR, "seen", hashlib.sha256(model_id.encode()).hexdigest()[:16])
+    return gallery, EmbeddingIndex(seen_dir, model_id=model_id, max_rows=SEEN_INDEX_MAX_ROWS)
+
+def record_prediction(kind, key, prediction, source, digest, model_id, latency_ms=None, stages_ms=None):
+    # Widget reruns bring the same upload back; it goes into the history once per session
+    recorded = st.session_state.setdefault("history_recorded", set())
+    if key in recorded:
+        return
+    recorded.add(key)
+    get_prediction_history().record(kind, prediction, source=source, image_hash=digest, model_id=model_id,
+                                    latency_ms=latency_ms, stages_ms=stages_ms)
+
+def decode_error(uploaded, error):
+    # Every mode reports a corrupt or non-image upload the same way instead of with a traceback
+    reason = "not a readable image" if isinstance(error, UnidentifiedImageError) else str(error)
+    return f"{uploaded.name}: {reason}"
+
+def lazy_image(source, draft_size=PREVIEW_SIZE):
+    # Decoded on first use; a rerun served from the preview and prediction caches never decodes
+    decoded = []
+    def image():
+        if not decoded:
+            try:
+                with metrics.stage("decode"):
+                    decoded.append(load_image(source, draft_size=draft_size))
+            except (ImageTooLargeError, OSError) as e:
+                st.error(decode_error(source, e))
+                st.stop()
+        return decoded[0]
+    return image
+
+def classify_upload(model, image, key, model_id, digest=None, kind="single"):
+    # image is a callable returning the decoded upload, only called on a cache miss
+    started = time.perf_counter()
+    prediction, embedding, source = lookup_or_predict(model, image, key, model_id)
+    if prediction is not None:
+        record_prediction(kind, key, prediction, source, digest, model_id, (time.perf_counter() - started) * 1000,
+                          metrics.current_stages())
+    return prediction, embedding
+
+def lookup_or_predict(model, image, key, model_id):
+    # Exact re-uploads hit the prediction cache; re-encoded or resized copies hit the near-duplicate index
+    prediction_cache = get_prediction_cache()
+    prediction = prediction_cache.get(key)
+    with_embeddings = supports_embeddings(model)
+    embedding = get_embedding_cache().get(key) if with_embeddings and prediction is not None else None
+    # Only the similar-snacks panel needs the embedding; a hit that lost it runs the model again when there is a gallery
+    gallery = get_embedding_indexes(model_id)[0] if with_embeddings else None
+    if prediction is not None and (embedding is not None or gallery is None or len(gallery) == 0):
+        return prediction, embedding, "cache"
+
+    resized = image().resize(IMAGE_SIZE)
+    if with_embeddings and (NEAR_DUPLICATE_REUSE or RECORD_UPLOADS):
+        image_hash, colors = dhash(resized), color_signature(resized)
+    if with_embeddings and NEAR_DUPLICATE_REUSE:
+        with metrics.stage("near_duplicate"):
+            for index in get_embedding_indexes(model_id):
+                row = index.find_near_duplicate(image_hash, colors) if index is not None else None
+                if row is not None:
+                    entry = index.entry(row)
+                    if prediction is not None:
+                        return prediction, entry["embedding"], "cache"
+                    prediction = entry["prediction"]
+                    prediction_cache.put(key, prediction)
+                    return prediction, entry["embedding"], "near_duplicate"
+
+    embeddings = None
+    try:
+        with inference_slot():
+            with batch_pool.batch(1) as batch:
+                with metrics.stage("preprocess"):
+                    fill_batch(batch, [resized])
+                with metrics.stage("inference"):
+                    if with_embeddings:
+                        predictions, embeddings = model.predict_with_embeddings(batch)
+                    else:
+                        predictions = model.predict(batch, verbose=0)
+    except Overloaded as e:
+        st.warning(f"{BUSY_MESSAGE} ({e})")
+        return None, None, None
     except Exception as e:
         st.error(f"Error during prediction: {str(e)}")
-        return None
+        return None, None, None
+    prediction_cache.put(key, predictions[0])
+    if embeddings is None:
+        return predictions[0], None, "model"
+    get_embedding_cache().put(key, embeddings[0])
+    if RECORD_UPLOADS:
+        get_embedding_indexes(model_id)[1].add(embeddings, predictions, [image_hash], colors=[colors])
+    return predictions[0], embeddings[0], "model"
 
-def create_prediction_chart(prediction, class_names):
-    # Get top 5 predictions
-    top_indices = np.argsort(prediction)[-5:][::-1]
-    top_classes = [class_names[i].replace('_', ' ').title() for i in top_indices]
-    top_scores = [prediction[i] * 100 for i in top_indices]
-    
-    df = pd.DataFrame({
-        'Snack': top_classes,
-        'Confidence (%)': top_scores
-    })
-    
-    fig = px.bar(df, x='Confidence (%)', y='Snack', orientation='h',
-                 title='Top 5 Predictions',
-                 color='Confidence (%)',
-                 color_continuous_scale='viridis')
-    fig.update_layout(height=400, showlegend=False)
-    return fig
+def render_similar_snacks(embedding, model_id):
+    gallery = get_embedding_indexes(model_id)[0]
+    if gallery is None or len(gallery) == 0:
+        return
+    with metrics.stage("similar_search"):
+        scores, rows = gallery.search(embedding, k=SIMILAR_SNACKS, n_probe=8)
+    with st.expander("🔍 Visually similar snacks"):
+        columns = st.columns(SIMILAR_SNACKS)
+        for column, score, row in zip(columns, scores[0], rows[0]):
+            if row < 0:
+                continue
+            entry = gallery.entry(row)
+            caption = f"{(entry['label'] or 'unknown').replace('_', ' ').title()} ({score * 100:.0f}% similar)"
+            with column:
+                if entry["source"] and os.path.exists(entry["source"]):
+                    st.image(load_image(entry["source"], draft_size=THUMBNAIL_SIZE), caption=caption,
+                             use_container_width=True)
+                else:
+                    st.markdown(caption)
+
+def show_prediction_card(predicted_label, confidence, container=st):
+    container.markdown(
+        f"""
+        <div class="prediction-card">
+            <div class="prediction-title">{predicted_label.replace('_', ' ')}</div>
+            <div class="confidence-score">Confidence: {confidence:.1f}%</div>
+        </div>
+        """,
+        unsafe_allow_html=True
+    )
+
+def show_prediction_chart(prediction, key=None):
+    with metrics.stage("chart"):
+        if CHART_RENDERER == "plotly":
+            st.plotly_chart(create_prediction_chart(prediction, CLASS_NAMES), use_container_width=True, key=key)
+        else:
+            st.vega_lite_chart(prediction_chart_spec(prediction, CLASS_NAMES), use_container_width=True, key=key)
+
+def predict_batch(model, images, max_batch_size=MAX_BATCH_SIZE):
+    # Yield predictions chunk by chunk so the UI can render results as they finish
+    for start in range(0, len(images), max_batch_size):
+        chunk = images[start:start + max_batch_size]
+        with inference_slot(f"Classifying {len(chunk)} images..."), batch_pool.batch(len(chunk)) as batch:
+            with metrics.stage("preprocess"):
+                fill_batch(batch, chunk)
+            with metrics.stage("inference"):
+                predictions = model.predict(batch, batch_size=len(chunk), verbose=0)
+        yield start, predictions
+
+def render_batch_mode():
+    st.markdown("### Upload Your Snack Images")
+    uploaded_files = st.file_uploader(
+        "Choose image files",
+        type=["jpg", "jpeg", "png"],
+        accept_multiple_files=True,
+        help="Upload a tray of snack photos to classify them together"
+    )
+    if not uploaded_files:
+        return
+
+    metrics.begin_request("batch", images=len(uploaded_files))
+    model, model_id = download_and_load_model()
+    if model is None:
+        return
+
+    prediction_cache = get_prediction_cache()
+    progress = st.progress(0.0, text=f"Classifying {len(uploaded_files)} images...")
+    done = 0
+
+    for chunk_start in range(0, len(uploaded_files), MAX_BATCH_SIZE):
+        chunk_files = uploaded_files[chunk_start:chunk_start + MAX_BATCH_SIZE]
+        digests = [content_digest(f.getvalue()) for f in chunk_files]
+        keys = [cache_key(f.getvalue(), model_id, digest) for f, digest in zip(chunk_files, digests)]
+        predictions = [prediction_cache.get(key) for key in keys]
+        latencies = {}
+        thumbnails = []
+        failed = {}
+        pending_images, pending_slots = [], []
+
+        for slot, (uploaded, prediction) in enumerate(zip(chunk_files, predictions)):
+            # Nothing to decode on a rerun: prediction and thumbnail are both cached
+            thumbnail = get_preview_cache().get(digests[slot], THUMBNAIL_SIZE)
+            if prediction is not None and thumbnail is not None:
+                thumbnails.append(thumbnail)
+                continue
+            try:
+                with metrics.stage("decode"):
+                    image = load_image(uploaded, draft_size=THUMBNAIL_SIZE)
+            except (ImageTooLargeError, OSError) as e:
+                # Satu file rusak tidak menggagalkan seluruh batch
+                failed[slot] = decode_error(uploaded, e)
+                thumbnails.append(None)
+                continue
+            if prediction is None:
+                pending_images.append(image.resize(IMAGE_SIZE))
+                pending_slots.append(slot)
+            # Simpan thumbnail saja, gambar resolusi penuh langsung dilepas
+            thumbnails.append(thumbnail or get_preview_cache().put(digests[slot], THUMBNAIL_SIZE, image))
+
+        if pending_images:
+            try:
+                started = time.perf_counter()
+                for offset, batch_predictions in predict_batch(model, pending_images):
+                    # Each image is charged an equal share of its forward pass
+                    latency_ms = (time.perf_counter() - started) * 1000 / len(batch_predictions)
+                    for j, prediction in enumerate(batch_predictions):
+                        slot = pending_slots[offset + j]
+                        predictions[slot] = prediction
+                        latencies[slot] = latency_ms
+                        prediction_cache.put(keys[slot], prediction)
+                    started = time.perf_counter()
+            except Overloaded as e:
+                st.warning(f"{BUSY_MESSAGE} ({e})")
+                return
+            except Exception as e:
+                st.error(f"Error during prediction: {str(e)}")
+                return
+
+        for slot, (uploaded, prediction) in enumerate(zip(chunk_files, predictions)):
+            if slot in failed:
+                st.markdown("---")
+                st.error(failed[slot])
+                continue
+            # Stage timings cover the whole batch, so they are not attached to single images
+            record_prediction("batch", keys[slot], prediction, "model" if slot in latencies else "cache",
+                              digests[slot], model_id, latencies.get(slot))
+            index = chunk_start + slot
+            predicted_index = np.argmax(prediction)
+            predicted_label = CLASS_NAMES[predicted_index]
+            confidence = prediction[predicted_index] * 100
+
+            st.markdown("---")
+            img_col, result_col = st.columns([1, 2])
+            with img_col:
+                st.image(thumbnails[slot], caption=uploaded.name, output_format="JPEG", use_container_width=True)
+            with result_col:
+                st.markdown(f"**{predicted_label.replace('_', ' ').title()}** "
+                            f"— Confidence: {confidence:.1f}%")
+                show_prediction_chart(prediction, key=f"batch_chart_{index}")
+
+        done += len(chunk_files)
+        progress.progress(done / len(uploaded_files),
+                          text=f"Classified {done} of {len(uploaded_files)} images")
+
+def render_camera():
+    # Each snapshot is one rerun; the EMA lives in the session so the label settles over snapshots
+    snapshot = st.camera_input("Point the camera at a snack")
+    smoother = st.session_state.setdefault("camera_smoother", PredictionSmoother())
+    if st.button("Reset smoothing"):
+        smoother.reset()
+        st.session_state.pop("camera_snapshot", None)
+    if not snapshot:
+        return
+
+    metrics.begin_request("camera", upload_bytes=snapshot.size)
+    try:
+        with metrics.stage("decode"):
+            image = load_image(snapshot, draft_size=PREVIEW_SIZE)
+    except (ImageTooLargeError, OSError) as e:
+        st.error(decode_error(snapshot, e))
+        return
+    model, model_id = download_and_load_model()
+    if model is None:
+        return
+    digest = content_digest(snapshot.getvalue())
+    key = cache_key(snapshot.getvalue(), model_id, digest)
+    prediction, _ = classify_upload(model, lambda: image, key, model_id, digest, kind="camera")
+    if prediction is None:
+        return
+    # Reruns from other widgets bring back the same snapshot; count it once
+    if st.session_state.get("camera_snapshot") != key:
+        smoother.update(prediction)
+        st.session_state["camera_snapshot"] = key
+    smoothed = smoother.value
+    predicted_index = np.argmax(smoothed)
+    show_prediction_card(CLASS_NAMES[predicted_index], smoothed[predicted_index] * 100)
+    st.caption(f"This snapshot alone: {CLASS_NAMES[np.argmax(prediction)].replace('_', ' ').title()} "
+               f"({prediction.max() * 100:.1f}%)")
+    show_prediction_chart(smoothed, key="camera_chart")
+
+def render_video():
+    video_file = st.file_uploader(
+        "Choose a video",
+        type=list(VIDEO_TYPES),
+        help="Frames are sampled as fast as the model keeps up with playback and smoothed over time"
+    )
+    if not video_file:
+        return
+    model, model_id = download_and_load_model()
+    if model is None:
+        return
+
+    data = video_file.getvalue()
+    key = cache_key(data, model_id)
+    result = st.session_state.get("live_video")
+    if result is None or result["key"] != key:
+        metrics.begin_request("video", upload_bytes=video_file.size)
+        frame_col, label_col = st.columns([1, 2])
+        frame_view, label_view = frame_col.empty(), label_col.empty()
+        progress = st.progress(0.0, text="Classifying video frames...")
+        timestamps, smoothed = [], []
+        started = time.perf_counter()
+        try:
+            with open_video(data, video_file.name) as video:
+                scheduler = FrameScheduler(video.fps)
+                frames = classify_video(model, video, scheduler=scheduler,
+                                        slot=lambda: inference_slot("Classifying video frames..."))
+                for batch_timestamps, _, batch_smoothed in frames:
+                    timestamps.extend(batch_timestamps)
+                    smoothed.extend(batch_smoothed)
+                    predicted_index = np.argmax(batch_smoothed[-1])
+                    show_prediction_card(CLASS_NAMES[predicted_index], batch_smoothed[-1][predicted_index] * 100,
+                                         container=label_view)
+                    frame_view.caption(f"⏱️ {batch_timestamps[-1]:.1f}s, classifying every "
+                                       f"{scheduler.stride}th frame")
+                    if video.frame_count > 0:
+                        progress.progress(min(1.0, scheduler.seen / video.frame_count),
+                                          text=f"Frame {scheduler.seen} of {video.frame_count}")
+        except Overloaded as e:
+            st.warning(f"{BUSY_MESSAGE} ({e})")
+            return
+        except Exception as e:
+            st.error(f"Error during prediction: {str(e)}")
+            return
+        finally:
+            progress.empty()
+            frame_view.empty()
+            label_view.empty()
+        if not smoothed:
+            st.error("No frames could be read from this video.")
+            return
+        elapsed = time.perf_counter() - started
+        stats = scheduler.stats()
+        result = {
+            "key": key,
+            "timestamps": np.array(timestamps),
+            "smoothed": np.stack(smoothed),
+            "stats": stats,
+            # Video seconds covered per second of processing; >= 1 means the model kept up with playback
+            "speed": stats["seen"] / stats["fps"] / elapsed,
+        }
+        st.session_state["live_video"] = result
+
+    final = result["smoothed"][-1]
+    predicted_index = np.argmax(final)
+    show_prediction_card(CLASS_NAMES[predicted_index], final[predicted_index] * 100)
+    stats = result["stats"]
+    st.caption(f"Classified {stats['sampled']} of {stats['seen']} frames "
+               f"(final stride {stats['stride']}) at {result['speed']:.1f}x real time")
+    with metrics.stage("chart"):
+        st.vega_lite_chart(timeline_chart_spec(result["timestamps"], result["smoothed"], CLASS_NAMES),
+                           use_container_width=True)
+
+def render_live_mode():
+    st.markdown("### Live Recognition")
+    source = st.radio("Source", ["Camera", "Video file"], horizontal=True)
+    if source == "Camera":
+        render_camera()
+    else:
+        render_video()
+
+def render_platter_mode():
+    st.markdown("### Upload a Platter Photo")
+    uploaded = st.file_uploader(
+        "Choose an image file",
+        type=["jpg", "jpeg", "png"],
+        help="A tray with several different snacks; each one is found and labelled"
+    )
+    if not uploaded:
+        return
+    model, model_id = download_and_load_model()
+    if model is None:
+        return
+
+    key = cache_key(uploaded.getvalue(), model_id)
+    result = st.session_state.get("platter")
+    if result is None or result["key"] != key:
+        metrics.begin_request("platter", upload_bytes=uploaded.size)
+        try:
+            with metrics.stage("decode"):
+                image = load_image(uploaded, draft_size=PLATTER_SIZE)
+        except (ImageTooLargeError, OSError) as e:
+            st.error(decode_error(uploaded, e))
+            return
+        started = time.perf_counter()
+        try:
+            with metrics.stage("tiles"):
+                detection = detect(model, image, slot=lambda: inference_slot("Looking for snacks..."))
+        except Overloaded as e:
+            st.warning(f"{BUSY_MESSAGE} ({e})")
+            return
+        except Exception as e:
+            st.error(f"Error during prediction: {str(e)}")
+            return
+        # Hanya overlay seukuran preview yang disimpan, sudah di-encode, bukan foto aslinya
+        result = {"key": key, "detection": detection, "seconds": time.perf_counter() - started,
+                  "overlay": encode_preview(overlay(image, detection), preview_size(PREVIEW_SIZE))}
+        st.session_state["platter"] = result
+
+    detection = result["detection"]
+    st.image(result["overlay"], caption=uploaded.name, output_format="JPEG", use_container_width=True)
+    st.caption(f"Classified {detection['classified']} of {detection['tiles']} tiles in one pass "
+               f"({detection['tiles'] - detection['classified']} skipped as background or over the limit) "
+               f"in {result['seconds'] * 1000:.0f} ms")
+    if not detection["snacks"]:
+        st.info("No snack was recognised with enough confidence. Try a closer or better lit photo.")
+        return
+    st.markdown("#### Snacks on this platter")
+    for label, confidence in sorted(detection["snacks"].items(), key=lambda item: -item[1]):
+        regions = sum(region["label"] == label for region in detection["regions"])
+        st.markdown(f"- **{label.replace('_', ' ').title()}**: {confidence * 100:.1f}%"
+                    + (f" ({regions} places)" if regions > 1 else ""))
 
 # ========================
 # Main App Interface
@@ -488,6 +960,15 @@ with st.sidebar:
     - Includes recipe ingredients
     """)
     
+    st.markdown("## Mode")
+    mode = st.radio(
+        "Mode",
+        [SINGLE_MODE, BATCH_MODE, LIVE_MODE, PLATTER_MODE],
+        label_visibility="collapsed",
+        help=f"Batch mode classifies many images at once, up to {MAX_BATCH_SIZE} per forward pass; "
+             "live mode follows a camera or a video; platter mode finds several snacks in one photo"
+    )
+    
     st.markdown("## Supported Snacks")
     for idx, snack in enumerate(CLASS_NAMES, 1):
         st.markdown(f"{idx}. {snack.replace('_', ' ').title()}")
@@ -502,50 +983,60 @@ with st.sidebar:
     """)
 
 # Main content area
-col1, col2 = st.columns([1, 1])
+if mode == BATCH_MODE:
+    render_batch_mode()
+    uploaded_file = None
+elif mode == LIVE_MODE:
+    render_live_mode()
+    uploaded_file = None
+elif mode == PLATTER_MODE:
+    render_platter_mode()
+    uploaded_file = None
+else:
+    col1, col2 = st.columns([1, 1])
 
-with col1:
-    st.markdown('<div class="upload-section">', unsafe_allow_html=True)
-    st.markdown("### Upload Your Snack Image")
-    uploaded_file = st.file_uploader(
-        "Choose an image file", 
-        type=["jpg", "jpeg", "png"],
-        help="Upload a clear image of a traditional Indonesian snack"
-    )
-    st.markdown('</div>', unsafe_allow_html=True)
+    with col1:
+        st.markdown('<div class="upload-section">', unsafe_allow_html=True)
+        st.markdown("### Upload Your Snack Image")
+        uploaded_file = st.file_uploader(
+            "Choose an image file", 
+            type=["jpg", "jpeg", "png"],
+            help="Upload a clear image of a traditional Indonesian snack"
+        )
+        st.markdown('</div>', unsafe_allow_html=True)
     
-    if uploaded_file:
-        image = Image.open(uploaded_file).convert("RGB")
-        st.image(image, caption="Uploaded Image", use_container_width=True)
-
-with col2:
-    if uploaded_file:
-        with st.spinner("Analyzing your image..."):
-            model = download_and_load_model()
+        if uploaded_file:
+            metrics.begin_request("single", upload_bytes=uploaded_file.size)
+            image_bytes = uploaded_file.getvalue()
+            digest = content_digest(image_bytes)
+            image = lazy_image(uploaded_file)
+            with metrics.stage("preview"):
+                preview = preview_bytes(digest, image)
+            st.image(preview, caption="Uploaded Image", output_format="JPEG", use_container_width=True)
+
+    with col2:
+        if uploaded_file:
+            model, model_id = download_and_load_model()
             
             if model is not None:
-                prediction = predict_image(model, image)
-                
+                # Rerun karena interaksi widget tidak perlu inferensi ulang
+                key = cache_key(image_bytes, model_id, digest)
+                prediction, embedding = classify_upload(model, image, key, model_id, digest)
+            
                 if prediction is not None:
                     predicted_index = np.argmax(prediction)
                     predicted_label = CLASS_NAMES[predicted_index]
                     confidence = prediction[predicted_index] * 100
-                    
+                
                     # Main prediction result
-                    st.markdown(
-                        f"""
-                        <div class="prediction-card">
-                            <div class="prediction-title">{predicted_label.replace('_', ' ')}</div>
-                            <div class="confidence-score">Confidence: {confidence:.1f}%</div>
-                        </div>
-                        """, 
-                        unsafe_allow_html=True
-                    )
-                    
+                    show_prediction_card(predicted_label, confidence)
+                
                     # Prediction chart
                     if st.checkbox("📊 Show detailed predictions", value=True):
-                        fig = create_prediction_chart(prediction, CLASS_NAMES)
-                        st.plotly_chart(fig, use_container_width=True)
+                        show_prediction_chart(prediction)
+
+                    if embedding is not None:
+                        render_similar_snacks(embedding, model_id)
 
 # Additional Information Section
 if uploaded_file and 'predicted_label' in locals():
@@ -576,8 +1067,61 @@ if uploaded_file and 'predicted_label' in locals():
     else:
         st.info("Historical information and ingredients for this snack will be added soon!")
 
+# Prediction cache statistics (rendered last so the counters include this run)
+with st.sidebar:
+    st.markdown("---")
+    st.markdown("## Prediction Cache")
+    cache_stats = get_prediction_cache().stats()
+    st.markdown(f"""
+    - Hits: {cache_stats['hits']} ({cache_stats['disk_hits']} from disk)
+    - Misses: {cache_stats['misses']}
+    - Hit rate: {cache_stats['hit_rate'] * 100:.1f}%
+    - Entries: {cache_stats['entries']} (evicted: {cache_stats['evictions']})
+    """)
+    preview_stats = get_preview_cache().stats()
+    st.markdown(f"**Previews:** {preview_stats['entries']} encoded ({preview_stats['mb']:.1f} MB), "
+                f"{preview_stats['hit_rate'] * 100:.0f}% reused")
+
+    st.markdown("## Inference Queue")
+    queue_stats = get_admission_controller().stats()
+    st.markdown(f"""
+    - Running: {queue_stats['running']}, waiting: {queue_stats['queued']}
+    - Served: {queue_stats['admitted']}
+    - Turned away: {queue_stats['shed'] + queue_stats['timeouts']}
+    """)
+    active_model = get_model_loader().active
+    if active_model is not None and active_model.version:
+        st.markdown(f"**Model version:** {active_model.version}")
+    if active_model is not None and hasattr(active_model.model, "cascade_stats"):
+        cascade_stats = active_model.model.cascade_stats()
+        st.markdown(f"**Cascade:** {cascade_stats['escalation_rate'] * 100:.0f}% of {cascade_stats['images']} "
+                    f"images escalated to ResNet50 (threshold {cascade_stats['threshold']:.2f})")
+
+    # Debug panel, only when METRICS_ENABLED=1
+    last_trace = metrics.end_request()
+    if metrics.ENABLED:
+        with st.expander("⏱️ Request timings"):
+            if last_trace is not None:
+                st.markdown("**This run:** " + ", ".join(
+                    f"{name} {ms:.0f} ms" for name, ms in last_trace["stages_ms"].items()
+                ) + f" — total {last_trace['total_ms']:.0f} ms")
+            st.markdown("| stage | count | p50 ms | p95 ms | p99 ms |\n|---|---|---|---|---|\n" + "\n".join(
+                f"| {name} | {stats['count']} | {stats['p50_ms']:.1f} | {stats['p95_ms']:.1f} | {stats['p99_ms']:.1f} |"
+                for name, stats in metrics.registry.summary().items()
+            ))
+
+    memory_guard = get_memory_guard()
+    memory_guard.check(st.session_state, SESSION_SHRINKERS)
+    memory_stats = memory_guard.stats()
+    st.markdown("## Memory")
+    st.markdown(f"- Process RSS: {memory_stats['rss_mb']:.0f} MB" + (
+        f"\n- TensorFlow allocator: {memory_stats['tf_mb']:.0f} MB" if memory_stats["tf_mb"] is not None else ""))
+    if memory_guard.last_report is not None:
+        with st.expander("🧠 Last memory report"):
+            st.code(memory_guard.last_report, language=None)
+
 # Welcome message for first-time users
-if not uploaded_file:
+if not uploaded_file and mode == SINGLE_MODE:
     st.markdown("---")
     st.markdown("## Get Started")
     
@@ -0,0 +1,216 @@
+"""Headless batch scoring for directories and tar archives of snack images.
+
+Example:
+    python batch_score.py photos/ archive-2023.tar.gz -o scores.jsonl --top-k 3
+
+Images are streamed through decode -> preprocess -> predict, so memory stays
+bounded by the batch size regardless of how many images are scored. Results are
+flushed after every batch; rerunning the same command skips images that already
+have a row in the output file.
+"""
+import argparse
+import csv
+import json
+import os
+import queue
+import sys
+import tarfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from classifier import MAX_BATCH_SIZE, MODEL_PATH, batch_pool, decode_image, fill_batch, load_classifier, top_k
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def iter_directory(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(dirpath, filename)
+                yield path, lambda path=path: open(path, "rb").read()
+
+
+def iter_tar(archive_path):
+    # Mode "r|*" membaca tar secara streaming, tanpa index seluruh arsip di memori
+    with tarfile.open(archive_path, "r|*") as archive:
+        for member in archive:
+            if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                data = archive.extractfile(member).read()
+                yield f"{archive_path}:{member.name}", lambda data=data: data
+
+
+def iter_sources(sources, done):
+    for source in sources:
+        items = iter_directory(source) if os.path.isdir(source) else iter_tar(source)
+        for image_id, read in items:
+            if image_id not in done:
+                yield image_id, read
+
+
+def parallel_decode(items, workers):
+    # PIL melepas GIL saat decode, jadi thread pool cukup untuk paralelisme
+    max_in_flight = workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for image_id, read in items:
+            pending.append((image_id, pool.submit(lambda read=read: decode_image(read()))))
+            if len(pending) >= max_in_flight:
+                yield _result(*pending.popleft())
+        while pending:
+            yield _result(*pending.popleft())
+
+
+def _result(image_id, future):
+    try:
+        return image_id, future.result(), None
+    except Exception as e:
+        return image_id, None, str(e)
+
+
+def iter_batches(decoded, batch_size):
+    batch = []
+    for item in decoded:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(iterable, depth):
+    # Run the decode pipeline in a background thread while the model is busy
+    buffer = queue.Queue(maxsize=depth)
+    sentinel = object()
+
+    def producer():
+        try:
+            for item in iterable:
+                buffer.put(item)
+        except BaseException as e:
+            buffer.put(e)
+        buffer.put(sentinel)
+
+    threading.Thread(target=producer, daemon=True).start()
+    while True:
+        item = buffer.get()
+        if item is sentinel:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+class ResultWriter:
+    """Append-only CSV/JSONL writer that remembers which images are already scored."""
+
+    def __init__(self, path, k):
+        self.path = path
+        self.k = k
+        self.format = "csv" if path.lower().endswith(".csv") else "jsonl"
+        self.header = ["path", "error"] + [
+            f"{field}_{rank}" for rank in range(1, k + 1) for field in ("label", "score")
+        ]
+        self.done = self._load_done()
+        self._file = open(path, "a", newline="")
+        self._csv = csv.writer(self._file) if self.format == "csv" else None
+        if self._csv is not None and self._file.tell() == 0:
+            self._csv.writerow(self.header)
+
+    def _load_done(self):
+        if not os.path.exists(self.path):
+            return set()
+        self._truncate_partial_line()
+        done = set()
+        with open(self.path, newline="") as f:
+            if self.format == "csv":
+                for row in csv.DictReader(f):
+                    done.add(row["path"])
+            else:
+                for line in f:
+                    done.add(json.loads(line)["path"])
+        return done
+
+    def _truncate_partial_line(self):
+        # Proses yang mati di tengah penulisan bisa meninggalkan baris terpotong
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def write(self, image_id, prediction=None, error=None):
+        ranked = top_k(prediction, self.k) if prediction is not None else []
+        if self._csv is not None:
+            row = [image_id, error or ""]
+            for label, score in ranked:
+                row += [label, f"{score:.6f}"]
+            self._csv.writerow(row)
+        else:
+            record = {"path": image_id, "top_k": [
+                {"label": label, "score": round(score, 6)} for label, score in ranked
+            ]}
+            if error:
+                record["error"] = error
+            self._file.write(json.dumps(record) + "\n")
+        self.done.add(image_id)
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def score(model, sources, writer, batch_size=MAX_BATCH_SIZE, workers=4, prefetch_batches=2):
+    items = iter_sources(sources, writer.done)
+    batches = prefetch(iter_batches(parallel_decode(items, workers), batch_size), prefetch_batches)
+    scored = failed = 0
+
+    for batch in batches:
+        ok = [(image_id, array) for image_id, array, error in batch if error is None]
+        for image_id, _, error in batch:
+            if error is not None:
+                writer.write(image_id, error=error)
+                failed += 1
+        if ok:
+            with batch_pool.batch(len(ok)) as arrays:
+                fill_batch(arrays, [array for _, array in ok])
+                predictions = model.predict(arrays, batch_size=len(ok), verbose=0)
+            for (image_id, _), prediction in zip(ok, predictions):
+                writer.write(image_id, prediction)
+            scored += len(ok)
+        writer.flush()
+        print(f"scored={scored} failed={failed}", file=sys.stderr, flush=True)
+
+    return scored, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score snack images offline with the ResNet50 classifier")
+    parser.add_argument("sources", nargs="+", help="image directories or tar archives")
+    parser.add_argument("-o", "--output", required=True, help="output file (.csv or .jsonl)")
+    parser.add_argument("--model", default=MODEL_PATH, help="path to the .keras model")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4,
+                        help="parallel decode threads")
+    parser.add_argument("--prefetch", type=int, default=2, help="batches decoded ahead of the model")
+    args = parser.parse_args(argv)
+
+    writer = ResultWriter(args.output, args.top_k)
+    if writer.done:
+        print(f"resuming: {len(writer.done)} images already scored", file=sys.stderr)
+    model = load_classifier(args.model)
+    try:
+        scored, failed = score(model, args.sources, writer, args.batch_size, args.workers, args.prefetch)
+    finally:
+        writer.close()
+    print(f"done: scored={scored} failed={failed}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
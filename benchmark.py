@@ -0,0 +1,356 @@
+"""Benchmark suite for the classification hot path.
+
+Times every stage of a request on its own and end to end, on a fixed set of
+synthetic images (and optionally real ones), and compares against a stored
+JSON baseline.
+
+    python benchmark.py --save-baseline benchmarks/baseline.json
+    python benchmark.py --compare benchmarks/baseline.json --threshold 0.15
+
+Exits with status 1 when a stage's p50 regresses by more than --threshold.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from charts import _chart_spec, create_prediction_chart, prediction_chart_spec
+from classifier import CLASS_NAMES, IMAGE_SIZE, MODEL_PATH, batch_pool, fill_batch, load_image, top_k, top_k_indices
+from preview import PreviewCache, encode_preview
+from tiling import PLATTER_SIZE, detect, tiles
+
+RESOLUTIONS = [(640, 480), (1920, 1080), (4032, 3024)]
+BATCH_SIZES = [1, 8, 32, 64]
+SEED = 1234
+# Browser "Fast 3G" throttling, roughly a phone on a weak mobile signal
+SLOW_LINK_MBPS = 1.6
+# What the app decodes an upload to, and what the single-image preview is shown at
+PREVIEW_SIZE = (1024, 1024)
+PREVIEW_DISPLAY_SIZE = (800, 800)
+
+
+def synthetic_images(resolutions=RESOLUTIONS, seed=SEED):
+    # Gradient plus noise compresses like a photo, unlike pure noise
+    rng = np.random.default_rng(seed)
+    images = {}
+    for width, height in resolutions:
+        y, x = np.mgrid[0:height, 0:width]
+        base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+        noise = rng.integers(-20, 20, size=(height, width, 3))
+        pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+        for fmt in ("JPEG", "PNG"):
+            buffer = io.BytesIO()
+            Image.fromarray(pixels).save(buffer, format=fmt, quality=90)
+            images[f"synthetic_{width}x{height}.{fmt.lower()}"] = buffer.getvalue()
+    return images
+
+
+def real_images(directory):
+    images = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(directory, filename), "rb") as f:
+                images[f"real_{filename}"] = f.read()
+    return images
+
+
+def measure(fn, repeat, warmup=2, items=1):
+    for _ in range(warmup):
+        fn()
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples[i] = time.perf_counter() - started
+    p50, p95, p99 = np.percentile(samples * 1000, [50, 95, 99])
+    return {
+        "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+        "mean_ms": samples.mean() * 1000,
+        "throughput_per_s": items / samples.mean(),
+        "repeat": repeat,
+    }
+
+
+def decode(data):
+    return Image.open(io.BytesIO(data)).convert("RGB")
+
+
+def to_array(image):
+    return np.expand_dims(np.array(image), axis=0)
+
+
+def bench_image_stages(name, data, repeat, model=None):
+    image = decode(data)
+    results = {
+        f"decode/{name}": measure(lambda: decode(data), repeat),
+        f"resize/{name}": measure(lambda: image.resize(IMAGE_SIZE), repeat),
+    }
+    if model is not None:
+        def end_to_end():
+            # The app's path: draft decode, pooled uint8 batch, in-graph preprocessing
+            with batch_pool.batch(1) as batch:
+                fill_batch(batch, [load_image(data)])
+                top_k(model.predict(batch, verbose=0)[0])
+        results[f"end_to_end/{name}"] = measure(end_to_end, repeat)
+    return results
+
+
+def bench_decode_paths(images, repeat, model=None):
+    # Full decode + resize (the original app path) against load_image's JPEG draft decode
+    results, parity = {}, {}
+    for name, data in images.items():
+        results[f"decode_resize_full/{name}"] = measure(lambda: decode(data).resize(IMAGE_SIZE), repeat)
+        results[f"decode_resize_draft/{name}"] = measure(lambda: load_image(data).resize(IMAGE_SIZE), repeat)
+
+        full, draft = decode(data), load_image(data)
+        full_input = np.asarray(full.resize(IMAGE_SIZE), dtype=np.int16)
+        draft_input = np.asarray(draft.resize(IMAGE_SIZE), dtype=np.int16)
+        parity[name] = {
+            # Size of the decoded RGB buffer, which dominates per-upload memory
+            "full_decoded_mb": full.width * full.height * 3 / 1e6,
+            "draft_decoded_mb": draft.width * draft.height * 3 / 1e6,
+            "mean_pixel_diff": float(np.abs(full_input - draft_input).mean()),
+        }
+        if model is not None:
+            scores = model.predict(np.stack([full_input, draft_input]).astype(np.uint8), verbose=0)
+            parity[name]["same_top1"] = bool(scores[0].argmax() == scores[1].argmax())
+            parity[name]["max_score_diff"] = float(np.abs(scores[0] - scores[1]).max())
+    return results, parity
+
+
+def fill_pooled_batch(images):
+    with batch_pool.batch(len(images)) as batch:
+        fill_batch(batch, images)
+
+
+def bench_array_stages(repeat, seed=SEED):
+    # Independent of the source resolution: everything here is already 256x256.
+    # to_array and preprocess_input are the old float32 host-side path, kept for comparison
+    from tensorflow.keras.applications.resnet50 import preprocess_input
+
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(*IMAGE_SIZE, 3), dtype=np.uint8)
+    resized = Image.fromarray(pixels)
+    array = to_array(resized)
+    return {
+        "to_array": measure(lambda: to_array(resized), repeat),
+        "preprocess_input": measure(lambda: preprocess_input(array.copy()), repeat),
+        "fill_batch_pooled/batch_1": measure(lambda: fill_pooled_batch([resized]), repeat),
+        "fill_batch_pooled/batch_32": measure(lambda: fill_pooled_batch([resized] * 32), repeat, items=32),
+    }
+
+
+def bench_inference(model, repeat, batch_sizes=BATCH_SIZES, seed=SEED):
+    rng = np.random.default_rng(seed)
+    results = {}
+    for batch_size in batch_sizes:
+        batch = rng.integers(0, 256, size=(batch_size, *IMAGE_SIZE, 3), dtype=np.uint8)
+        results[f"inference/batch_{batch_size}"] = measure(
+            lambda: model.predict(batch, batch_size=batch_size, verbose=0),
+            max(3, repeat // max(1, batch_size // 8)), items=batch_size,
+        )
+    return results
+
+
+def bench_tiling(model, images, repeat):
+    # A platter against one image of the same photo; the ratio is what tiling costs on top
+    image = load_image(images["synthetic_1920x1080.jpeg"], draft_size=PLATTER_SIZE)
+    candidates = list(tiles(image))
+
+    def single():
+        with batch_pool.batch(1) as batch:
+            fill_batch(batch, [image])
+            model.predict(batch, verbose=0)
+
+    return {
+        "tiling/single_image": measure(single, repeat),
+        "tiling/tiles_only": measure(lambda: list(tiles(image)), repeat, items=len(candidates)),
+        f"tiling/platter_{len(candidates)}_tiles": measure(lambda: detect(model, image), max(3, repeat // 4)),
+    }
+
+
+def streamlit_pil_bytes(image):
+    # What the app did on every rerun: fit the decoded upload in PREVIEW_SIZE, then st.image(pil_image)
+    # encodes it as JPEG at quality 100
+    buffer = io.BytesIO()
+    ImageOps.contain(image, PREVIEW_SIZE).save(buffer, format="JPEG", quality=100)
+    return buffer.getvalue()
+
+
+def preview_payloads(images, repeat):
+    """Per rerun: server time and bytes sent for the upload preview, before and after caching it encoded.
+
+    Time to render on a slow link is estimated as server time + transfer at
+    SLOW_LINK_MBPS + decoding the JPEG (PIL's decode standing in for the browser's).
+    """
+    results, payloads = {}, {}
+    for name, data in images.items():
+        image = load_image(io.BytesIO(data), draft_size=PREVIEW_SIZE)
+        cache = PreviewCache()
+        cache.put(name, PREVIEW_DISPLAY_SIZE, image)
+        before, after = streamlit_pil_bytes(image), cache.get(name, PREVIEW_DISPLAY_SIZE)
+        results.update({
+            f"preview/pil_rerun/{name}": measure(lambda: streamlit_pil_bytes(image), repeat),
+            f"preview/encode_once/{name}": measure(lambda: encode_preview(image, PREVIEW_DISPLAY_SIZE), repeat),
+            f"preview/cached_rerun/{name}": measure(lambda: cache.get(name, PREVIEW_DISPLAY_SIZE), repeat),
+        })
+        for variant, payload, server in (("pil_rerun", before, f"preview/pil_rerun/{name}"),
+                                         ("cached_rerun", after, f"preview/cached_rerun/{name}")):
+            decode_ms = measure(lambda: Image.open(io.BytesIO(payload)).load(), repeat)["p50_ms"]
+            transfer_ms = len(payload) * 8 / (SLOW_LINK_MBPS * 1e6) * 1000
+            payloads[f"{name}/{variant}"] = {
+                "payload_bytes": len(payload),
+                "server_ms": results[server]["p50_ms"],
+                "transfer_ms": transfer_ms,
+                "render_ms": results[server]["p50_ms"] + transfer_ms + decode_ms,
+            }
+    return results, payloads
+
+
+def bench_postprocess(repeat, seed=SEED):
+    prediction = np.random.default_rng(seed).dirichlet(np.ones(len(CLASS_NAMES))).astype(np.float32)
+
+    def vega_cold():
+        _chart_spec.cache_clear()
+        return json.dumps(prediction_chart_spec(prediction, CLASS_NAMES))
+
+    # "+json" includes the serialization Streamlit does before shipping the chart to the browser
+    return {
+        "argsort_top_k": measure(lambda: np.argsort(prediction)[-5:][::-1], repeat),
+        "argpartition_top_k": measure(lambda: top_k_indices(prediction, 5), repeat),
+        "create_prediction_chart": measure(lambda: create_prediction_chart(prediction, CLASS_NAMES), repeat),
+        "plotly_chart+json": measure(lambda: create_prediction_chart(prediction, CLASS_NAMES).to_json(), repeat),
+        "vega_chart+json/cold": measure(vega_cold, repeat),
+        "vega_chart+json/memoized": measure(
+            lambda: json.dumps(prediction_chart_spec(prediction, CLASS_NAMES)), repeat
+        ),
+    }
+
+
+def chart_payloads(seed=SEED):
+    # Bytes sent to the browser per chart, and the one-off import cost of each renderer
+    prediction = np.random.default_rng(seed).dirichlet(np.ones(len(CLASS_NAMES))).astype(np.float32)
+    imports = {}
+    for name, statement in (("plotly", "import plotly.express, pandas"), ("vega", "import charts")):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        imports[name] = time.perf_counter() - started
+    return {
+        "plotly": {"payload_bytes": len(create_prediction_chart(prediction, CLASS_NAMES).to_json()),
+                   "import_s": imports["plotly"]},
+        "vega": {"payload_bytes": len(json.dumps(prediction_chart_spec(prediction, CLASS_NAMES))),
+                 "import_s": imports["vega"]},
+    }
+
+
+def run(repeat, image_dir=None, model_path=None):
+    model = None
+    if model_path:
+        from classifier import load_classifier, warm_up
+        model = load_classifier(model_path)
+        warm_up(model)
+
+    images = synthetic_images()
+    if image_dir:
+        images.update(real_images(image_dir))
+
+    results = {}
+    for name, data in images.items():
+        results.update(bench_image_stages(name, data, repeat, model))
+    decode_results, decode_parity = bench_decode_paths(images, repeat, model)
+    results.update(decode_results)
+    results.update(bench_array_stages(repeat))
+    if model is not None:
+        results.update(bench_inference(model, repeat))
+        results.update(bench_tiling(model, images, repeat))
+    results.update(bench_postprocess(repeat))
+    preview_results, previews = preview_payloads(images, repeat)
+    results.update(preview_results)
+    return results, {"decode_parity": decode_parity, "chart_payloads": chart_payloads(), "preview_payloads": previews}
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    regressions = []
+    for stage, stats in results.items():
+        before = baseline.get("results", {}).get(stage)
+        if before is None:
+            continue
+        change = stats["p50_ms"] / before["p50_ms"] - 1
+        stats["p50_change"] = change
+        # Sub-millisecond stages are noisy; a relative jump alone is not a regression
+        if change > threshold and stats["p50_ms"] - before["p50_ms"] > min_delta_ms:
+            regressions.append((stage, before["p50_ms"], stats["p50_ms"], change))
+    return regressions
+
+
+def print_table(results):
+    print(f"{'stage':58} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'items/s':>10} {'vs base':>8}")
+    for stage, stats in results.items():
+        change = f"{stats['p50_change'] * 100:+.0f}%" if "p50_change" in stats else ""
+        print(f"{stage:58} {stats['p50_ms']:9.2f} {stats['p95_ms']:9.2f} {stats['p99_ms']:9.2f} "
+              f"{stats['throughput_per_s']:10.1f} {change:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the classification hot path")
+    parser.add_argument("--model", default=MODEL_PATH if os.path.exists(MODEL_PATH) else None,
+                        help="model to benchmark; inference stages are skipped without one")
+    parser.add_argument("--images", help="folder of real images to add to the synthetic set")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative p50 increase that counts as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5,
+                        help="ignore p50 increases smaller than this many milliseconds")
+    args = parser.parse_args(argv)
+
+    results, extras = run(args.repeat, args.images, args.model)
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.min_delta_ms)
+    print_table(results)
+    print()
+    print(f"{'draft decode parity':58} {'full MB':>9} {'draft MB':>9} {'px diff':>9} {'same top1':>10}")
+    for name, stats in extras["decode_parity"].items():
+        print(f"{name:58} {stats['full_decoded_mb']:9.1f} {stats['draft_decoded_mb']:9.1f} "
+              f"{stats['mean_pixel_diff']:9.2f} {str(stats.get('same_top1', '-')):>10}")
+    print()
+    print(f"{'chart renderer':58} {'bytes':>9} {'import s':>9}")
+    for name, stats in extras["chart_payloads"].items():
+        print(f"{name:58} {stats['payload_bytes']:9d} {stats['import_s']:9.2f}")
+    print()
+    print(f"{f'upload preview per rerun ({SLOW_LINK_MBPS} Mbit/s)':58} {'bytes':>9} {'server ms':>9} "
+          f"{'link ms':>9} {'render ms':>10}")
+    for name, stats in extras["preview_payloads"].items():
+        print(f"{name:58} {stats['payload_bytes']:9d} {stats['server_ms']:9.1f} "
+              f"{stats['transfer_ms']:9.0f} {stats['render_ms']:10.0f}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump({
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "cpu_count": os.cpu_count(),
+                "model": args.model,
+                "results": results,
+                **extras,
+            }, f, indent=2)
+
+    for stage, before, after, change in regressions:
+        print(f"REGRESSION {stage}: p50 {before:.2f} ms -> {after:.2f} ms ({change * 100:+.0f}%)",
+              file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
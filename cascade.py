@@ -0,0 +1,296 @@
+"""Confidence-gated cascade: a linear head on cheap image features answers first.
+
+The head is a softmax regression over CLASS_NAMES on features that cost a
+fraction of a millisecond: an 8x8 colour thumbnail plus 16-bin per-channel
+histograms, computed from the same uint8 batch the ResNet50 gets. It is
+trained to imitate the ResNet50 (distillation on its probabilities), so any
+folder of representative uploads works, labelled or not. When the head's top
+probability clears the calibrated threshold its answer is used; every other
+image goes on to the ResNet50.
+
+Train, calibrate and evaluate against ResNet50-only on a held-out split:
+    python cascade.py train --images data/uploads --target-agreement 0.99
+    python cascade.py evaluate --images data/holdout --threshold 0.9
+
+The head is saved next to the model as ``<model>.cascade.npz`` and used with
+CASCADE=1. The threshold is the lowest one whose cascade keeps top-1
+agreement with ResNet50-only at or above the target on the calibration
+split. Set CASCADE_THRESHOLD to override it.
+
+Similar snacks and the near-duplicate index need ResNet50 embeddings, which
+the head does not have, so the app turns both off in cascade mode.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+import metrics
+from classifier import CLASS_NAMES, MODEL_PATH
+from prediction_cache import content_digest, model_identity
+from tflite_backend import load_calibration_set
+
+logger = logging.getLogger(__name__)
+
+# Overrides the threshold calibrated at training time
+CASCADE_THRESHOLD = os.environ.get("CASCADE_THRESHOLD")
+# Minimum top-1 agreement with ResNet50-only that calibration has to keep
+TARGET_AGREEMENT = float(os.environ.get("CASCADE_TARGET_AGREEMENT", "0.99"))
+# Bump when the features or the file layout change
+ARTIFACT_VERSION = 1
+SUBSAMPLE = 4
+THUMBNAIL_GRID = 8
+HISTOGRAM_BINS = 16
+SWEEP_THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+SEED = 1234
+
+
+def artifact_path(model_path):
+    return f"{os.path.splitext(model_path)[0]}.cascade.npz"
+
+
+def cheap_features(batch):
+    """(N, 256, 256, 3) uint8 -> (N, 240) float32: an 8x8 thumbnail and per-channel histograms."""
+    batch = np.asarray(batch)
+    n, channels = len(batch), batch.shape[-1]
+    # Every 4th pixel (64x64) is plenty for both, and reading it is most of the cost
+    sample = np.ascontiguousarray(batch[:, ::SUBSAMPLE, ::SUBSAMPLE])
+    side, grid = sample.shape[1], THUMBNAIL_GRID
+    thumbnail = sample.reshape(n, grid, side // grid, grid, side // grid, channels).mean(
+        axis=(2, 4), dtype=np.float32) / 255
+    bins = sample.reshape(n, -1, channels) // (256 // HISTOGRAM_BINS)
+    offsets = (np.arange(n)[:, None, None] * channels + np.arange(channels)) * HISTOGRAM_BINS
+    histogram = np.bincount((bins + offsets).ravel(), minlength=n * channels * HISTOGRAM_BINS)
+    histogram = histogram.reshape(n, channels * HISTOGRAM_BINS).astype(np.float32) / bins.shape[1]
+    return np.concatenate([thumbnail.reshape(n, -1), histogram], axis=1)
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class LinearHead:
+    def __init__(self, mean, scale, weights, bias):
+        self.mean, self.scale, self.weights, self.bias = mean, scale, weights, bias
+
+    def predict(self, batch):
+        features = (cheap_features(batch) - self.mean) / self.scale
+        return _softmax(features @ self.weights + self.bias)
+
+    @classmethod
+    def fit(cls, batch, targets, epochs=300, learning_rate=0.05, l2=1e-3):
+        """Softmax regression onto the teacher's probabilities, full batch with Adam."""
+        features = cheap_features(batch)
+        mean, scale = features.mean(axis=0), features.std(axis=0) + 1e-6
+        features = (features - mean) / scale
+        weights = np.zeros((features.shape[1], targets.shape[1]), dtype=np.float32)
+        bias = np.zeros(targets.shape[1], dtype=np.float32)
+        params = [weights, bias]
+        moments = [[np.zeros_like(p), np.zeros_like(p)] for p in params]
+        for step in range(1, epochs + 1):
+            error = (_softmax(features @ weights + bias) - targets) / len(features)
+            gradients = [features.T @ error + l2 * weights, error.sum(axis=0)]
+            for param, gradient, (m, v) in zip(params, gradients, moments):
+                m[:] = 0.9 * m + 0.1 * gradient
+                v[:] = 0.999 * v + 0.001 * gradient ** 2
+                param -= learning_rate * (m / (1 - 0.9 ** step)) / (np.sqrt(v / (1 - 0.999 ** step)) + 1e-8)
+        return cls(mean, scale, weights, bias)
+
+
+def calibrate(confidence, agrees, target_agreement=TARGET_AGREEMENT):
+    """Lowest threshold at which the cascade keeps target_agreement with ResNet50-only.
+
+    Escalated images agree by construction, so only confident head answers
+    that disagree cost agreement.
+    """
+    order = np.argsort(-confidence, kind="stable")
+    confidence, wrong = confidence[order], np.cumsum(~agrees[order])
+    allowed = (1 - target_agreement) * len(confidence)
+    # Accepting the k most confident is only possible where the confidence changes
+    boundary = np.append(confidence[1:] < confidence[:-1], True)
+    accepted = np.nonzero(boundary & (wrong <= allowed))[0]
+    if len(accepted) == 0:
+        return 1.01  # Never answer from the head
+    return float(confidence[accepted[-1]])
+
+
+class CascadeClassifier:
+    """Head first, ResNet50 for the images the head is not confident about; same predict() as the model."""
+
+    supports_embeddings = False
+
+    def __init__(self, head, model, threshold, artifact_digest=""):
+        self.head = head
+        self.escalation_model = model
+        self.threshold = threshold
+        # Goes into the model id, so cached and recorded predictions never mix with the model's own
+        self.cascade_identity = f"{artifact_digest[:12]}-{threshold:.4f}"
+        self.images = 0
+        self.escalated = 0
+        self._lock = threading.Lock()
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        batch = np.asarray(batch)
+        with metrics.stage("cascade_head"):
+            predictions = self.head.predict(batch)
+        escalate = predictions.max(axis=1) < self.threshold
+        if escalate.any():
+            predictions[escalate] = self.escalation_model.predict(batch[escalate], batch_size=batch_size,
+                                                                  verbose=verbose)
+        with self._lock:
+            self.images += len(batch)
+            self.escalated += int(escalate.sum())
+        return predictions
+
+    def cascade_stats(self):
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "images": self.images,
+                "escalated": self.escalated,
+                "escalation_rate": self.escalated / self.images if self.images else 0.0,
+            }
+
+
+def save(head, path, threshold, model_path, report):
+    tmp_path = path + ".part.npz"
+    np.savez(tmp_path, mean=head.mean, scale=head.scale, weights=head.weights, bias=head.bias,
+             metadata=json.dumps({"version": ARTIFACT_VERSION, "source": model_identity(model_path),
+                                  "classes": CLASS_NAMES, "threshold": threshold, "report": report}))
+    os.replace(tmp_path, path)
+
+
+def load(model_path=MODEL_PATH):
+    """(head, metadata) of the current head for model_path; raises ValueError when there is none."""
+    path = artifact_path(model_path)
+    try:
+        with np.load(path) as data:
+            metadata = json.loads(str(data["metadata"]))
+            head = LinearHead(data["mean"], data["scale"], data["weights"], data["bias"])
+    except (OSError, KeyError) as e:
+        raise ValueError(f"no cascade head at {path}; train one with python cascade.py train") from e
+    if metadata.get("version") != ARTIFACT_VERSION or metadata.get("classes") != CLASS_NAMES:
+        raise ValueError(f"{path} was trained by an older version or for other classes")
+    if metadata.get("source") != model_identity(model_path):
+        raise ValueError(f"{path} was trained against a different model file")
+    return head, metadata
+
+
+def load_cascade(model, model_path=MODEL_PATH, threshold=CASCADE_THRESHOLD):
+    try:
+        head, metadata = load(model_path)
+    except ValueError as e:
+        logger.warning("%s; serving the model alone", e)
+        return model
+    threshold = float(threshold) if threshold else metadata["threshold"]
+    test = metadata["report"]["test"]
+    logger.info("cascade enabled at threshold %.3f (at %.3f on held-out images: %.0f%% escalated, "
+                "%.1f%% top-1 agreement)", threshold, test["threshold"], test["escalation_rate"] * 100,
+                test["top1_agreement"] * 100)
+    with open(artifact_path(model_path), "rb") as f:
+        artifact_digest = content_digest(f.read())
+    return CascadeClassifier(head, model, threshold, artifact_digest)
+
+
+def _per_image_ms(predict, images, repeat=1):
+    samples = []
+    for image in images:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            predict(image[None])
+        samples.append((time.perf_counter() - started) / repeat * 1000)
+    return float(np.mean(samples))
+
+
+def evaluate(head, model, images, threshold, teacher=None, timing_samples=50):
+    """Escalation rate, top-1 agreement and latency of the cascade against ResNet50-only."""
+    teacher = model.predict(images, batch_size=32, verbose=0) if teacher is None else teacher
+    probabilities = head.predict(images)
+    confident = probabilities.max(axis=1) >= threshold
+    agrees = probabilities.argmax(axis=1) == teacher.argmax(axis=1)
+    report = {
+        "samples": len(images),
+        "threshold": threshold,
+        "escalation_rate": float(1 - confident.mean()),
+        "top1_agreement": float(np.mean(~confident | agrees)),
+        "head_only_agreement": float(agrees.mean()),
+        "sweep": [{"threshold": t, "escalation_rate": float(np.mean(probabilities.max(axis=1) < t)),
+                   "top1_agreement": float(np.mean((probabilities.max(axis=1) < t) | agrees))}
+                  for t in SWEEP_THRESHOLDS],
+    }
+    # Single images, as the app sends them; warm both paths up first
+    timed = images[:timing_samples]
+    cascade = CascadeClassifier(head, model, threshold)
+    for predict in (model.predict, cascade.predict):
+        predict(timed[:1])
+    report["resnet50_ms_per_image"] = _per_image_ms(lambda b: model.predict(b, verbose=0), timed)
+    report["cascade_ms_per_image"] = _per_image_ms(cascade.predict, timed)
+    report["head_ms_per_image"] = _per_image_ms(head.predict, timed, repeat=10)
+    report["latency_saved"] = 1 - report["cascade_ms_per_image"] / report["resnet50_ms_per_image"]
+    return report
+
+
+def train(model, images, model_path=MODEL_PATH, target_agreement=TARGET_AGREEMENT, seed=SEED):
+    """Fit on 60% of images, calibrate on 20% and report on the last 20%."""
+    teacher = model.predict(images, batch_size=32, verbose=0)
+    order = np.random.default_rng(seed).permutation(len(images))
+    train_rows, calibration_rows, test_rows = np.split(order, [int(len(order) * 0.6), int(len(order) * 0.8)])
+    if min(len(train_rows), len(calibration_rows), len(test_rows)) < 20:
+        logger.warning("only %d images; the calibrated threshold will be noisy", len(images))
+
+    head = LinearHead.fit(images[train_rows], teacher[train_rows])
+    probabilities = head.predict(images[calibration_rows])
+    threshold = calibrate(probabilities.max(axis=1),
+                          probabilities.argmax(axis=1) == teacher[calibration_rows].argmax(axis=1),
+                          target_agreement)
+    report = {
+        "target_agreement": target_agreement,
+        "train_samples": len(train_rows),
+        "calibration_samples": len(calibration_rows),
+        "test": evaluate(head, model, images[test_rows], threshold, teacher[test_rows]),
+    }
+    save(head, artifact_path(model_path), threshold, model_path, report)
+    return report
+
+
+def print_report(report):
+    print(f"threshold {report['threshold']:.3f} on {report['samples']} held-out images: "
+          f"{report['escalation_rate'] * 100:.1f}% escalated, top-1 agreement {report['top1_agreement'] * 100:.1f}% "
+          f"(head alone {report['head_only_agreement'] * 100:.1f}%)")
+    print(f"per image: ResNet50 {report['resnet50_ms_per_image']:.1f} ms, cascade {report['cascade_ms_per_image']:.1f} ms "
+          f"(head {report['head_ms_per_image']:.2f} ms), {report['latency_saved'] * 100:.0f}% saved")
+    print(f"{'threshold':>10} {'escalated':>10} {'agreement':>10}")
+    for row in report["sweep"]:
+        print(f"{row['threshold']:10.2f} {row['escalation_rate'] * 100:9.1f}% {row['top1_agreement'] * 100:9.1f}%")
+
+
+def main(argv=None):
+    from classifier import load_classifier
+
+    parser = argparse.ArgumentParser(description="Train and evaluate the cascade head")
+    parser.add_argument("command", choices=("train", "evaluate"))
+    parser.add_argument("--images", required=True, help="folder of representative uploads")
+    parser.add_argument("--model", default=MODEL_PATH, help="path to the .keras model")
+    parser.add_argument("--target-agreement", type=float, default=TARGET_AGREEMENT)
+    parser.add_argument("--threshold", type=float, help="evaluate at this threshold instead of the calibrated one")
+    args = parser.parse_args(argv)
+
+    model = load_classifier(args.model, cascade=False)
+    images = load_calibration_set(args.images, limit=None)
+    if args.command == "train":
+        report = train(model, images, args.model, args.target_agreement)["test"]
+    else:
+        head, metadata = load(args.model)
+        report = evaluate(head, model, images, args.threshold or metadata["threshold"])
+    print_report(report)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,149 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from classifier import top_k_indices
+
+# "vega" builds a small Vega-Lite spec; "plotly" is the original Plotly Express figure
+CHART_RENDERER = os.environ.get("CHART_RENDERER", "vega")
+TOP_K = 5
+
+
+def create_prediction_chart(prediction, class_names):
+    # Imported here so the landing page does not pay for Plotly and pandas
+    import plotly.express as px
+    import pandas as pd
+
+    # Get top 5 predictions
+    top_indices = top_k_indices(prediction, TOP_K)
+    top_classes = [class_names[i].replace('_', ' ').title() for i in top_indices]
+    top_scores = [prediction[i] * 100 for i in top_indices]
+    
+    df = pd.DataFrame({
+        'Snack': top_classes,
+        'Confidence (%)': top_scores
+    })
+    
+    fig = px.bar(df, x='Confidence (%)', y='Snack', orientation='h',
+                 title='Top 5 Predictions',
+                 color='Confidence (%)',
+                 color_continuous_scale='viridis')
+    fig.update_layout(height=400, showlegend=False)
+    return fig
+
+
+def prediction_chart_spec(prediction, class_names, k=TOP_K):
+    """Vega-Lite spec for the same top-k bar chart, without pandas or Plotly.
+
+    Memoized on the prediction bytes, so widget reruns reuse the spec. Callers
+    must not mutate the returned dict.
+    """
+    prediction = np.ascontiguousarray(prediction, dtype=np.float32)
+    return _chart_spec(prediction.tobytes(), tuple(class_names), k)
+
+
+@lru_cache(maxsize=256)
+def _chart_spec(prediction_bytes, class_names, k):
+    prediction = np.frombuffer(prediction_bytes, dtype=np.float32)
+    values = [
+        {"Snack": class_names[i].replace('_', ' ').title(), "Confidence (%)": round(float(prediction[i]) * 100, 2)}
+        for i in top_k_indices(prediction, k)
+    ]
+    confidence = {"field": "Confidence (%)", "type": "quantitative"}
+    return {
+        "title": f"Top {len(values)} Predictions",
+        "height": 400,
+        # Data lives inside the layer: Streamlit converts top-level data to Arrow through pandas
+        "layer": [{
+            "data": {"values": values},
+            "mark": {"type": "bar", "tooltip": True},
+            "encoding": {
+                "x": confidence,
+                "y": {"field": "Snack", "type": "nominal", "sort": "-x"},
+                "color": {**confidence, "scale": {"scheme": "viridis"}, "legend": None},
+            },
+        }],
+    }
+
+
+def timeline_chart_spec(timestamps, predictions, class_names, k=3):
+    # Smoothed confidence over the video for the k snacks that ever scored highest
+    predictions = np.asarray(predictions)
+    values = [
+        {"Time (s)": round(float(t), 2), "Snack": class_names[i].replace('_', ' ').title(),
+         "Confidence (%)": round(float(p[i]) * 100, 2)}
+        for i in top_k_indices(predictions.max(axis=0), k)
+        for t, p in zip(timestamps, predictions)
+    ]
+    return {
+        "title": "Prediction Over Time",
+        "height": 300,
+        "layer": [{
+            "data": {"values": values},
+            "mark": {"type": "line", "tooltip": True},
+            "encoding": {
+                "x": {"field": "Time (s)", "type": "quantitative"},
+                "y": {"field": "Confidence (%)", "type": "quantitative", "scale": {"domain": [0, 100]}},
+                "color": {"field": "Snack", "type": "nominal"},
+            },
+        }],
+    }
+
+
+def class_distribution_spec(rows):
+    # rows from HistoryReader.class_distribution
+    values = [{"Snack": r["label"].replace('_', ' ').title(), "Predictions": r["count"],
+               "Mean confidence (%)": round(r["mean_confidence"] * 100, 1)} for r in rows]
+    return {
+        "title": "Predictions per Snack",
+        "height": 400,
+        "layer": [{
+            "data": {"values": values},
+            "mark": {"type": "bar", "tooltip": True},
+            "encoding": {
+                "x": {"field": "Predictions", "type": "quantitative"},
+                "y": {"field": "Snack", "type": "nominal", "sort": "-x"},
+                "color": {"field": "Mean confidence (%)", "type": "quantitative",
+                          "scale": {"scheme": "viridis", "domain": [0, 100]}},
+            },
+        }],
+    }
+
+
+def confidence_histogram_spec(rows):
+    # rows from HistoryReader.confidence_histogram
+    values = [{"from": r["from"] * 100, "to": r["to"] * 100, "Predictions": r["count"]} for r in rows]
+    return {
+        "title": "Top-1 Confidence",
+        "height": 300,
+        "layer": [{
+            "data": {"values": values},
+            "mark": {"type": "bar", "tooltip": True},
+            "encoding": {
+                "x": {"field": "from", "type": "quantitative", "bin": {"binned": True, "step": 5},
+                      "title": "Confidence (%)"},
+                "x2": {"field": "to"},
+                "y": {"field": "Predictions", "type": "quantitative"},
+            },
+        }],
+    }
+
+
+def latency_trend_spec(rows):
+    # rows from HistoryReader.latency_trend; one line per percentile
+    values = [{"Hour": r["hour"] * 1000, "Percentile": name, "Latency (ms)": round(r[f"{name}_ms"], 1)}
+              for r in rows for name in ("p50", "p95", "p99")]
+    return {
+        "title": "Latency per Hour",
+        "height": 300,
+        "layer": [{
+            "data": {"values": values},
+            "mark": {"type": "line", "point": True, "tooltip": True},
+            "encoding": {
+                "x": {"field": "Hour", "type": "temporal"},
+                "y": {"field": "Latency (ms)", "type": "quantitative", "scale": {"type": "log"}},
+                "color": {"field": "Percentile", "type": "nominal"},
+            },
+        }],
+    }
@@ -0,0 +1,277 @@
+import io
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import model_download
+
+# TensorFlow is imported inside the functions below so that importing this
+# module (and rendering the Streamlit landing page) stays fast.
+
+logger = logging.getLogger(__name__)
+
+# URL ke model ResNet50 (.keras)
+MODEL_URL = "https://huggingface.co/zakialfadilah/best_model_resnet50/resolve/main/best_model_resnet50.keras"
+MODEL_PATH = "best_model_resnet50.keras"
+# Optional pinned checksum; without it the SHA-256 advertised by the server is used
+MODEL_SHA256 = os.environ.get("MODEL_SHA256")
+# "keras", or a quantized TFLite variant: "tflite-dynamic", "tflite-float16", "tflite-int8"
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "keras")
+# "compiled" wraps the Keras model in a fixed-signature tf.function; "predict" uses model.predict
+SERVING_MODE = os.environ.get("SERVING_MODE", "compiled")
+SERVING_XLA = os.environ.get("SERVING_XLA", "0") == "1"
+# Answer confident images from the cheap cascade head and only run the model for the rest (see cascade.py)
+CASCADE = os.environ.get("CASCADE", "0") == "1"
+# Layer whose output is used as the image embedding; default is the input of the final Dense layer
+EMBEDDING_LAYER = os.environ.get("EMBEDDING_LAYER")
+
+# Ukuran input model dan jumlah gambar maksimum per forward pass
+IMAGE_SIZE = (256, 256)
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "32"))
+# Inference calls allowed to run at once (0: one in-process, or one per worker process)
+INFERENCE_CONCURRENCY = int(os.environ.get("INFERENCE_CONCURRENCY", "0"))
+# TensorFlow thread pools; 0 sizes intra-op to the usable CPUs and inter-op to the concurrency
+TF_INTRA_OP_THREADS = int(os.environ.get("TF_INTRA_OP_THREADS", "0"))
+TF_INTER_OP_THREADS = int(os.environ.get("TF_INTER_OP_THREADS", "0"))
+# Tolak gambar raksasa (decompression bomb) sebelum piksel di-decode
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", "100000000"))
+
+# Daftar kelas
+CLASS_NAMES = [
+    "kembang_goyang", "kerak_telor", "kue_cente", "kue_cubit", "kue_cucur",
+    "kue_gemblong", "kue_lumpur", "kue_pancong", "kue_rangi", "kue_wajik",
+    "ongol_ongol", "putu_mayang", "selendang_mayang", "uli_bakar"
+]
+
+
+def download_model(url=MODEL_URL, path=MODEL_PATH, expected_sha256=MODEL_SHA256, progress=None):
+    return model_download.fetch(url, path, expected_sha256=expected_sha256, progress=progress)
+
+
+class CompiledClassifier:
+    """Serves a Keras model through one traced tf.function instead of model.predict.
+
+    model.predict sets up a data adapter, callbacks and its predict loop on every
+    call, which costs more than the forward pass itself at batch size 1. The
+    function is traced once for a (None, 256, 256, 3) uint8 input, so single
+    images and batches of any size share the same graph.
+
+    With an embedding_model (see serving_layers.with_embeddings), a second
+    function returns the penultimate features from the same forward pass.
+    """
+
+    def __init__(self, model, jit_compile=SERVING_XLA, embedding_model=None):
+        import tensorflow as tf
+
+        signature = [tf.TensorSpec((None, *IMAGE_SIZE, 3), tf.uint8)]
+        self.model = model
+        self._serve = tf.function(
+            lambda batch: model(batch, training=False),
+            input_signature=signature,
+            jit_compile=jit_compile,
+        )
+        self._serve_embeddings = None
+        if embedding_model is not None:
+            self._serve_embeddings = tf.function(
+                lambda batch: embedding_model(batch, training=False),
+                input_signature=signature,
+                jit_compile=jit_compile,
+            )
+
+    @property
+    def supports_embeddings(self):
+        return self._serve_embeddings is not None
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        batch = np.asarray(batch, dtype=np.uint8)
+        if batch_size is None or len(batch) <= batch_size:
+            return self._serve(batch).numpy()
+        return np.concatenate([
+            self._serve(batch[start:start + batch_size]).numpy()
+            for start in range(0, len(batch), batch_size)
+        ])
+
+    def predict_with_embeddings(self, batch):
+        # Returns (predictions, embeddings), both float32
+        predictions, embeddings = self._serve_embeddings(np.asarray(batch, dtype=np.uint8))
+        return predictions.numpy(), embeddings.numpy()
+
+
+def available_cpus():
+    # CPUs this process may really use: its affinity mask, capped by a cgroup v2 CPU quota.
+    # TensorFlow's own default counts every core on the host, even in a 2-CPU container
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def configure_threading(intra_op=0, inter_op=0):
+    """Size TensorFlow's thread pools; must run before TensorFlow executes anything.
+
+    0 falls back to TF_INTRA_OP_THREADS / TF_INTER_OP_THREADS, then to
+    available_cpus() intra-op threads and one inter-op thread per concurrent inference.
+    """
+    import tensorflow as tf
+
+    intra_op = intra_op or TF_INTRA_OP_THREADS or available_cpus()
+    inter_op = inter_op or TF_INTER_OP_THREADS or INFERENCE_CONCURRENCY or 1
+    config = tf.config.threading
+    if (config.get_intra_op_parallelism_threads(), config.get_inter_op_parallelism_threads()) == (intra_op, inter_op):
+        return
+    try:
+        config.set_intra_op_parallelism_threads(intra_op)
+        config.set_inter_op_parallelism_threads(inter_op)
+    except RuntimeError:
+        logger.warning("TensorFlow is already initialized; keeping its thread pools")
+        return
+    logger.info("TensorFlow thread pools: intra_op=%d inter_op=%d", intra_op, inter_op)
+
+
+def load_classifier(path=MODEL_PATH, url=MODEL_URL, backend=INFERENCE_BACKEND, serving_mode=SERVING_MODE,
+                    intra_op_threads=0, inter_op_threads=0, cascade=CASCADE):
+    """Load the classifier for serving: predict() takes uint8 RGB (N, 256, 256, 3) batches.
+
+    Shared by the Streamlit app and the headless tools; raises instead of using st.error.
+    """
+    if not os.path.exists(path):
+        download_model(url, path)
+    configure_threading(intra_op_threads, inter_op_threads)
+    from model_artifact import load_model
+    from serving_layers import with_embeddings, with_preprocessing
+    base_model = load_model(path)
+    keras_model = model = with_preprocessing(base_model)
+    if backend != "keras":
+        from tflite_backend import load_backend
+        model = load_backend(keras_model, backend, path, num_threads=intra_op_threads)
+    if serving_mode == "compiled" and model is keras_model:
+        # Embeddings are only served by the compiled Keras path; TFLite artifacts have one output
+        embedding_model = with_preprocessing(with_embeddings(base_model, EMBEDDING_LAYER))
+        model = CompiledClassifier(keras_model, embedding_model=embedding_model)
+    if cascade:
+        from cascade import load_cascade
+        model = load_cascade(model, path)
+    return model
+
+
+def warm_up(model):
+    # One dummy inference so graph tracing (and XLA compilation) is not paid by the first real request
+    dummy = np.zeros((1, *IMAGE_SIZE, 3), dtype=np.uint8)
+    model.predict(dummy, verbose=0)
+    if supports_embeddings(model):
+        model.predict_with_embeddings(dummy)
+    # A cascade may answer the dummy from its head alone
+    escalation_model = getattr(model, "escalation_model", None)
+    if escalation_model is not None:
+        warm_up(escalation_model)
+
+
+def supports_embeddings(model):
+    return getattr(model, "supports_embeddings", False)
+
+
+def serving_backend(model):
+    # The backend that actually loaded: a TFLite variant that fails conversion or parity falls back to Keras
+    model = getattr(model, "escalation_model", model)
+    return getattr(model, "backend", "keras")
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def load_image(source, draft_size=IMAGE_SIZE, max_pixels=MAX_IMAGE_PIXELS):
+    """Open an upload as an upright RGB image, decoded no larger than needed.
+
+    For JPEGs, draft mode lets libjpeg scale by 1/2, 1/4 or 1/8 in the DCT
+    domain while keeping both sides >= draft_size, so a 12-48 MP phone photo is
+    never materialised at full resolution. Pass draft_size=None for a full decode.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    image = Image.open(source)  # hanya membaca header, belum decode piksel
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageTooLargeError(
+            f"Image is {width}x{height} pixels, above the limit of {max_pixels:,} pixels"
+        )
+    if draft_size is not None and image.format == "JPEG":
+        image.draft("RGB", draft_size)
+    # Foto dari HP sering disimpan miring dengan tag EXIF Orientation
+    image = ImageOps.exif_transpose(image)
+    return image.convert("RGB")
+
+
+def decode_image(data):
+    # Encoded JPEG/PNG bytes -> uint8 array (256, 256, 3), ready for model.predict
+    return np.asarray(load_image(data).resize(IMAGE_SIZE), dtype=np.uint8)
+
+
+def fill_batch(batch, images):
+    # Tulis gambar (PIL atau array uint8) langsung ke slot buffer, tanpa np.stack
+    for i, image in enumerate(images):
+        if isinstance(image, Image.Image) and image.size != IMAGE_SIZE:
+            image = image.resize(IMAGE_SIZE)
+        batch[i] = image
+    return batch
+
+
+class BatchBufferPool:
+    """Reusable uint8 (MAX_BATCH_SIZE, 256, 256, 3) buffers for assembling batches.
+
+    A uint8 batch is a quarter the size of the float32 batch the old
+    preprocess_input path built, and pooling means steady-state requests
+    allocate no batch arrays at all.
+    """
+
+    def __init__(self, max_batch_size=MAX_BATCH_SIZE, max_buffers=4):
+        self.max_batch_size = max_batch_size
+        self.max_buffers = max_buffers
+        self._free = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def batch(self, size):
+        if size > self.max_batch_size:
+            # Oversized batches are rare; don't let them pin a big buffer in the pool
+            yield np.empty((size, *IMAGE_SIZE, 3), dtype=np.uint8)
+            return
+        with self._lock:
+            buffer = self._free.pop() if self._free else None
+        if buffer is None:
+            buffer = np.empty((self.max_batch_size, *IMAGE_SIZE, 3), dtype=np.uint8)
+        try:
+            yield buffer[:size]
+        finally:
+            with self._lock:
+                if len(self._free) < self.max_buffers:
+                    self._free.append(buffer)
+
+    def trim(self):
+        # Buffers in use are returned as usual; only the idle ones are freed
+        with self._lock:
+            self._free.clear()
+
+
+batch_pool = BatchBufferPool()
+
+
+def top_k_indices(prediction, k=5):
+    # Partial selection of the k best, then a sort of just those k
+    k = min(k, len(prediction))
+    indices = np.argpartition(prediction, -k)[-k:]
+    return indices[np.argsort(prediction[indices])[::-1]]
+
+
+def top_k(prediction, k=5):
+    # Returns [(class_name, score), ...] sorted by descending score
+    return [(CLASS_NAMES[i], float(prediction[i])) for i in top_k_indices(prediction, k)]
@@ -0,0 +1,444 @@
+"""Persistent embedding index for similar-snack search and near-duplicate uploads.
+
+Each index is a directory of append-only, memory-mapped columns, one row per image:
+
+    vectors.f32       L2-normalised ResNet50 penultimate embeddings (N, dim)
+    predictions.f32   class probabilities (N, len(CLASS_NAMES))
+    hashes.u64        64-bit difference hash of the 256x256 model input
+    colors.f32        mean colour of each cell of a 4x4 grid (NaN for rows added without one)
+    labels.jsonl      {"label": ..., "source": ...} per row
+    centroids.npy     optional IVF coarse quantizer (see train_ivf)
+    lists.i32         IVF list of every row
+
+Adding rows appends to the files, so the index never needs a rebuild; rows
+added after train_ivf are assigned to the nearest existing centroid. With
+max_rows, the oldest rows are dropped once the index grows past it.
+
+Build a labelled reference gallery (one sub-folder per class) and query it:
+
+    python embedding_index.py add gallery_images/ --index embedding_index/gallery
+    python embedding_index.py train-ivf --index embedding_index/gallery --lists 64
+    python embedding_index.py query kue_cubit.jpg --index embedding_index/gallery
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+from PIL import Image
+
+from classifier import CLASS_NAMES
+from model_download import file_lock
+
+EMBEDDING_INDEX_DIR = os.environ.get("EMBEDDING_INDEX_DIR", "embedding_index")
+# Serving a stored prediction for a near-duplicate upload skips inference, but the grayscale hash also
+# matches a different snack shot with the same framing; off unless asked for
+NEAR_DUPLICATE_REUSE = os.environ.get("NEAR_DUPLICATE_REUSE", "0") == "1"
+# Hamming distance (of 64 bits) under which two uploads count as the same picture
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.environ.get("NEAR_DUPLICATE_MAX_DISTANCE", "0"))
+# Largest difference (0-255) in any cell of the colour grid; the hash can not tell a red gradient from a blue one
+NEAR_DUPLICATE_MAX_COLOR_DIFF = float(os.environ.get("NEAR_DUPLICATE_MAX_COLOR_DIFF", "12"))
+# Remember classified uploads so re-encoded or resized copies skip inference; only used for reuse
+RECORD_UPLOADS = os.environ.get("INDEX_RECORD_UPLOADS", "1" if NEAR_DUPLICATE_REUSE else "0") == "1"
+# The index of seen uploads keeps only this many of the newest rows
+SEEN_INDEX_MAX_ROWS = int(os.environ.get("SEEN_INDEX_MAX_ROWS", "100000"))
+# Dropping goes down to this share of max_rows, so the columns are not rewritten on every add
+PRUNE_TO = 0.9
+# Rows scored per matmul in brute-force search; bounds the temporary (queries, rows) matrix
+SEARCH_CHUNK_ROWS = 65536
+HASH_SIZE = 8
+COLOR_GRID = 4
+COLOR_DIMS = COLOR_GRID * COLOR_GRID * 3
+
+# Jumlah bit 1 untuk setiap nilai byte, untuk menghitung jarak Hamming
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def dhash(image):
+    # Difference hash: one bit per horizontally adjacent pixel pair of a 9x8 grayscale thumbnail
+    pixels = np.asarray(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return np.uint64(int.from_bytes(np.packbits(bits).tobytes(), "big"))
+
+
+def color_signature(image):
+    # Mean RGB of each grid cell; BOX resampling averages every pixel of the cell
+    cells = image.convert("RGB").resize((COLOR_GRID, COLOR_GRID), Image.BOX)
+    return np.asarray(cells, dtype=np.float32).ravel()
+
+
+def hamming_distances(hashes, query):
+    differing = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(query))
+    return _POPCOUNT[differing.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class _Column:
+    """Raw append-only array file, memory-mapped read-only and remapped whenever the file changes."""
+
+    def __init__(self, path, dtype, row_shape=()):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.row_bytes = self.dtype.itemsize * int(np.prod(self.row_shape, dtype=np.int64))
+        self._map = None
+        self.identity = None
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.path) // self.row_bytes
+        except OSError:
+            return 0
+
+    def array(self, rows):
+        # View of the first `rows` rows; a torn last row from a crashed append is ignored
+        if rows == 0:
+            return np.empty((0, *self.row_shape), dtype=self.dtype)
+        # Another process may have appended, or rewritten the file with fewer rows (a new inode)
+        stat = os.stat(self.path)
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if self._map is None or identity != self.identity:
+            self._map = np.memmap(self.path, dtype=self.dtype, mode="r",
+                                  shape=(stat.st_size // self.row_bytes, *self.row_shape))
+            self.identity = identity
+        return self._map[:rows]
+
+    def append(self, values, rows):
+        values = np.ascontiguousarray(values, dtype=self.dtype).reshape(-1, *self.row_shape)
+        with open(self.path, "ab") as f:
+            # Cut off a torn row first so every column stays aligned on row boundaries
+            f.truncate(rows * self.row_bytes)
+            f.write(values.tobytes())
+
+    def rewrite(self, values):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(np.ascontiguousarray(values, dtype=self.dtype).tobytes())
+        os.replace(tmp_path, self.path)
+        self._map = None
+
+
+class EmbeddingIndex:
+    """Memory-mapped cosine-similarity index with an optional IVF coarse quantizer."""
+
+    def __init__(self, directory, dim=None, model_id=None, max_rows=None):
+        self.directory = directory
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._labels = []
+        self._labels_offset = 0
+        self._labels_inode = None
+        self._centroids = None
+        self._centroids_mtime = None
+        self._inverted = None
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            self.dim, self.model_id = manifest["dim"], manifest.get("model")
+        else:
+            self.dim, self.model_id = dim, model_id
+        if self.dim is not None:
+            self._open_columns()
+
+    def _open_columns(self):
+        path = lambda name: os.path.join(self.directory, name)  # noqa: E731
+        self._vectors = _Column(path("vectors.f32"), np.float32, (self.dim,))
+        self._predictions = _Column(path("predictions.f32"), np.float32, (len(CLASS_NAMES),))
+        self._hashes = _Column(path("hashes.u64"), np.uint64)
+        self._colors = _Column(path("colors.f32"), np.float32, (COLOR_DIMS,))
+        self._lists = _Column(path("lists.i32"), np.int32)
+
+    def _write_manifest(self):
+        with open(os.path.join(self.directory, "manifest.json"), "w") as f:
+            # Embeddings and stored predictions are only valid for the model that produced them
+            json.dump({"dim": self.dim, "model": self.model_id, "classes": CLASS_NAMES}, f)
+
+    def _read_labels(self):
+        # Other processes may have appended rows; only the new lines are parsed
+        path = os.path.join(self.directory, "labels.jsonl")
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return self._labels
+        if stat.st_ino != self._labels_inode or stat.st_size < self._labels_offset:
+            # Another process dropped the oldest rows and replaced the file; start over
+            self._labels, self._labels_offset, self._labels_inode = [], 0, stat.st_ino
+        if stat.st_size == self._labels_offset:
+            return self._labels
+        with open(path, "rb") as f:
+            f.seek(self._labels_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._labels.append(json.loads(line))
+                self._labels_offset += len(line)
+        return self._labels
+
+    def __len__(self):
+        if self.dim is None:
+            return 0
+        # A row is only complete once every column, and finally its label line, is written
+        return min(len(self._vectors), len(self._predictions), len(self._hashes), len(self._read_labels()))
+
+    def _load_centroids(self):
+        path = os.path.join(self.directory, "centroids.npy")
+        if not os.path.exists(path):
+            self._centroids = self._centroids_mtime = None
+            return None
+        mtime = os.path.getmtime(path)
+        if mtime != self._centroids_mtime:
+            self._centroids, self._centroids_mtime = np.load(path), mtime
+            self._lists._map = None
+        return self._centroids
+
+    def add(self, embeddings, predictions, hashes, labels=None, sources=None, colors=None):
+        embeddings = normalize(embeddings)
+        count = len(embeddings)
+        labels = labels if labels is not None else [None] * count
+        sources = sources if sources is not None else [None] * count
+        colors = np.full((count, COLOR_DIMS), np.nan) if colors is None else np.asarray(colors).reshape(count, -1)
+        with self._lock, file_lock(os.path.join(self.directory, "index.lock")):
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+                self._write_manifest()
+                self._open_columns()
+            if embeddings.shape[1] != self.dim:
+                raise ValueError(f"Embedding has {embeddings.shape[1]} dimensions, the index expects {self.dim}")
+            rows = len(self)
+            self._vectors.append(embeddings, rows)
+            self._predictions.append(predictions, rows)
+            self._hashes.append(hashes, rows)
+            # Indexes built before colours were stored have none for their old rows; NaN never matches
+            colored = min(len(self._colors), rows)
+            self._colors.append(np.concatenate([np.full((rows - colored, COLOR_DIMS), np.nan), colors]), colored)
+            centroids = self._load_centroids()
+            if centroids is not None:
+                self._lists.append(np.argmax(embeddings @ centroids.T, axis=1), rows)
+            with open(os.path.join(self.directory, "labels.jsonl"), "a") as f:
+                f.truncate(self._labels_offset)
+                f.writelines(json.dumps({"label": label, "source": source}) + "\n"
+                             for label, source in zip(labels, sources))
+            if self.max_rows and rows + count > self.max_rows:
+                rows = self._drop_oldest(max(count, int(self.max_rows * PRUNE_TO)))
+                return range(rows - count, rows)
+        return range(rows, rows + count)
+
+    def _drop_oldest(self, keep):
+        # Called with both locks held; every column is rewritten to its newest `keep` rows
+        rows = len(self)
+        start = rows - keep
+        for column in (self._vectors, self._predictions, self._hashes, self._colors):
+            column.rewrite(np.array(column.array(rows)[start:]))
+        if len(self._lists):
+            self._lists.rewrite(np.array(self._lists.array(min(rows, len(self._lists)))[start:]))
+        labels = self._read_labels()[start:rows]
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.writelines(json.dumps(label) + "\n" for label in labels)
+        os.replace(tmp_path, os.path.join(self.directory, "labels.jsonl"))
+        stat = os.stat(os.path.join(self.directory, "labels.jsonl"))
+        self._labels, self._labels_offset, self._labels_inode = labels, stat.st_size, stat.st_ino
+        self._inverted = None
+        return keep
+
+    def entry(self, row):
+        rows = len(self)
+        return {
+            **self._labels[row],
+            "row": row,
+            "prediction": np.array(self._predictions.array(rows)[row]),
+            "embedding": np.array(self._vectors.array(rows)[row]),
+        }
+
+    def find_near_duplicate(self, image_hash, colors, max_distance=NEAR_DUPLICATE_MAX_DISTANCE,
+                            max_color_diff=NEAR_DUPLICATE_MAX_COLOR_DIFF):
+        """The closest row whose hash is within max_distance and whose colour grid is within max_color_diff.
+
+        Returns None when no row passes both.
+        """
+        rows = min(len(self), len(self._colors)) if self.dim is not None else 0
+        if rows == 0:
+            return None
+        distances = hamming_distances(self._hashes.array(rows), image_hash)
+        candidates = np.flatnonzero(distances <= max_distance)
+        if len(candidates) == 0:
+            return None
+        color_diffs = np.abs(self._colors.array(rows)[candidates] - np.asarray(colors, dtype=np.float32)).max(axis=1)
+        matching = color_diffs <= max_color_diff
+        if not matching.any():
+            return None
+        candidates, distances = candidates[matching], distances[candidates[matching]]
+        return int(candidates[np.lexsort((color_diffs[matching], distances))[0]])
+
+    def search(self, queries, k=5, n_probe=None):
+        """Top-k rows by cosine similarity for each query.
+
+        Returns (scores, rows), both (len(queries), k), best first; missing hits
+        have row -1. With n_probe and a trained IVF quantizer only the rows of
+        the n_probe closest lists are scored.
+        """
+        queries = normalize(queries)
+        rows = len(self)
+        k = min(k, rows)
+        if k == 0:
+            return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+        vectors = self._vectors.array(rows)
+        centroids = self._load_centroids() if n_probe else None
+        if centroids is not None and len(self._lists) >= rows:
+            return self._search_ivf(queries, vectors, centroids, k, n_probe)
+
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, rows, SEARCH_CHUNK_ROWS):
+            chunk = vectors[start:start + SEARCH_CHUNK_ROWS]
+            scores = np.concatenate([best_scores, queries @ chunk.T], axis=1)
+            candidates = np.concatenate([
+                best_rows, np.broadcast_to(np.arange(start, start + len(chunk)), (len(queries), len(chunk)))
+            ], axis=1)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_rows = np.take_along_axis(candidates, top, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+    def _inverted_lists(self, rows, n_lists):
+        # Row ids grouped by list, so probing a list is a slice instead of a scan over every row
+        lists = self._lists.array(rows)
+        key = (rows, self._centroids_mtime, self._lists.identity)
+        if self._inverted is None or self._inverted[0] != key:
+            order = np.argsort(lists, kind="stable")
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=n_lists))])
+            self._inverted = (key, order, offsets)
+        return self._inverted[1:]
+
+    def _search_ivf(self, queries, vectors, centroids, k, n_probe):
+        order, offsets = self._inverted_lists(len(vectors), len(centroids))
+        probes = np.argsort(-(queries @ centroids.T), axis=1)[:, :n_probe]
+        scores_out = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        rows_out = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, query in enumerate(queries):
+            candidates = np.sort(np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probes[i]]))
+            if len(candidates) == 0:
+                continue
+            scores = vectors[candidates] @ query
+            top = np.argsort(-scores)[:k]
+            scores_out[i, :len(top)] = scores[top]
+            rows_out[i, :len(top)] = candidates[top]
+        return scores_out, rows_out
+
+    def train_ivf(self, n_lists=None, iterations=10, sample_size=100000, seed=0):
+        # Spherical k-means on a sample, then every row is assigned to its closest centroid
+        rows = len(self)
+        if rows == 0:
+            raise ValueError("Cannot train IVF lists on an empty index")
+        n_lists = min(n_lists or max(1, int(np.sqrt(rows))), rows)
+        vectors = self._vectors.array(rows)
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(vectors[np.sort(rng.choice(rows, min(rows, sample_size), replace=False))])
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = normalize(centroids)
+
+        with self._lock, file_lock(os.path.join(self.directory, "index.lock")):
+            rows = len(self)
+            vectors = self._vectors.array(rows)
+            lists = np.concatenate([
+                np.argmax(vectors[start:start + SEARCH_CHUNK_ROWS] @ centroids.T, axis=1)
+                for start in range(0, rows, SEARCH_CHUNK_ROWS)
+            ])
+            self._lists.rewrite(lists)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, centroids)
+            os.replace(tmp_path, os.path.join(self.directory, "centroids.npy"))
+        return n_lists
+
+
+def embed_images(model, images, batch_size):
+    # PIL images -> (predictions, embeddings, hashes, colors) in model-sized batches
+    from classifier import IMAGE_SIZE, batch_pool, fill_batch
+
+    predictions, embeddings, hashes, colors = [], [], [], []
+    for start in range(0, len(images), batch_size):
+        chunk = [image.resize(IMAGE_SIZE) for image in images[start:start + batch_size]]
+        hashes.extend(dhash(image) for image in chunk)
+        colors.extend(color_signature(image) for image in chunk)
+        with batch_pool.batch(len(chunk)) as batch:
+            fill_batch(batch, chunk)
+            chunk_predictions, chunk_embeddings = model.predict_with_embeddings(batch)
+        predictions.append(chunk_predictions)
+        embeddings.append(chunk_embeddings)
+    return (np.concatenate(predictions), np.concatenate(embeddings), np.array(hashes, dtype=np.uint64),
+            np.array(colors, dtype=np.float32))
+
+
+def _gallery_files(directory):
+    # Sub-folder name is the label: gallery/kue_cubit/001.jpg -> "kue_cubit"
+    for root, _, filenames in sorted(os.walk(directory)):
+        label = os.path.relpath(root, directory)
+        for filename in sorted(filenames):
+            if filename.lower().endswith((".jpg", ".jpeg", ".png")):
+                yield os.path.join(root, filename), (None if label == "." else label)
+
+
+def main(argv=None):
+    from classifier import MAX_BATCH_SIZE, MODEL_PATH, load_classifier, load_image, supports_embeddings
+    from prediction_cache import model_identity
+
+    parser = argparse.ArgumentParser(description="Build and query the snack embedding index")
+    parser.add_argument("--index", default=os.path.join(EMBEDDING_INDEX_DIR, "gallery"))
+    parser.add_argument("--model", default=MODEL_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="add a folder of images, one sub-folder per class")
+    add.add_argument("directory")
+    train = commands.add_parser("train-ivf", help="train the coarse quantizer for large galleries")
+    train.add_argument("--lists", type=int, help="number of IVF lists (default: sqrt of the row count)")
+    query = commands.add_parser("query", help="print the most similar gallery images")
+    query.add_argument("image")
+    query.add_argument("-k", type=int, default=5)
+    query.add_argument("--n-probe", type=int, help="search only this many IVF lists")
+    args = parser.parse_args(argv)
+
+    index = EmbeddingIndex(args.index, model_id=model_identity(args.model))
+    if args.command == "train-ivf":
+        print(f"Trained {index.train_ivf(args.lists)} lists over {len(index)} rows")
+        return
+
+    model = load_classifier(args.model, serving_mode="compiled")
+    if not supports_embeddings(model):
+        parser.error("embeddings need the compiled Keras backend (INFERENCE_BACKEND=keras)")
+    if args.command == "add":
+        files = list(_gallery_files(args.directory))
+        for start in range(0, len(files), MAX_BATCH_SIZE):
+            chunk = files[start:start + MAX_BATCH_SIZE]
+            predictions, embeddings, hashes, colors = embed_images(
+                model, [load_image(path) for path, _ in chunk], MAX_BATCH_SIZE
+            )
+            index.add(embeddings, predictions, hashes,
+                      labels=[label for _, label in chunk], sources=[path for path, _ in chunk], colors=colors)
+        print(f"Added {len(files)} images, index has {len(index)} rows")
+    else:
+        _, embeddings, _, _ = embed_images(model, [load_image(args.image)], 1)
+        scores, rows = index.search(embeddings, args.k, args.n_probe)
+        for score, row in zip(scores[0], rows[0]):
+            if row >= 0:
+                entry = index.entry(row)
+                print(f"{score:.4f}  {entry['label'] or '-':20} {entry['source']}")
+
+
+if __name__ == "__main__":
+    main()
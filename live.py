@@ -0,0 +1,217 @@
+"""Continuous classification of video files and camera snapshots.
+
+    with open_video(data, "clip.mp4") as video:
+        for timestamps, predictions, smoothed in classify_video(model, video):
+            ...
+
+FrameScheduler picks which frames to classify: it widens the gap between
+sampled frames whenever the measured cost per frame says we would fall behind
+playback. Sampled frames go through the model in batches, and
+PredictionSmoother keeps an EMA of the class vector so the label does not
+flicker from one frame to the next.
+
+MP4/MOV/AVI/WebM need OpenCV (opencv-python-headless); animated GIF and WebP
+are read with Pillow.
+"""
+import io
+import math
+import os
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from classifier import IMAGE_SIZE, MAX_BATCH_SIZE, batch_pool, fill_batch
+
+LIVE_BATCH_SIZE = int(os.environ.get("LIVE_BATCH_SIZE", "8"))
+# A snack on a counter does not change 30 times a second; never classify more often than this
+LIVE_MAX_SAMPLE_FPS = float(os.environ.get("LIVE_MAX_SAMPLE_FPS", "5"))
+# Time constant of the prediction EMA, in seconds of video
+LIVE_SMOOTHING_SECONDS = float(os.environ.get("LIVE_SMOOTHING_SECONDS", "1.0"))
+# Camera snapshots arrive seconds apart, so they are smoothed per snapshot instead of per second
+LIVE_SNAPSHOT_ALPHA = float(os.environ.get("LIVE_SNAPSHOT_ALPHA", "0.5"))
+# Smoothing of the measured per-frame cost that drives the frame skip
+FRAME_COST_ALPHA = 0.3
+PILLOW_VIDEO_TYPES = ("gif", "webp")
+OPENCV_VIDEO_TYPES = ("mp4", "mov", "avi", "mkv", "webm")
+VIDEO_TYPES = OPENCV_VIDEO_TYPES + PILLOW_VIDEO_TYPES
+
+
+class FrameScheduler:
+    def __init__(self, fps, max_sample_fps=LIVE_MAX_SAMPLE_FPS):
+        self.fps = fps
+        self.min_stride = max(1, round(fps / max_sample_fps)) if max_sample_fps > 0 else 1
+        self.stride = self.min_stride
+        self.frame_cost = None
+        self.sampled = 0
+        self.seen = 0
+        self._next = 0
+
+    def should_sample(self, index):
+        self.seen = index + 1
+        if index < self._next:
+            return False
+        self._next = index + self.stride
+        self.sampled += 1
+        return True
+
+    def observe(self, seconds, frames):
+        # seconds covers everything spent on these frames: reading skipped ones, decoding, queueing, inference
+        cost = seconds / frames
+        self.frame_cost = cost if self.frame_cost is None else (
+            FRAME_COST_ALPHA * cost + (1 - FRAME_COST_ALPHA) * self.frame_cost
+        )
+        # Keeping up means spending at most 1/fps of wall time per frame of video
+        self.stride = max(self.min_stride, math.ceil(self.frame_cost * self.fps))
+
+    def stats(self):
+        return {
+            "fps": self.fps,
+            "stride": self.stride,
+            "sampled": self.sampled,
+            "seen": self.seen,
+            "frame_cost": self.frame_cost,
+        }
+
+
+class PredictionSmoother:
+    def __init__(self, time_constant=LIVE_SMOOTHING_SECONDS, alpha=LIVE_SNAPSHOT_ALPHA):
+        self.time_constant = time_constant
+        self.alpha = alpha
+        self.value = None
+        self._timestamp = None
+
+    def update(self, prediction, timestamp=None):
+        """Fold one prediction into the EMA and return the smoothed vector.
+
+        With timestamps the weight depends on the time since the previous
+        update, so the smoothing is the same whatever the frame skip; without
+        them every update gets the fixed alpha.
+        """
+        prediction = np.asarray(prediction, dtype=np.float32)
+        if self.value is None:
+            self.value = prediction.copy()
+        else:
+            alpha = self.alpha
+            if timestamp is not None and self._timestamp is not None and self.time_constant > 0:
+                alpha = 1 - math.exp(-max(0.0, timestamp - self._timestamp) / self.time_constant)
+            self.value += alpha * (prediction - self.value)
+        self._timestamp = timestamp
+        return self.value.copy()
+
+    def reset(self):
+        self.value = None
+        self._timestamp = None
+
+
+class _PillowVideo:
+    def __init__(self, source):
+        self._image = Image.open(source)
+        self.frame_count = getattr(self._image, "n_frames", 1)
+        self._default_duration = self._image.info.get("duration") or 100
+        self.fps = 1000 / self._default_duration
+
+    def __iter__(self):
+        timestamp = 0.0
+        for index, frame in enumerate(ImageSequence.Iterator(self._image)):
+            yield index, timestamp, lambda frame=frame: np.asarray(frame.convert("RGB").resize(IMAGE_SIZE))
+            timestamp += (frame.info.get("duration") or self._default_duration) / 1000
+
+    def close(self):
+        self._image.close()
+
+
+class _OpenCVVideo:
+    def __init__(self, path):
+        import cv2
+        self._cv2 = cv2
+        self._capture = cv2.VideoCapture(path)
+        if not self._capture.isOpened():
+            raise ValueError("Could not read the video file")
+        self.fps = self._capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.frame_count = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def __iter__(self):
+        index = 0
+        # grab() decodes without converting or copying the frame out, which is all a skipped frame needs
+        while self._capture.grab():
+            yield index, index / self.fps, self._retrieve
+            index += 1
+
+    def _retrieve(self):
+        cv2 = self._cv2
+        _, frame = self._capture.retrieve()
+        # Shrink before the colour conversion so it only touches 256x256 pixels
+        frame = cv2.resize(frame, IMAGE_SIZE, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def close(self):
+        self._capture.release()
+
+
+@contextmanager
+def open_video(data, filename):
+    """Open encoded video bytes as an iterable of (index, timestamp, decode).
+
+    decode() returns the frame as a uint8 IMAGE_SIZE array and must be called
+    before the iterator moves on; frames that are never decoded stay cheap.
+    """
+    suffix = os.path.splitext(filename)[1].lower().lstrip(".")
+    if suffix in PILLOW_VIDEO_TYPES:
+        video = _PillowVideo(io.BytesIO(data))
+        try:
+            yield video
+        finally:
+            video.close()
+        return
+    try:
+        import cv2  # noqa: F401
+    except ImportError:
+        raise ValueError(f"Reading .{suffix} videos needs OpenCV: pip install opencv-python-headless") from None
+    # VideoCapture only reads from a path
+    with tempfile.NamedTemporaryFile(suffix=f".{suffix}") as f:
+        f.write(data)
+        f.flush()
+        video = _OpenCVVideo(f.name)
+        try:
+            yield video
+        finally:
+            video.close()
+
+
+def classify_video(model, video, batch_size=LIVE_BATCH_SIZE, scheduler=None, smoother=None, slot=nullcontext):
+    """Classify sampled frames of video in batches.
+
+    Yields (timestamps, predictions, smoothed) for every batch. slot() is
+    entered around each forward pass, for admission control.
+    """
+    scheduler = scheduler or FrameScheduler(video.fps)
+    smoother = smoother or PredictionSmoother()
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    frames, timestamps = [], []
+    started = time.perf_counter()
+
+    def run():
+        with slot(), batch_pool.batch(len(frames)) as batch:
+            fill_batch(batch, frames)
+            predictions = model.predict(batch, batch_size=len(frames), verbose=0)
+        smoothed = np.stack([smoother.update(p, t) for p, t in zip(predictions, timestamps)])
+        return np.array(timestamps), predictions, smoothed
+
+    for index, timestamp, decode in video:
+        if not scheduler.should_sample(index):
+            continue
+        frames.append(decode())
+        timestamps.append(timestamp)
+        if len(frames) == batch_size:
+            result = run()
+            scheduler.observe(time.perf_counter() - started, len(frames))
+            frames, timestamps = [], []
+            yield result
+            started = time.perf_counter()
+    if frames:
+        result = run()
+        scheduler.observe(time.perf_counter() - started, len(frames))
+        yield result
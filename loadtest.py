@@ -0,0 +1,367 @@
+"""Load test: many concurrent sessions of app.py in one process.
+
+Every session is a Streamlit AppTest of app.py running in its own thread.
+All sessions share one interpreter, so they share the cache_resource objects
+(model, prediction cache, admission controller) the same way browser sessions
+of one server pod do. Each session uploads an image from the corpus and then
+toggles "Show detailed predictions" a few times, which is where most reruns
+come from in real use.
+
+The test runs at each level of --sessions in turn and times every rerun. For
+each level it records:
+- throughput
+- rerun latency percentiles, per action
+- RSS of the process (and of the inference workers)
+- TensorFlow allocator memory after every rerun
+The capacity is the largest level that still meets --slo-ms at p95 without
+errors. Save the report and compare a later commit against it:
+
+    python loadtest.py --sessions 1,2,4,8 --duration 60 --save-report loadtest/baseline.json
+    python loadtest.py --sessions 1,2,4,8 --duration 60 --compare loadtest/baseline.json
+
+Exits with status 1 when the capacity drops, or when p95 latency or
+throughput at some level gets worse by more than --threshold.
+
+The prediction cache and history go to a temporary directory, and uploads are
+not added to the near-duplicate index. That way a run neither reuses nor
+leaves behind results of an earlier run. Set the usual environment variables
+to override this.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from benchmark import real_images, synthetic_images
+from memory_guard import rss_bytes, tf_memory_bytes
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+SESSION_LEVELS = [1, 2, 4, 8]
+# Reruns of the detailed-predictions checkbox after every upload
+TOGGLES_PER_UPLOAD = 2
+SEED = 1234
+MIME_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+
+
+def worker_pids():
+    # Inference workers (INFERENCE_WORKERS > 0) are child processes holding their own copy of the model
+    pids = []
+    try:
+        for task in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{task}/children") as f:
+                pids.extend(f.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+class Corpus:
+    """Uploads for the sessions, optionally made unique so every one runs the model."""
+
+    def __init__(self, images, fresh=False, seed=SEED):
+        self.images = sorted(images.items())
+        self.fresh = fresh
+        self.seed = seed
+
+    def upload(self, session, index):
+        name, data = self.images[(session + index) % len(self.images)]
+        if not self.fresh:
+            return name, data
+        # A random crop changes the content hash and the perceptual hash, so neither cache answers
+        rng = random.Random(f"{self.seed}-{session}-{index}")
+        image = Image.open(io.BytesIO(data)).convert("RGB")
+        width, height = image.size
+        scale = rng.uniform(0.75, 0.95)
+        left, top = rng.randint(0, int(width * (1 - scale))), rng.randint(0, int(height * (1 - scale)))
+        image = image.crop((left, top, left + int(width * scale), top + int(height * scale)))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        return f"{os.path.splitext(name)[0]}_{session}_{index}.jpg", buffer.getvalue()
+
+
+class MemorySampler:
+    def __init__(self):
+        self.rss = []
+        self.worker_rss = []
+        self.tf_current = []
+        self.tf_peak = 0
+        self._lock = threading.Lock()
+
+    def sample(self):
+        rss = rss_bytes()
+        workers = [rss_bytes(pid) for pid in worker_pids()]
+        tf_memory = tf_memory_bytes()
+        with self._lock:
+            if rss is not None:
+                self.rss.append(rss)
+            self.worker_rss.append(sum(r for r in workers if r))
+            if tf_memory is not None:
+                self.tf_current.append(tf_memory["current"])
+                self.tf_peak = max(self.tf_peak, tf_memory["peak"])
+
+    def summary(self, reruns):
+        mb = 1024 * 1024
+        if not self.rss:
+            return {}
+        summary = {
+            "rss_start_mb": self.rss[0] / mb,
+            "rss_end_mb": self.rss[-1] / mb,
+            "rss_peak_mb": max(self.rss) / mb,
+            # Steady growth here across levels points at a leak
+            "rss_growth_kb_per_rerun": (self.rss[-1] - self.rss[0]) / 1024 / max(1, reruns),
+            "worker_rss_peak_mb": max(self.worker_rss) / mb,
+        }
+        if self.tf_current:
+            summary.update({
+                "tf_current_mb": self.tf_current[-1] / mb,
+                "tf_peak_mb": self.tf_peak / mb,
+                "tf_growth_kb_per_rerun": (self.tf_current[-1] - self.tf_current[0]) / 1024 / max(1, reruns),
+            })
+        return summary
+
+
+def latency_stats(samples, elapsed):
+    samples = np.asarray(samples)
+    p50, p95, p99 = np.percentile(samples * 1000, [50, 95, 99])
+    return {
+        "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+        "mean_ms": samples.mean() * 1000,
+        "count": len(samples),
+        "throughput_per_s": len(samples) / elapsed,
+    }
+
+
+def set_upload(app, name, data):
+    app.file_uploader[0].set_value((name, data, MIME_TYPES.get(os.path.splitext(name)[1].lower(), "image/jpeg")))
+
+
+def run_session(session, corpus, deadline, timeout, toggles, record, memory):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    def rerun(action):
+        started = time.perf_counter()
+        try:
+            app.run()
+        except Exception as e:  # AppTest raises when the script does not finish within the timeout
+            record(action, time.perf_counter() - started, f"{type(e).__name__}: {e}")
+            return False
+        seconds = time.perf_counter() - started
+        memory.sample()
+        error = None
+        if app.exception:
+            error = app.exception[0].value
+        elif any("overloaded" in warning.value for warning in app.warning):
+            error = "overloaded"
+        record(action, seconds, error)
+        return error is None
+
+    if not rerun("open"):
+        return
+    index = 0
+    while time.monotonic() < deadline:
+        set_upload(app, *corpus.upload(session, index))
+        index += 1
+        if not rerun("upload"):
+            continue
+        for _ in range(toggles):
+            if not app.checkbox or time.monotonic() >= deadline:
+                break
+            app.checkbox[0].set_value(not app.checkbox[0].value)
+            rerun("toggle")
+
+
+def warm_up(corpus, timeout):
+    # One upload before any level, so loading and warming up the model is not part of the results
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    app.run()
+    set_upload(app, *corpus.upload(0, 0))
+    app.run()
+    if app.exception:
+        raise RuntimeError(f"app.py failed: {app.exception[0].value}")
+
+
+def run_level(sessions, corpus, duration, timeout, toggles=TOGGLES_PER_UPLOAD):
+    import metrics
+
+    samples, errors = {}, {}
+    lock = threading.Lock()
+
+    def record(action, seconds, error):
+        with lock:
+            samples.setdefault(action, []).append(seconds)
+            if error is not None:
+                errors[error] = errors.get(error, 0) + 1
+
+    # Fresh per-stage histograms for this level
+    metrics.registry = metrics.Registry()
+    memory = MemorySampler()
+    memory.sample()
+    started = time.perf_counter()
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=run_session, args=(i, corpus, deadline, timeout, toggles, record, memory),
+                         name=f"loadtest-session-{i}")
+        for i in range(sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    reruns = sum(len(s) for s in samples.values())
+    everything = [seconds for action, s in samples.items() if action != "open" for seconds in s]
+    result = {
+        "sessions": sessions,
+        "elapsed_s": elapsed,
+        "reruns": reruns,
+        "errors": sum(errors.values()),
+        "error_kinds": errors,
+        "uploads_per_s": len(samples.get("upload", [])) / elapsed,
+        "actions": {action: latency_stats(s, elapsed) for action, s in sorted(samples.items())},
+        "memory": memory.summary(reruns),
+        "stages": metrics.registry.summary(),
+    }
+    if everything:
+        result["reruns_total"] = latency_stats(everything, elapsed)
+    return result
+
+
+def capacity(levels, slo_ms):
+    # Largest level such that it and every level below it meet the SLO without errors
+    best = 0
+    for sessions, result in sorted(levels.items(), key=lambda item: int(item[0])):
+        total = result.get("reruns_total")
+        if result["errors"] or total is None or total["p95_ms"] > slo_ms:
+            break
+        best = int(sessions)
+    return best
+
+
+def compare(report, baseline, threshold):
+    regressions = []
+    # Only comparable when this run went as high as the baseline's capacity
+    tested = str(baseline.get("capacity_sessions")) in report["levels"]
+    if tested and report["capacity_sessions"] < baseline["capacity_sessions"]:
+        regressions.append(f"capacity {baseline['capacity_sessions']} -> {report['capacity_sessions']} sessions")
+    for sessions, result in report["levels"].items():
+        before = baseline.get("levels", {}).get(sessions, {}).get("reruns_total")
+        after = result.get("reruns_total")
+        if before is None or after is None:
+            continue
+        result["p95_change"] = after["p95_ms"] / before["p95_ms"] - 1
+        result["throughput_change"] = after["throughput_per_s"] / before["throughput_per_s"] - 1
+        if result["p95_change"] > threshold:
+            regressions.append(f"{sessions} sessions: p95 {before['p95_ms']:.0f} ms -> {after['p95_ms']:.0f} ms "
+                               f"({result['p95_change'] * 100:+.0f}%)")
+        if result["throughput_change"] < -threshold:
+            regressions.append(f"{sessions} sessions: {before['throughput_per_s']:.2f} -> "
+                               f"{after['throughput_per_s']:.2f} reruns/s ({result['throughput_change'] * 100:+.0f}%)")
+    return regressions
+
+
+def print_report(report):
+    print(f"{'sessions':>8} {'reruns/s':>9} {'uploads/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'errors':>7} {'RSS MB':>8} {'KB/rerun':>9} {'TF MB':>7} {'vs base':>8}")
+    for sessions, result in report["levels"].items():
+        total = result.get("reruns_total", {})
+        memory = result["memory"]
+        change = f"{result['p95_change'] * 100:+.0f}%" if "p95_change" in result else ""
+        print(f"{sessions:>8} {total.get('throughput_per_s', 0):9.2f} {result['uploads_per_s']:10.2f} "
+              f"{total.get('p50_ms', 0):9.0f} {total.get('p95_ms', 0):9.0f} {total.get('p99_ms', 0):9.0f} "
+              f"{result['errors']:7d} {memory.get('rss_peak_mb', 0):8.0f} "
+              f"{memory.get('rss_growth_kb_per_rerun', 0):9.1f} {memory.get('tf_peak_mb', 0):7.0f} {change:>8}")
+    print()
+    print(f"capacity: {report['capacity_sessions']} concurrent sessions at p95 <= {report['slo_ms']:.0f} ms")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(APP_PATH)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test app.py with concurrent sessions")
+    parser.add_argument("--sessions", default=",".join(map(str, SESSION_LEVELS)),
+                        help="comma-separated numbers of concurrent sessions, run in turn")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per level")
+    parser.add_argument("--images", help="folder of images to upload (default: synthetic images)")
+    parser.add_argument("--fresh", action="store_true",
+                        help="make every upload unique so it runs the model instead of hitting a cache")
+    parser.add_argument("--toggles", type=int, default=TOGGLES_PER_UPLOAD,
+                        help="checkbox reruns after each upload")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before a rerun counts as failed")
+    parser.add_argument("--slo-ms", type=float, default=2000, help="p95 rerun latency a level must meet")
+    parser.add_argument("--save-report", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH", help="report JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="relative p95 increase or throughput decrease that counts as a regression")
+    args = parser.parse_args(argv)
+
+    scratch = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ.setdefault("PREDICTION_CACHE_DIR", os.path.join(scratch, "prediction_cache"))
+    os.environ.setdefault("PREDICTION_HISTORY_PATH", os.path.join(scratch, "prediction_history.db"))
+    os.environ.setdefault("INDEX_RECORD_UPLOADS", "0")
+    os.environ.setdefault("METRICS_ENABLED", "1")
+
+    images = real_images(args.images) if args.images else synthetic_images()
+    corpus = Corpus(images, fresh=args.fresh)
+    print("loading the model...", file=sys.stderr)
+    warm_up(corpus, args.timeout)
+
+    levels = {}
+    for sessions in (int(s) for s in args.sessions.split(",")):
+        print(f"{sessions} sessions for {args.duration:.0f}s...", file=sys.stderr)
+        levels[str(sessions)] = run_level(sessions, corpus, args.duration, args.timeout, args.toggles)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "images": args.images, "fresh": args.fresh, "toggles": args.toggles, "duration_s": args.duration,
+            **{name: os.environ.get(name) for name in (
+                "INFERENCE_BACKEND", "SERVING_MODE", "INFERENCE_WORKERS", "INFERENCE_CONCURRENCY",
+                "TF_INTRA_OP_THREADS", "TF_INTER_OP_THREADS", "CHART_RENDERER")},
+        },
+        "slo_ms": args.slo_ms,
+        "levels": levels,
+    }
+    report["capacity_sessions"] = capacity(levels, args.slo_ms)
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+    print_report(report)
+
+    if args.save_report:
+        os.makedirs(os.path.dirname(args.save_report) or ".", exist_ok=True)
+        with open(args.save_report, "w") as f:
+            json.dump(report, f, indent=2)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""Memory accounting after every rerun, with a budget per session and per process.
+
+MemoryGuard.check() runs at the end of every rerun. It samples:
+- the process RSS
+- TensorFlow allocator memory
+- the size of everything the session keeps in st.session_state
+- with MEMORY_TRACKING=1, tracemalloc's traced total
+
+When a session is over SESSION_MEMORY_BUDGET_MB, its largest entries are
+shrunk or dropped. When the process is over PROCESS_MEMORY_BUDGET_MB, the
+registered caches are released and freed heap pages go back to the OS. While
+either budget is exceeded, previews are shown at thumbnail size.
+
+Each time a budget is exceeded, a report is logged and kept on the guard.
+With MEMORY_TRACKING=1 the report also shows the net bytes each
+metrics.stage() kept allocated and the top allocation sites since the first
+rerun. tracemalloc slows allocation-heavy code, so leave tracking off unless
+you are hunting a leak.
+"""
+import ctypes
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+TRACKING = os.environ.get("MEMORY_TRACKING", "0") == "1"
+TRACE_FRAMES = int(os.environ.get("MEMORY_TRACE_FRAMES", "1"))
+# 0 turns a budget off
+PROCESS_MEMORY_BUDGET_MB = float(os.environ.get("PROCESS_MEMORY_BUDGET_MB", "0"))
+SESSION_MEMORY_BUDGET_MB = float(os.environ.get("SESSION_MEMORY_BUDGET_MB", "64"))
+# Releasing collects garbage and trims the heap, which is not free; do it at most this often
+RELEASE_INTERVAL_SECONDS = float(os.environ.get("MEMORY_RELEASE_INTERVAL", "30"))
+REPORT_TOP = 10
+RECENT_SAMPLES = 100
+MB = 1024 * 1024
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+if TRACKING and not tracemalloc.is_tracing():
+    tracemalloc.start(TRACE_FRAMES)
+
+
+def rss_bytes(pid="self"):
+    # Linux only; None elsewhere
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+_tf_device = None
+
+
+def tf_memory_bytes(ready=True):
+    """TensorFlow allocator stats, or None until ready.
+
+    Pass ready=False while the model loader is still starting. Listing devices
+    initialises the TF runtime, and once that has happened
+    classifier.configure_threading can no longer set the thread budget.
+    """
+    global _tf_device
+    # Only once the app has imported TensorFlow; importing it here would add to the memory being measured
+    tf = sys.modules.get("tensorflow")
+    if not ready or tf is None:
+        return None
+    try:
+        if _tf_device is None:
+            _tf_device = "GPU:0" if tf.config.list_logical_devices("GPU") else "CPU:0"
+        return tf.config.experimental.get_memory_info(_tf_device)
+    except (AttributeError, ValueError, RuntimeError):
+        return None  # No allocator stats for this device
+
+
+def sizeof(value, _seen=None):
+    """Approximate bytes held by value, following containers and plain objects."""
+    _seen = set() if _seen is None else _seen
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        return value.nbytes if value.base is None else 0  # Views share their base's memory
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, (bytes, bytearray, str)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(k, _seen) + sizeof(v, _seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset, deque)):
+        return sys.getsizeof(value) + sum(sizeof(v, _seen) for v in value)
+    if hasattr(value, "__dict__") and not isinstance(value, type):
+        return sys.getsizeof(value) + sizeof(vars(value), _seen)
+    return sys.getsizeof(value)
+
+
+def release_heap():
+    # Freed Python and numpy memory stays in glibc's arenas until trimmed; that is most of the daily creep
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+# Net bytes each metrics.stage() left allocated: name -> [calls, total, largest]
+_stage_allocations = {}
+_stage_lock = threading.Lock()
+
+
+def traced_bytes():
+    return tracemalloc.get_traced_memory()[0] if TRACKING else None
+
+
+def observe_stage(name, before):
+    # Other sessions allocate at the same time, so under load this is an attribution, not an exact count
+    if before is None:
+        return
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    with _stage_lock:
+        stats = _stage_allocations.setdefault(name, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += allocated
+        stats[2] = max(stats[2], allocated)
+
+
+def stage_allocations():
+    with _stage_lock:
+        return {name: {"calls": calls, "net_mb": total / MB, "largest_mb": largest / MB}
+                for name, (calls, total, largest) in sorted(_stage_allocations.items(),
+                                                           key=lambda item: -item[1][1])}
+
+
+def _snapshot():
+    # Imports and tracemalloc's own bookkeeping are not leaks
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+
+
+class MemoryGuard:
+    def __init__(self, process_budget_mb=PROCESS_MEMORY_BUDGET_MB, session_budget_mb=SESSION_MEMORY_BUDGET_MB,
+                 tf_ready=None):
+        self.process_budget = process_budget_mb * MB
+        self.session_budget = session_budget_mb * MB
+        # TensorFlow is only asked for its stats once tf_ready() is true, see tf_memory_bytes
+        self._tf_ready = tf_ready or (lambda: True)
+        self.samples = deque(maxlen=RECENT_SAMPLES)
+        self.last_report = None
+        self.releases = 0
+        self.session_evictions = 0
+        self._releasers = []
+        self._released_at = 0.0
+        self._was_over = False
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    def add_releaser(self, name, release):
+        """Register release(), called in order when the process is over budget."""
+        self._releasers.append((name, release))
+
+    @property
+    def over_process_budget(self):
+        return bool(self.process_budget and self.samples and self.samples[-1]["rss"] > self.process_budget)
+
+    def sample(self):
+        tf_memory = tf_memory_bytes(self._tf_ready())
+        sample = {
+            "timestamp": time.time(),
+            "rss": rss_bytes() or 0,
+            "tf_current": tf_memory["current"] if tf_memory else None,
+            "tf_peak": tf_memory["peak"] if tf_memory else None,
+            "traced": traced_bytes(),
+        }
+        self.samples.append(sample)
+        return sample
+
+    def check(self, session_state, shrinkers=None):
+        """Account for this rerun and enforce the budgets; returns the report when one was exceeded.
+
+        shrinkers maps session_state keys to fn(value) returning a smaller
+        value, or None to drop the entry. Keys without one are never touched.
+        """
+        shrinkers = shrinkers or {}
+        sample = self.sample()
+        if TRACKING and self._baseline is None:
+            self._baseline = _snapshot()
+        session = {key: sizeof(value) for key, value in session_state.items()}
+        actions = []
+
+        if self.session_budget and sum(session.values()) > self.session_budget:
+            for key in sorted(session, key=session.get, reverse=True):
+                if sum(session.values()) <= self.session_budget:
+                    break
+                if key not in shrinkers:
+                    continue
+                while key in session_state and sum(session.values()) > self.session_budget:
+                    smaller = shrinkers[key](session_state[key])
+                    self.session_evictions += 1
+                    if smaller is None:
+                        del session_state[key]
+                        session[key] = 0
+                        actions.append(f"dropped session entry {key}")
+                    else:
+                        session_state[key] = smaller
+                        actions.append(f"shrank session entry {key} from {session[key] / MB:.1f} MB")
+                        session[key] = sizeof(smaller)
+
+        if (self.process_budget and sample["rss"] > self.process_budget
+                and time.monotonic() - self._released_at > RELEASE_INTERVAL_SECONDS
+                # One session at a time releases; the others would only repeat the same work
+                and self._lock.acquire(blocking=False)):
+            try:
+                for name, release in self._releasers:
+                    release()
+                    actions.append(f"released {name}")
+                release_heap()
+                self.releases += 1
+                self._released_at = time.monotonic()
+            finally:
+                self._lock.release()
+            sample = self.sample()
+            actions.append(f"RSS after releasing: {sample['rss'] / MB:.0f} MB")
+
+        # Report what was done, and the moment the process first goes over; not every rerun after that
+        over = self.over_process_budget
+        newly_over, self._was_over = over and not self._was_over, over
+        if not actions and not newly_over:
+            return None
+        self.last_report = self.report(session, actions)
+        logger.warning("memory budget exceeded\n%s", self.last_report)
+        return self.last_report
+
+    def under_pressure(self, session_state):
+        # Decides whether previews are shown at thumbnail size
+        return self.over_process_budget or bool(
+            self.session_budget and sum(sizeof(v) for v in session_state.values()) > self.session_budget)
+
+    def report(self, session=None, actions=()):
+        sample = self.samples[-1] if self.samples else self.sample()
+        lines = [f"RSS {sample['rss'] / MB:.0f} MB"
+                 + (f" of {self.process_budget / MB:.0f} MB budget" if self.process_budget else "")]
+        if len(self.samples) > 1:
+            first = self.samples[0]
+            lines.append(f"RSS change over the last {len(self.samples)} reruns: "
+                         f"{(sample['rss'] - first['rss']) / MB:+.1f} MB")
+        if sample["tf_current"] is not None:
+            lines.append(f"TensorFlow allocator {sample['tf_current'] / MB:.0f} MB (peak {sample['tf_peak'] / MB:.0f} MB)")
+        if session:
+            lines.append(f"session state {sum(session.values()) / MB:.1f} MB"
+                         + (f" of {self.session_budget / MB:.0f} MB budget" if self.session_budget else "") + ": "
+                         + ", ".join(f"{key} {size / MB:.2f} MB"
+                                     for key, size in sorted(session.items(), key=lambda item: -item[1])[:REPORT_TOP]))
+        lines.extend(actions)
+        if TRACKING:
+            lines.append(f"traced by Python {sample['traced'] / MB:.0f} MB; net allocations per stage:")
+            lines.extend(f"  {name}: {stats['net_mb']:+.1f} MB over {stats['calls']} calls, "
+                         f"largest {stats['largest_mb']:+.1f} MB"
+                         for name, stats in list(stage_allocations().items())[:REPORT_TOP])
+            if self._baseline is not None:
+                lines.append("top allocation sites since the first rerun:")
+                growth = _snapshot().compare_to(self._baseline, "lineno")
+                lines.extend(f"  {stat}" for stat in growth[:REPORT_TOP])
+        return "\n".join(lines)
+
+    def stats(self):
+        sample = self.samples[-1] if self.samples else self.sample()
+        return {
+            "rss_mb": sample["rss"] / MB,
+            "tf_mb": sample["tf_current"] / MB if sample["tf_current"] is not None else None,
+            "releases": self.releases,
+            "session_evictions": self.session_evictions,
+        }
@@ -0,0 +1,182 @@
+"""Per-stage latency instrumentation.
+
+Enable with METRICS_ENABLED=1. Code under measurement wraps each stage in
+``with metrics.stage("decode"):``; when metrics are disabled that returns a
+shared no-op context manager, so the cost is one function call.
+
+Every finished request is written as one JSON line to the ``metrics.trace``
+logger and folded into rolling per-stage histograms, which are available as
+Prometheus text (``prometheus_text()``, ``GET /metrics/prometheus`` on serve.py,
+or the file named by METRICS_FILE for a node_exporter textfile collector).
+
+With MEMORY_TRACKING=1 stages also report the memory they leave allocated to
+memory_guard, whether or not timing is enabled.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+import memory_guard
+
+ENABLED = os.environ.get("METRICS_ENABLED", "0") == "1"
+METRICS_FILE = os.environ.get("METRICS_FILE")
+METRICS_FILE_INTERVAL = float(os.environ.get("METRICS_FILE_INTERVAL", "10"))
+RECENT_SAMPLES = 1000
+RECENT_TRACES = 50
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+trace_logger = logging.getLogger("metrics.trace")
+
+
+class StageHistogram:
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+        for i, upper in enumerate(BUCKETS):
+            if seconds <= upper:
+                self.bucket_counts[i] += 1
+                break
+
+    def percentile(self, q):
+        if not self.recent:
+            return None
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = {}
+        self.recent_traces = deque(maxlen=RECENT_TRACES)
+        self._lock = threading.Lock()
+        self._file_written_at = 0.0
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = StageHistogram()
+            histogram.observe(seconds)
+
+    def add_trace(self, trace):
+        with self._lock:
+            self.recent_traces.append(trace)
+
+    def summary(self):
+        with self._lock:
+            return {
+                name: {
+                    "count": h.count,
+                    "p50_ms": h.percentile(50) * 1000,
+                    "p95_ms": h.percentile(95) * 1000,
+                    "p99_ms": h.percentile(99) * 1000,
+                }
+                for name, h in sorted(self.histograms.items())
+            }
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP jajanan_stage_duration_seconds Time spent in each request stage.",
+            "# TYPE jajanan_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for name, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for upper, count in zip(BUCKETS, h.bucket_counts):
+                    cumulative += count
+                    lines.append(f'jajanan_stage_duration_seconds_bucket{{stage="{name}",le="{upper}"}} {cumulative}')
+                lines.append(f'jajanan_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'jajanan_stage_duration_seconds_sum{{stage="{name}"}} {h.sum:.6f}')
+                lines.append(f'jajanan_stage_duration_seconds_count{{stage="{name}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+    def maybe_write_file(self, path, interval=METRICS_FILE_INTERVAL):
+        now = time.monotonic()
+        if now - self._file_written_at < interval:
+            return
+        self._file_written_at = now
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+registry = Registry()
+_current_trace = ContextVar("metrics_trace", default=None)
+_NOOP = nullcontext()
+
+
+@contextmanager
+def _timed(name):
+    started = time.perf_counter()
+    allocated = memory_guard.traced_bytes()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+        memory_guard.observe_stage(name, allocated)
+
+
+def stage(name):
+    if not ENABLED and not memory_guard.TRACKING:
+        return _NOOP
+    return _timed(name)
+
+
+def observe(name, seconds):
+    if not ENABLED:
+        return
+    registry.observe(name, seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace["stages_ms"][name] = trace["stages_ms"].get(name, 0.0) + seconds * 1000
+
+
+def begin_request(kind, **fields):
+    if not ENABLED:
+        return None
+    trace = {"kind": kind, "timestamp": time.time(), "stages_ms": {}, **fields}
+    trace["_started"] = time.perf_counter()
+    _current_trace.set(trace)
+    return trace
+
+
+def current_stages():
+    # Stage timings of the request in progress so far; empty when metrics are disabled
+    trace = _current_trace.get()
+    return dict(trace["stages_ms"]) if trace is not None else {}
+
+
+def end_request():
+    if not ENABLED:
+        return None
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    _current_trace.set(None)
+    total = time.perf_counter() - trace.pop("_started")
+    trace["total_ms"] = total * 1000
+    registry.observe("request", total)
+    registry.add_trace(trace)
+    trace_logger.info(json.dumps(trace))
+    if METRICS_FILE:
+        registry.maybe_write_file(METRICS_FILE)
+    return trace
+
+
+def prometheus_text():
+    return registry.prometheus_text()
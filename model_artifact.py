@@ -0,0 +1,183 @@
+"""Fast-loading copy of the Keras model: architecture JSON plus a raw weights blob.
+
+load_model() on the .keras file unzips it and reads every weight through h5py
+before building the layers. The first load writes the same model next to the
+file as ``<model>.fastload/`` (``model.json`` with the architecture, the
+source fingerprint and the offset of every weight; ``weights.bin`` with the
+weights back to back). Later starts build the layers from the JSON and assign
+the weights straight from a memory map of the blob.
+
+A SavedModel export of the traced serving functions was tried as well; with
+Keras 3 restoring it took longer than rebuilding the model and tracing again.
+
+Compare load times of both formats:
+    python model_artifact.py --model best_model_resnet50.keras
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from classifier import MODEL_PATH
+from model_download import file_lock
+from prediction_cache import model_identity
+
+logger = logging.getLogger(__name__)
+
+# Set MODEL_FAST_LOAD=0 to always load the .keras file
+FAST_LOAD = os.environ.get("MODEL_FAST_LOAD", "1") == "1"
+# Bump when the layout of the artifact changes
+ARTIFACT_VERSION = 1
+# Weights start on cache-line boundaries so every view of the memory map is aligned
+ALIGNMENT = 64
+
+
+def artifact_path(model_path):
+    return f"{os.path.splitext(model_path)[0]}.fastload"
+
+
+def export(model, model_path=MODEL_PATH):
+    """Write model (loaded from model_path) as a fast-loading artifact next to it."""
+    path = artifact_path(model_path)
+    # Several worker processes may finish loading at the same moment; one export is enough
+    with file_lock(path + ".lock"):
+        if _read_manifest(model_path) is not None:
+            return path
+        started = time.perf_counter()
+        tmp_path = path + ".part"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        weights, offset = [], 0
+        with open(os.path.join(tmp_path, "weights.bin"), "wb") as f:
+            for array in model.get_weights():
+                array = np.ascontiguousarray(array)
+                padding = -offset % ALIGNMENT
+                f.write(b"\0" * padding)
+                offset += padding
+                weights.append({"offset": offset, "shape": list(array.shape), "dtype": array.dtype.str})
+                f.write(array.tobytes())
+                offset += array.nbytes
+        with open(os.path.join(tmp_path, "model.json"), "w") as f:
+            json.dump({
+                "version": ARTIFACT_VERSION,
+                "source": model_identity(model_path),
+                "config": model.to_json(),
+                "weights": weights,
+            }, f)
+        # The directory only appears under its final name once it is complete
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+    logger.info("exported %s to %s in %.2fs", model_path, path, time.perf_counter() - started)
+    return path
+
+
+def _read_manifest(model_path):
+    try:
+        with open(os.path.join(artifact_path(model_path), "model.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != ARTIFACT_VERSION or manifest.get("source") != model_identity(model_path):
+        return None
+    return manifest
+
+
+def _load_artifact(model_path, manifest):
+    import tensorflow as tf
+
+    model = tf.keras.models.model_from_json(manifest["config"])
+    blob = np.memmap(os.path.join(artifact_path(model_path), "weights.bin"), dtype=np.uint8, mode="r")
+    weights = []
+    for weight in manifest["weights"]:
+        dtype = np.dtype(weight["dtype"])
+        count = int(np.prod(weight["shape"], dtype=np.int64))
+        start = weight["offset"]
+        weights.append(blob[start:start + count * dtype.itemsize].view(dtype).reshape(weight["shape"]))
+    # set_weights copies into the TensorFlow variables; the pages are only read once
+    model.set_weights(weights)
+    return model
+
+
+def load_model(model_path=MODEL_PATH, fast_load=FAST_LOAD):
+    """Load the Keras model, from the fast-loading artifact when there is a current one.
+
+    Without one, the .keras file is loaded and, with fast_load, exported for the next start.
+    """
+    started = time.perf_counter()
+    manifest = _read_manifest(model_path) if fast_load else None
+    if manifest is not None:
+        try:
+            model = _load_artifact(model_path, manifest)
+        except Exception:
+            logger.exception("could not load %s, falling back to the .keras file", artifact_path(model_path))
+        else:
+            logger.info("loaded %s in %.2fs", artifact_path(model_path), time.perf_counter() - started)
+            return model
+
+    from tensorflow.keras.models import load_model as load_keras_model
+    model = load_keras_model(model_path)
+    logger.info("loaded %s in %.2fs", model_path, time.perf_counter() - started)
+    if fast_load:
+        # A failed export only means the next start is not faster
+        try:
+            export(model, model_path)
+        except Exception:
+            logger.exception("could not export the fast-loading model")
+    return model
+
+
+# Runs in a fresh interpreter per format, so neither import caches nor traced graphs carry over
+_TIMING_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import tensorflow
+imported = time.perf_counter()
+from classifier import load_classifier, warm_up
+model = load_classifier(sys.argv[1])
+loaded = time.perf_counter()
+warm_up(model)
+print(json.dumps({"import_s": imported - started, "load_s": loaded - imported,
+                  "warm_up_s": time.perf_counter() - loaded}))
+"""
+
+
+def load_times(model_path=MODEL_PATH, repeat=3):
+    """Median import, load and warm-up time of each format, each run in a fresh process."""
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def run(fast_load):
+        output = subprocess.run([sys.executable, "-c", _TIMING_SCRIPT, model_path], check=True, cwd=here,
+                                capture_output=True, text=True,
+                                env={**os.environ, "MODEL_FAST_LOAD": "1" if fast_load else "0"})
+        return json.loads(output.stdout.strip().splitlines()[-1])
+
+    if _read_manifest(model_path) is None:
+        run(fast_load=True)  # exports
+    results = {}
+    for name, fast_load in (("keras", False), ("fastload", True)):
+        runs = [run(fast_load) for _ in range(repeat)]
+        results[name] = {key: float(np.median([r[key] for r in runs])) for key in runs[0]}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the fast-loading model and compare load times")
+    parser.add_argument("--model", default=MODEL_PATH, help="path to the .keras model")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh processes per format")
+    args = parser.parse_args(argv)
+
+    print(f"{'format':12} {'import s':>9} {'load s':>9} {'warm-up s':>10} {'total s':>9}")
+    for name, timing in load_times(args.model, args.repeat).items():
+        print(f"{name:12} {timing['import_s']:9.2f} {timing['load_s']:9.2f} {timing['warm_up_s']:10.2f} "
+              f"{sum(timing.values()):9.2f}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import re
+import time
+from contextlib import contextmanager
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, downloads are still atomic
+    fcntl = None
+
+CHUNK_SIZE = 1024 * 1024
+MAX_RETRIES = 5
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ChecksumError(Exception):
+    pass
+
+
+@contextmanager
+def file_lock(lock_path):
+    # Worker lain yang memegang lock sedang mengunduh model yang sama; tunggu saja
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _expected_sha256(response, expected):
+    if expected:
+        return expected.lower()
+    # Hugging Face sends the LFS object's SHA-256 as the linked ETag on the redirect
+    for r in [*response.history, response]:
+        for header in ("X-Linked-Etag", "ETag"):
+            etag = r.headers.get(header, "").removeprefix("W/").strip('"').lower()
+            if SHA256_PATTERN.match(etag):
+                return etag
+    return None
+
+
+def _hash_file(path, digest):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+
+def _download_part(url, part_path, expected_sha256, timeout, progress):
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 416 and offset:
+            # Partial file is already complete (or bigger than the remote file); start over once,
+            # without a Range header, so a server that keeps answering 416 fails in raise_for_status
+            os.remove(part_path)
+            return _download_part(url, part_path, expected_sha256, timeout, progress)
+        response.raise_for_status()
+
+        digest = hashlib.sha256()
+        if offset and response.status_code == 206:
+            _hash_file(part_path, digest)
+            mode = "ab"
+        else:
+            offset, mode = 0, "wb"
+        total = int(response.headers.get("Content-Length", 0)) + offset or None
+        expected_sha256 = _expected_sha256(response, expected_sha256)
+
+        done = offset
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                digest.update(chunk)
+                done += len(chunk)
+                if progress is not None:
+                    progress(done, total)
+            f.flush()
+            os.fsync(f.fileno())
+
+    if total is not None and done != total:
+        raise requests.exceptions.ChunkedEncodingError(f"expected {total} bytes, got {done}")
+    if expected_sha256 is not None and digest.hexdigest() != expected_sha256:
+        os.remove(part_path)
+        raise ChecksumError(f"SHA-256 mismatch: expected {expected_sha256}, got {digest.hexdigest()}")
+
+
+def fetch(url, path, expected_sha256=None, timeout=30, progress=None, max_retries=MAX_RETRIES):
+    """Stream url to path, resuming with HTTP Range and installing atomically.
+
+    The body is written to ``path + ".part"`` and renamed over ``path`` only
+    after the size and SHA-256 check out, so ``path`` never holds a truncated
+    file. A lock file serialises concurrent workers downloading the same path.
+    """
+    part_path = path + ".part"
+    with file_lock(path + ".lock"):
+        if os.path.exists(path):
+            return path
+        for attempt in range(max_retries + 1):
+            try:
+                _download_part(url, part_path, expected_sha256, timeout, progress)
+                break
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout):
+                if attempt == max_retries:
+                    raise
+                time.sleep(min(2 ** attempt, 30))
+        os.replace(part_path, path)
+    return path
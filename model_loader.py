@@ -0,0 +1,149 @@
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import metrics
+from admission import INFERENCE_QUEUE_TIMEOUT
+from classifier import MODEL_PATH, MODEL_URL, download_model, load_classifier, serving_backend, warm_up
+from model_registry import MODEL_POLL_SECONDS, ModelRegistry
+from prediction_cache import model_identity
+from worker_pool import INFERENCE_WORKERS, InferencePool
+
+logger = logging.getLogger(__name__)
+
+# How long a replaced worker pool stays up for requests that picked it before the swap
+MODEL_SWAP_GRACE = float(os.environ.get("MODEL_SWAP_GRACE", str(INFERENCE_QUEUE_TIMEOUT + 30)))
+
+# model_id keys the prediction cache and the embedding indexes; it changes with the model
+ActiveModel = namedtuple("ActiveModel", ["model", "model_id", "version"])
+
+
+class BackgroundModelLoader:
+    """Downloads, loads and warms up the model on a background thread.
+
+    The Streamlit app starts this as soon as a worker boots, so the landing page
+    renders immediately and the first upload usually finds the model ready.
+    With INFERENCE_WORKERS set, the model is an InferencePool of worker processes.
+
+    When the model registry has a CURRENT version, that version is served
+    instead of path, and CURRENT is polled: a new version is loaded and warmed
+    up next to the old one, then swapped in by replacing ``active``.
+    """
+
+    def __init__(self, path=MODEL_PATH, url=MODEL_URL, registry=None, poll_seconds=MODEL_POLL_SECONDS):
+        self.path = path
+        self.url = url
+        self.registry = registry or ModelRegistry()
+        self.poll_seconds = poll_seconds
+        self.active = None
+        self.error = None
+        self.timings = {}
+        self.download_progress = (0, None)
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._watcher = None
+        self._failed_version = None
+
+    @contextmanager
+    def _phase(self, name):
+        started = time.perf_counter()
+        yield
+        self.timings[name] = time.perf_counter() - started
+        metrics.observe(f"startup_{name}", self.timings[name])
+        logger.info("startup phase %s took %.2fs", name, self.timings[name])
+
+    def _on_progress(self, done, total):
+        self.download_progress = (done, total)
+
+    def _load(self, path, phase_prefix=""):
+        if INFERENCE_WORKERS > 0:
+            # TensorFlow only lives in the worker processes, each loading and warming up its own model
+            with self._phase(f"{phase_prefix}start_workers"):
+                return InferencePool(INFERENCE_WORKERS, path=path, url=self.url).start()
+        with self._phase(f"{phase_prefix}import_tensorflow"):
+            import tensorflow  # noqa: F401
+        with self._phase(f"{phase_prefix}load_model"):
+            model = load_classifier(path, self.url)
+        with self._phase(f"{phase_prefix}warm_up"):
+            warm_up(model)
+        return model
+
+    def _run(self):
+        try:
+            version = self.registry.current()
+            path = self.registry.path(version) if version else self.path
+            if not os.path.exists(path):
+                with self._phase("download"):
+                    download_model(self.url, path, progress=self._on_progress)
+            model = self._load(path)
+            self.active = ActiveModel(model, self._identity(model, path), version)
+            logger.info("model %s ready after %.2fs", version or path, sum(self.timings.values()))
+            if self._watcher is None and self.poll_seconds > 0:
+                self._watcher = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+                self._watcher.start()
+        except Exception as e:
+            logger.exception("model startup failed")
+            self.error = e
+        finally:
+            self._ready.set()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            version = self.registry.current()
+            if version is None or version in (self.active.version, self._failed_version):
+                continue
+            try:
+                path = self.registry.path(version)
+                model = self._load(path, phase_prefix="swap_")
+            except Exception:
+                # Keep serving the old version; try again only once CURRENT moves on
+                logger.exception("could not load model version %s", version)
+                self._failed_version = version
+                continue
+            previous, self.active = self.active, ActiveModel(model, self._identity(model, path), version)
+            logger.info("swapped model %s -> %s", previous.version or self.path, version)
+            self._retire(previous.model)
+
+    @staticmethod
+    def _identity(model, path):
+        # Named after the backend that loaded, not the one asked for; a cascade reports its head and threshold
+        return model_identity(path, serving_backend(model), getattr(model, "cascade_identity", None))
+
+    @staticmethod
+    def _retire(model):
+        # An in-process model is freed once the last request using it lets go; a pool needs closing
+        if hasattr(model, "close"):
+            timer = threading.Timer(MODEL_SWAP_GRACE, model.close)
+            timer.daemon = True
+            timer.start()
+
+    def start(self):
+        # Idempotent; a failed attempt is retried on the next call
+        with self._lock:
+            if self._thread is not None and (self._thread.is_alive() or self.error is None):
+                return self
+            self.error = None
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run, name="model-loader", daemon=True)
+            self._thread.start()
+        return self
+
+    @property
+    def model(self):
+        return self.active.model if self.active is not None else None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    @property
+    def downloading(self):
+        return not self.ready and self.registry.current() is None and not os.path.exists(self.path)
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
@@ -0,0 +1,127 @@
+"""Versioned model registry with a movable CURRENT pointer.
+
+    python model_registry.py publish retrained.keras --version 2026-10 --prepare --activate
+    python model_registry.py activate 2026-09     # roll back
+    python model_registry.py list
+
+Layout of MODEL_REGISTRY_DIR:
+    <version>.keras, <version>.json    the model and when/where it was published
+    <version>.fastload/                fast-loading copy (see model_artifact.py)
+    CURRENT                            name of the version to serve
+
+Running apps poll CURRENT (see model_loader.BackgroundModelLoader), load and
+warm up the new version in the background and then swap it in. Requests
+already running finish on the model they started with.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR", "model_registry")
+MODEL_POLL_SECONDS = float(os.environ.get("MODEL_POLL_SECONDS", "10"))
+VERSION_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+class ModelRegistry:
+    def __init__(self, directory=MODEL_REGISTRY_DIR):
+        self.directory = directory
+
+    def path(self, version):
+        return os.path.join(self.directory, f"{version}.keras")
+
+    def exists(self):
+        return os.path.isdir(self.directory)
+
+    def current(self):
+        # None when there is no registry or nothing has been activated yet
+        try:
+            with open(os.path.join(self.directory, "CURRENT")) as f:
+                version = f.read().strip()
+        except OSError:
+            return None
+        return version if version and os.path.exists(self.path(version)) else None
+
+    def versions(self):
+        versions = []
+        if not self.exists():
+            return versions
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json") and os.path.exists(self.path(filename[:-5])):
+                with open(os.path.join(self.directory, filename)) as f:
+                    versions.append(json.load(f))
+        return sorted(versions, key=lambda v: v["published"])
+
+    def _write(self, filename, content):
+        # Readers never see a half-written file
+        path = os.path.join(self.directory, filename)
+        with open(path + ".part", "w") as f:
+            f.write(content)
+        os.replace(path + ".part", path)
+
+    def publish(self, source, version=None, activate=False):
+        digest = hashlib.sha256()
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        version = version or digest.hexdigest()[:12]
+        if not VERSION_PATTERN.match(version):
+            raise ValueError(f"invalid version name {version!r}")
+        if os.path.exists(self.path(version)):
+            raise ValueError(f"version {version} is already published")
+        os.makedirs(self.directory, exist_ok=True)
+        shutil.copyfile(source, self.path(version) + ".part")
+        os.replace(self.path(version) + ".part", self.path(version))
+        self._write(f"{version}.json", json.dumps({
+            "version": version,
+            "sha256": digest.hexdigest(),
+            "source": os.path.abspath(source),
+            "published": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }, indent=2))
+        if activate:
+            self.activate(version)
+        return version
+
+    def activate(self, version):
+        if not os.path.exists(self.path(version)):
+            raise ValueError(f"version {version} is not published")
+        self._write("CURRENT", version + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish and activate model versions")
+    parser.add_argument("--registry", default=MODEL_REGISTRY_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    publish = commands.add_parser("publish", help="copy a .keras model into the registry")
+    publish.add_argument("model")
+    publish.add_argument("--version", help="version name (default: start of the file's SHA-256)")
+    publish.add_argument("--prepare", action="store_true",
+                         help="write the fast-loading copy now instead of on the first server start")
+    publish.add_argument("--activate", action="store_true", help="serve this version right away")
+    activate = commands.add_parser("activate", help="point CURRENT at a published version")
+    activate.add_argument("version")
+    commands.add_parser("list")
+    args = parser.parse_args(argv)
+
+    registry = ModelRegistry(args.registry)
+    if args.command == "publish":
+        version = registry.publish(args.model, args.version)
+        if args.prepare:
+            from model_artifact import load_model
+            load_model(registry.path(version), fast_load=True)
+        if args.activate:
+            registry.activate(version)
+        print(version)
+    elif args.command == "activate":
+        registry.activate(args.version)
+    else:
+        current = registry.current()
+        for v in registry.versions():
+            print(f"{'*' if v['version'] == current else ' '} {v['version']:24} {v['published']}  {v['sha256'][:12]}")
+
+
+if __name__ == "__main__":
+    main()
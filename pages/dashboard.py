@@ -0,0 +1,66 @@
+import time
+from datetime import datetime
+
+import streamlit as st
+
+from charts import class_distribution_spec, confidence_histogram_spec, latency_trend_spec
+from classifier import CLASS_NAMES
+from prediction_history import HistoryReader
+
+# Aggregates are hourly, so a window starts at the top of the hour it falls in
+WINDOWS = {"Last hour": 3600, "Last 24 hours": 24 * 3600, "Last 7 days": 7 * 24 * 3600, "All time": None}
+
+st.set_page_config(page_title="Prediction Dashboard", page_icon="📊", layout="wide")
+
+@st.cache_resource
+def get_history_reader():
+    return HistoryReader()
+
+st.markdown("# 📊 Prediction Dashboard")
+window = st.radio("Window", list(WINDOWS), index=1, horizontal=True)
+since = time.time() - WINDOWS[window] if WINDOWS[window] else None
+reader = get_history_reader()
+
+distribution = reader.class_distribution(since)
+if not distribution:
+    st.info("No predictions recorded in this window yet. Classify a few snacks on the main page first.")
+    st.stop()
+
+total = sum(row["count"] for row in distribution)
+mean_confidence = sum(row["mean_confidence"] * row["count"] for row in distribution) / total
+latency = reader.latency_percentiles(since)
+col1, col2, col3 = st.columns(3)
+col1.metric("Predictions", f"{total:,}")
+col2.metric("Mean confidence", f"{mean_confidence * 100:.1f}%")
+if "total" in latency:
+    col3.metric("p95 latency", f"{latency['total']['p95_ms']:.0f} ms")
+
+col1, col2 = st.columns(2)
+with col1:
+    st.vega_lite_chart(class_distribution_spec(distribution), use_container_width=True)
+with col2:
+    snack = st.selectbox("Snack", ["All snacks"] + CLASS_NAMES,
+                         format_func=lambda name: name.replace('_', ' ').title())
+    histogram = reader.confidence_histogram(since, None if snack == "All snacks" else snack)
+    st.vega_lite_chart(confidence_histogram_spec(histogram), use_container_width=True)
+
+st.markdown("## Latency")
+if latency:
+    st.markdown("| stage | count | p50 ms | p95 ms | p99 ms |\n|---|---|---|---|---|\n" + "\n".join(
+        f"| {stage} | {stats['count']} | {stats['p50_ms']:.1f} | {stats['p95_ms']:.1f} | {stats['p99_ms']:.1f} |"
+        for stage, stats in sorted(latency.items())
+    ))
+    st.caption("Only predictions that ran the model; per-stage timings need METRICS_ENABLED=1.")
+    trend = reader.latency_trend(since)
+    if trend:
+        st.vega_lite_chart(latency_trend_spec(trend), use_container_width=True)
+else:
+    st.caption("Every prediction in this window came from a cache.")
+
+st.markdown("## Recent Predictions")
+rows = []
+for row in reader.recent():
+    latency_ms = "" if row["latency_ms"] is None else f"{row['latency_ms']:.0f} ms"
+    rows.append(f"| {datetime.fromtimestamp(row['timestamp']):%Y-%m-%d %H:%M:%S} | {row['kind']} | {row['source']} "
+                f"| {row['label'].replace('_', ' ').title()} | {row['confidence'] * 100:.1f}% | {latency_ms} |")
+st.markdown("| time | mode | source | snack | confidence | latency |\n|---|---|---|---|---|---|\n" + "\n".join(rows))
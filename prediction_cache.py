@@ -0,0 +1,183 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Ukuran cache dan TTL bisa diatur lewat environment variable
+CACHE_MAX_ENTRIES = int(os.environ.get("PREDICTION_CACHE_SIZE", "512"))
+CACHE_TTL_SECONDS = float(os.environ.get("PREDICTION_CACHE_TTL", "86400"))
+CACHE_DIR = os.environ.get("PREDICTION_CACHE_DIR", ".prediction_cache")
+# File di disk juga dibatasi; yang tertua dihapus duluan
+CACHE_DISK_MAX_ENTRIES = int(os.environ.get("PREDICTION_CACHE_DISK_SIZE", "50000"))
+# Pruning goes down to this share of the limit, so the directory is not listed on every write
+DISK_PRUNE_TO = 0.9
+
+
+def model_identity(model_path, backend="keras", cascade=None):
+    # Cheap fingerprint: a replaced model file changes size or mtime
+    stat = os.stat(model_path)
+    identity = f"{os.path.basename(model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    # Quantized backends give slightly different scores, so they get their own entries
+    if backend != "keras":
+        identity = f"{identity}:{backend}"
+    # The cascade's head answers most images itself; see CascadeClassifier.cascade_identity
+    return f"{identity}:cascade-{cascade}" if cascade else identity
+
+
+def content_digest(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def cache_key(image_bytes, model_id, digest=None):
+    # Pass digest when the caller already has content_digest(image_bytes)
+    digest = digest or content_digest(image_bytes)
+    return hashlib.sha256(f"{model_id}|{digest}".encode()).hexdigest()
+
+
+class PredictionCache:
+    """Bounded LRU of prediction vectors with TTL and an optional disk tier."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS,
+                 cache_dir=CACHE_DIR, disk_max_entries=CACHE_DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.cache_dir = cache_dir or None
+        self.disk_max_entries = disk_max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self._disk_entries = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._disk_entries = len(self._disk_files())
+
+    def _expired(self, stored_at):
+        return self.ttl_seconds > 0 and time.time() - stored_at > self.ttl_seconds
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if self._expired(stored_at):
+                os.remove(path)
+                return None
+            return np.load(path), stored_at
+        except (OSError, ValueError):
+            return None
+
+    def _disk_files(self):
+        # (mtime, path) of every stored entry; files removed meanwhile by another process are skipped
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy"):
+                try:
+                    files.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        return files
+
+    def _prune_disk(self):
+        # Oldest first. Other processes may share the directory, so the count is refreshed from the listing
+        files = sorted(self._disk_files())
+        excess = len(files) - int(self.disk_max_entries * DISK_PRUNE_TO)
+        for _, path in files[:max(0, excess)]:
+            try:
+                os.remove(path)
+                self.disk_evictions += 1
+            except OSError:
+                pass
+        self._disk_entries = len(files) - max(0, excess)
+
+    def _write_disk(self, key, prediction):
+        # Tulis ke file sementara lalu rename supaya pembaca tidak melihat file setengah jadi
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, prediction)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._disk_lock:
+            self._disk_entries += 1
+            if self.disk_max_entries and self._disk_entries > self.disk_max_entries:
+                self._prune_disk()
+
+    def _store(self, key, prediction, stored_at):
+        self._entries[key] = (prediction, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                prediction, stored_at = entry
+                if not self._expired(stored_at):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return prediction
+                del self._entries[key]
+                self.evictions += 1
+
+            if self.cache_dir:
+                disk_entry = self._read_disk(key)
+                if disk_entry is not None:
+                    prediction, stored_at = disk_entry
+                    self._store(key, prediction, stored_at)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return prediction
+
+            self.misses += 1
+            return None
+
+    def put(self, key, prediction):
+        prediction = np.asarray(prediction, dtype=np.float32)
+        with self._lock:
+            self._store(key, prediction, time.time())
+        if self.cache_dir:
+            self._write_disk(key, prediction)
+
+    def get_or_compute(self, key, compute):
+        prediction = self.get(key)
+        if prediction is not None:
+            return prediction
+        prediction = compute()
+        if prediction is not None:
+            self.put(key, prediction)
+        return prediction
+
+    def clear(self):
+        # Only the memory tier; entries on disk come back on their next lookup
+        with self._lock:
+            self.evictions += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,290 @@
+"""Durable history of every prediction, with aggregates kept up to date on write.
+
+record() only puts the prediction on a bounded queue; a background thread
+writes the queue to SQLite (WAL mode) in batches, one transaction per batch.
+When the queue is full, records are dropped and counted, so logging never
+waits on the disk.
+
+Alongside the raw ``predictions`` table, the same transaction adds each
+batch to small aggregate tables keyed by hour:
+    class_stats       count and confidence sum per snack
+    confidence_hist   confidence in 5% buckets per snack
+    latency_hist      latency in log-spaced buckets per stage ("total" and the metrics
+                      stages), for predictions that ran the model
+The dashboard (pages/dashboard.py) only reads those, so its cost depends on
+the time window and not on how many predictions were ever recorded.
+"""
+import atexit
+import json
+import logging
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from classifier import CLASS_NAMES, top_k_indices
+
+logger = logging.getLogger(__name__)
+
+# Empty disables the history
+HISTORY_PATH = os.environ.get("PREDICTION_HISTORY_PATH", "prediction_history.db")
+HISTORY_BATCH_SIZE = int(os.environ.get("PREDICTION_HISTORY_BATCH_SIZE", "256"))
+HISTORY_FLUSH_SECONDS = float(os.environ.get("PREDICTION_HISTORY_FLUSH_SECONDS", "1.0"))
+HISTORY_QUEUE_SIZE = int(os.environ.get("PREDICTION_HISTORY_QUEUE_SIZE", "10000"))
+TOP_K = 5
+CONFIDENCE_BUCKETS = 20
+# Latency buckets grow by 10%, so a percentile read from them is within about 5% of the true value
+LATENCY_BUCKET_GROWTH = 1.1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    kind TEXT NOT NULL,
+    source TEXT NOT NULL,
+    image_hash TEXT,
+    model_id TEXT,
+    label TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    top_k TEXT NOT NULL,
+    latency_ms REAL,
+    stages_ms TEXT
+);
+CREATE TABLE IF NOT EXISTS class_stats (
+    hour INTEGER NOT NULL, label TEXT NOT NULL, count INTEGER NOT NULL, confidence_sum REAL NOT NULL,
+    PRIMARY KEY (hour, label)
+);
+CREATE TABLE IF NOT EXISTS confidence_hist (
+    hour INTEGER NOT NULL, label TEXT NOT NULL, bucket INTEGER NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (hour, label, bucket)
+);
+CREATE TABLE IF NOT EXISTS latency_hist (
+    hour INTEGER NOT NULL, stage TEXT NOT NULL, bucket INTEGER NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (hour, stage, bucket)
+);
+"""
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL with synchronous=NORMAL only fsyncs at checkpoints; a crash loses at most the last batches
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def confidence_bucket(confidence):
+    return min(CONFIDENCE_BUCKETS - 1, int(confidence * CONFIDENCE_BUCKETS))
+
+
+def latency_bucket(ms):
+    return math.floor(math.log(max(ms, 0.01), LATENCY_BUCKET_GROWTH))
+
+
+def latency_bucket_ms(bucket):
+    # Geometric middle of the bucket
+    return LATENCY_BUCKET_GROWTH ** (bucket + 0.5)
+
+
+class PredictionHistory:
+    def __init__(self, path=HISTORY_PATH, batch_size=HISTORY_BATCH_SIZE, flush_seconds=HISTORY_FLUSH_SECONDS,
+                 max_queue=HISTORY_QUEUE_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="prediction-history", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def record(self, kind, prediction, source="model", image_hash=None, model_id=None, latency_ms=None,
+               stages_ms=None):
+        """Queue one prediction for writing; never blocks."""
+        if not self.path:
+            return
+        self._start()
+        item = (time.time(), kind, source, image_hash, model_id, np.array(prediction, dtype=np.float32),
+                latency_ms, dict(stages_ms or {}))
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=None):
+        # Returns once everything queued before the call is on disk
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        conn = connect(self.path)
+        stopping = False
+        while not stopping:
+            items, waiters = [], []
+            try:
+                item = self._queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_seconds
+            while True:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    items.append(item)
+                if stopping or waiters or len(items) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if items:
+                try:
+                    self._write(conn, items)
+                    self.written += len(items)
+                except sqlite3.Error:
+                    logger.exception("could not write %d predictions to %s", len(items), self.path)
+                    self.dropped += len(items)
+            for waiter in waiters:
+                waiter.set()
+        conn.close()
+
+    @staticmethod
+    def _write(conn, items):
+        rows = []
+        class_stats, confidence_hist, latency_hist = Counter(), Counter(), Counter()
+        confidence_sums = Counter()
+        for timestamp, kind, source, image_hash, model_id, prediction, latency_ms, stages_ms in items:
+            top = top_k_indices(prediction, TOP_K)
+            label, confidence = CLASS_NAMES[top[0]], float(prediction[top[0]])
+            rows.append((timestamp, kind, source, image_hash, model_id, label, confidence,
+                         json.dumps([[CLASS_NAMES[i], round(float(prediction[i]), 5)] for i in top]),
+                         latency_ms, json.dumps(stages_ms) if stages_ms else None))
+            hour = int(timestamp // 3600)
+            class_stats[hour, label] += 1
+            confidence_sums[hour, label] += confidence
+            confidence_hist[hour, label, confidence_bucket(confidence)] += 1
+            if source != "model":
+                continue  # Cache hits answer in microseconds and would only hide the model's latency
+            if latency_ms is not None:
+                latency_hist[hour, "total", latency_bucket(latency_ms)] += 1
+            for stage, ms in stages_ms.items():
+                latency_hist[hour, stage, latency_bucket(ms)] += 1
+
+        with conn:
+            conn.executemany(
+                "INSERT INTO predictions (timestamp, kind, source, image_hash, model_id, label, confidence, top_k,"
+                " latency_ms, stages_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.executemany(
+                "INSERT INTO class_stats VALUES (?, ?, ?, ?) ON CONFLICT (hour, label) DO UPDATE SET"
+                " count = count + excluded.count, confidence_sum = confidence_sum + excluded.confidence_sum",
+                [(*key, count, confidence_sums[key]) for key, count in class_stats.items()])
+            conn.executemany(
+                "INSERT INTO confidence_hist VALUES (?, ?, ?, ?) ON CONFLICT (hour, label, bucket) DO UPDATE SET"
+                " count = count + excluded.count", [(*key, count) for key, count in confidence_hist.items()])
+            conn.executemany(
+                "INSERT INTO latency_hist VALUES (?, ?, ?, ?) ON CONFLICT (hour, stage, bucket) DO UPDATE SET"
+                " count = count + excluded.count", [(*key, count) for key, count in latency_hist.items()])
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped, "queued": self._queue.qsize()}
+
+
+def _percentiles(buckets, quantiles=(50, 95, 99)):
+    # buckets: [(bucket, count)] sorted by bucket
+    total = sum(count for _, count in buckets)
+    results, seen, targets = {}, 0, list(quantiles)
+    for bucket, count in buckets:
+        seen += count
+        while targets and seen >= targets[0] / 100 * total:
+            results[f"p{targets.pop(0)}_ms"] = latency_bucket_ms(bucket)
+    return results
+
+
+class HistoryReader:
+    """Dashboard queries; every one reads only the hourly aggregate tables (or the newest rows)."""
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+
+    def _query(self, sql, params=()):
+        if not self.path or not os.path.exists(self.path):
+            return []
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=5)
+        try:
+            return conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError:
+            return []  # Created but no tables yet
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _since_hour(since):
+        return int(since // 3600) if since else 0
+
+    def class_distribution(self, since=None):
+        return [
+            {"label": label, "count": count, "mean_confidence": confidence_sum / count}
+            for label, count, confidence_sum in self._query(
+                "SELECT label, SUM(count), SUM(confidence_sum) FROM class_stats WHERE hour >= ?"
+                " GROUP BY label ORDER BY SUM(count) DESC", (self._since_hour(since),))
+        ]
+
+    def confidence_histogram(self, since=None, label=None):
+        rows = self._query(
+            "SELECT bucket, SUM(count) FROM confidence_hist WHERE hour >= ? AND (? IS NULL OR label = ?)"
+            " GROUP BY bucket", (self._since_hour(since), label, label))
+        counts = dict(rows)
+        return [{"from": b / CONFIDENCE_BUCKETS, "to": (b + 1) / CONFIDENCE_BUCKETS, "count": counts.get(b, 0)}
+                for b in range(CONFIDENCE_BUCKETS)]
+
+    def latency_percentiles(self, since=None):
+        rows = self._query(
+            "SELECT stage, bucket, SUM(count) FROM latency_hist WHERE hour >= ? GROUP BY stage, bucket"
+            " ORDER BY stage, bucket", (self._since_hour(since),))
+        by_stage = {}
+        for stage, bucket, count in rows:
+            by_stage.setdefault(stage, []).append((bucket, count))
+        return {stage: {"count": sum(c for _, c in buckets), **_percentiles(buckets)}
+                for stage, buckets in by_stage.items()}
+
+    def latency_trend(self, since=None, stage="total"):
+        rows = self._query(
+            "SELECT hour, bucket, count FROM latency_hist WHERE hour >= ? AND stage = ? ORDER BY hour, bucket",
+            (self._since_hour(since), stage))
+        by_hour = {}
+        for hour, bucket, count in rows:
+            by_hour.setdefault(hour, []).append((bucket, count))
+        return [{"hour": hour * 3600, "count": sum(c for _, c in buckets), **_percentiles(buckets)}
+                for hour, buckets in by_hour.items()]
+
+    def recent(self, limit=20):
+        return [
+            {"timestamp": timestamp, "kind": kind, "source": source, "label": label, "confidence": confidence,
+             "latency_ms": latency_ms}
+            for timestamp, kind, source, label, confidence, latency_ms in self._query(
+                "SELECT timestamp, kind, source, label, confidence, latency_ms FROM predictions"
+                " ORDER BY id DESC LIMIT ?", (limit,))
+        ]
@@ -0,0 +1,92 @@
+"""Previews encoded once per upload and reused on every rerun.
+
+Given a PIL image, st.image encodes it again on every rerun, checkbox toggles
+included. It uses JPEG quality 100 at the decoded size, which is several
+times the bytes a phone on a slow link needs.
+
+Here the preview is encoded once as a bounded-size JPEG and kept under the
+upload's content digest. st.image gets those bytes and passes them through
+without re-encoding.
+Streamlit only serves JPEG, PNG and GIF; WebP bytes would be re-encoded on
+every rerun, so JPEG it is.
+
+    previews = PreviewCache()
+    st.image(previews.get_or_encode(digest, (800, 800), lambda: image), output_format="JPEG")
+"""
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import ImageOps
+
+PREVIEW_QUALITY = int(os.environ.get("PREVIEW_QUALITY", "80"))
+PREVIEW_CACHE_MB = float(os.environ.get("PREVIEW_CACHE_MB", "32"))
+MB = 1024 * 1024
+
+
+def encode_preview(image, size, quality=PREVIEW_QUALITY):
+    """JPEG bytes of image, scaled down to fit size; never scaled up."""
+    if image.width > size[0] or image.height > size[1]:
+        image = ImageOps.contain(image, size)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    # Progressive: a slow link shows the whole picture blurry first instead of the top rows sharp
+    image.save(buffer, format="JPEG", quality=quality, progressive=True)
+    return buffer.getvalue()
+
+
+class PreviewCache:
+    """LRU of encoded previews keyed by (content digest, size), bounded in bytes."""
+
+    def __init__(self, max_mb=PREVIEW_CACHE_MB, quality=PREVIEW_QUALITY):
+        self.max_bytes = max_mb * MB
+        self.quality = quality
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest, size):
+        with self._lock:
+            data = self._entries.get((digest, size))
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((digest, size))
+            self.hits += 1
+            return data
+
+    def put(self, digest, size, image):
+        data = encode_preview(image, size, self.quality)
+        with self._lock:
+            previous = self._entries.pop((digest, size), None)
+            self._bytes += len(data) - (len(previous) if previous else 0)
+            self._entries[(digest, size)] = data
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+        return data
+
+    def get_or_encode(self, digest, size, image):
+        # image is a callable so a hit never needs the decoded upload
+        data = self.get(digest, size)
+        return data if data is not None else self.put(digest, size, image())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "mb": self._bytes / MB,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,295 @@
+"""Local HTTP inference server with dynamic micro-batching.
+
+Example:
+    python serve.py --port 8080 --max-batch-size 16 --max-wait-ms 5
+    curl --data-binary @kue_cubit.jpg http://127.0.0.1:8080/predict?top_k=5
+
+Endpoints:
+    POST /predict   raw JPEG/PNG bytes in the body, returns top-k JSON
+    GET  /metrics   latency percentiles and batch-size histogram
+    GET  /metrics/prometheus   per-stage histograms (needs METRICS_ENABLED=1)
+    GET  /healthz   liveness check
+
+Concurrent requests are queued and merged into one model.predict call of up
+to --max-batch-size images, waiting at most --max-wait-ms for a batch to fill.
+With --workers N, batches are scored by N model processes in parallel.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import metrics
+from classifier import (
+    CLASS_NAMES, MAX_BATCH_SIZE, MODEL_PATH, batch_pool, decode_image, fill_batch, load_classifier, top_k,
+)
+from worker_pool import INFERENCE_WORKERS, InferencePool
+
+MAX_BODY_BYTES = 20 * 1024 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+def parse_top_k(query, default=5):
+    # None when top_k is not a number of classes the model has
+    try:
+        k = int(parse_qs(query).get("top_k", [str(default)])[0])
+    except ValueError:
+        return None
+    return k if 1 <= k <= len(CLASS_NAMES) else None
+
+
+def format_top_k(prediction, k):
+    # Same numbers as create_prediction_chart in app.py: display name and confidence in %
+    return [
+        {"class": label, "snack": label.replace('_', ' ').title(), "confidence": score * 100}
+        for label, score in top_k(prediction, k)
+    ]
+
+
+class BatchMetrics:
+    def __init__(self, window=10000):
+        self.latencies_ms = deque(maxlen=window)
+        self.queue_waits_ms = deque(maxlen=window)
+        self.batch_sizes = Counter()
+        self.requests = 0
+        self.errors = 0
+
+    def record_batch(self, size):
+        self.batch_sizes[size] += 1
+
+    def record_request(self, latency_ms, queue_wait_ms):
+        self.requests += 1
+        self.latencies_ms.append(latency_ms)
+        self.queue_waits_ms.append(queue_wait_ms)
+
+    @staticmethod
+    def _percentiles(values):
+        if not values:
+            return {}
+        p50, p90, p99 = np.percentile(np.fromiter(values, dtype=np.float64), [50, 90, 99])
+        return {"p50": p50, "p90": p90, "p99": p99, "count": len(values)}
+
+    def snapshot(self):
+        batches = sum(self.batch_sizes.values())
+        images = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_ms": self._percentiles(self.latencies_ms),
+            "queue_wait_ms": self._percentiles(self.queue_waits_ms),
+            "batches": batches,
+            "mean_batch_size": images / batches if batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+        }
+
+
+class MicroBatcher:
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=5.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.metrics = BatchMetrics()
+        self._queue = asyncio.Queue()
+        # In-process TensorFlow already uses every core inside one predict; a worker pool takes one batch per worker
+        concurrency = getattr(model, "concurrency", 1)
+        self._model_executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._in_flight = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+
+    async def predict(self, array):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((array, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _run_model(self, arrays):
+        with batch_pool.batch(len(arrays)) as batch:
+            with metrics.stage("preprocess"):
+                fill_batch(batch, arrays)
+            with metrics.stage("inference"):
+                return self.model.predict(batch, batch_size=len(arrays), verbose=0)
+
+    async def _process(self, batch):
+        started = time.perf_counter()
+        self.metrics.record_batch(len(batch))
+        try:
+            predictions = await asyncio.get_running_loop().run_in_executor(
+                self._model_executor, self._run_model, [array for array, _, _ in batch]
+            )
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._in_flight.release()
+        for (_, future, enqueued), prediction in zip(batch, predictions):
+            if not future.done():
+                future.set_result((prediction, (started - enqueued) * 1000))
+
+    async def run(self):
+        while True:
+            # Start collecting the next batch only when a model slot is free, so batches keep filling meanwhile
+            await self._in_flight.acquire()
+            task = asyncio.create_task(self._process(await self._collect()))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+
+class InferenceServer:
+    def __init__(self, batcher, decode_workers=4):
+        self.batcher = batcher
+        self._decode_executor = ThreadPoolExecutor(max_workers=decode_workers)
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == "/healthz":
+            return 200, {"status": "ok"}
+        if url.path == "/metrics":
+            return 200, self.batcher.metrics.snapshot()
+        if url.path == "/metrics/prometheus":
+            return 200, metrics.prometheus_text()
+        if url.path != "/predict":
+            return 404, {"error": "not found"}
+        if method != "POST":
+            return 405, {"error": "use POST with the image bytes as the body"}
+        if not body:
+            return 400, {"error": "empty body"}
+
+        k = parse_top_k(url.query)
+        if k is None:
+            return 400, {"error": f"top_k must be a whole number from 1 to {len(CLASS_NAMES)}"}
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        trace = metrics.begin_request("http", upload_bytes=len(body))
+        try:
+            try:
+                with metrics.stage("decode"):
+                    array = await loop.run_in_executor(self._decode_executor, decode_image, body)
+            except Exception as e:
+                return 400, {"error": f"cannot decode image: {e}"}
+            with metrics.stage("queue_and_inference"):
+                prediction, queue_wait_ms = await self.batcher.predict(array)
+        except Exception as e:
+            # A failed batch still ends its request, so it shows up in the traces and the error count
+            if trace is not None:
+                trace["error"] = f"{type(e).__name__}: {e}"
+            self.batcher.metrics.errors += 1
+            return 500, {"error": str(e)}
+        finally:
+            metrics.end_request()
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.batcher.metrics.record_request(latency_ms, queue_wait_ms)
+        return 200, {"predictions": format_top_k(prediction, k), "latency_ms": latency_ms}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", "0"))
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "image too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                try:
+                    status, payload = await self.route(method, target, body)
+                except Exception as e:
+                    self.batcher.metrics.errors += 1
+                    status, payload = 500, {"error": str(e)}
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, payload, keep_alive):
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload).encode(), "application/json"
+        head = (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+async def serve(model, host, port, max_batch_size, max_wait_ms, decode_workers):
+    batcher = MicroBatcher(model, max_batch_size, max_wait_ms)
+    server = InferenceServer(batcher, decode_workers)
+    batch_task = asyncio.create_task(batcher.run())
+    async with await asyncio.start_server(server.handle, host, port) as http_server:
+        print(f"Serving on http://{host}:{port} "
+              f"(max_batch_size={max_batch_size}, max_wait_ms={max_wait_ms})", flush=True)
+        try:
+            await http_server.serve_forever()
+        finally:
+            batch_task.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP inference server for the snack classifier")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", default=MODEL_PATH, help="path to the .keras model")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0,
+                        help="how long the first request in a batch waits for others")
+    parser.add_argument("--decode-workers", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=INFERENCE_WORKERS,
+                        help="model worker processes (0 runs the model in this process)")
+    args = parser.parse_args(argv)
+
+    if args.workers > 0:
+        model = InferencePool(args.workers, path=args.model, max_batch_size=args.max_batch_size).start()
+    else:
+        model = load_classifier(args.model)
+    try:
+        asyncio.run(serve(model, args.host, args.port, args.max_batch_size,
+                          args.max_wait_ms, args.decode_workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.workers > 0:
+            model.close()
+
+
+if __name__ == "__main__":
+    main()
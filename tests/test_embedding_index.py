@@ -0,0 +1,96 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from classifier import CLASS_NAMES
+from embedding_index import EmbeddingIndex, color_signature, dhash
+
+DIM = 8
+
+
+def gradient(channel):
+    pixels = np.zeros((256, 256, 3), dtype=np.uint8)
+    pixels[..., channel] = np.linspace(0, 255, 256, dtype=np.uint8)[None, :]
+    return Image.fromarray(pixels)
+
+
+def reencoded(image, quality=70):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return Image.open(io.BytesIO(buffer.getvalue())).convert("RGB")
+
+
+def add(index, image, seed=0):
+    rng = np.random.default_rng(seed)
+    index.add(rng.normal(size=(1, DIM)), rng.dirichlet(np.ones(len(CLASS_NAMES)), size=1),
+              [dhash(image)], colors=[color_signature(image)])
+
+
+def test_same_hash_different_colour_is_not_a_duplicate(tmp_path):
+    red, blue = gradient(0), gradient(2)
+    assert dhash(red) == dhash(blue)
+    index = EmbeddingIndex(str(tmp_path))
+    add(index, red)
+    assert index.find_near_duplicate(dhash(blue), color_signature(blue)) is None
+    assert index.find_near_duplicate(dhash(red), color_signature(red)) == 0
+
+
+def test_solid_colours_are_not_duplicates(tmp_path):
+    green, grey = Image.new("RGB", (256, 256), (0, 160, 0)), Image.new("RGB", (256, 256), (90, 90, 90))
+    assert dhash(green) == dhash(grey)
+    index = EmbeddingIndex(str(tmp_path))
+    add(index, green)
+    assert index.find_near_duplicate(dhash(grey), color_signature(grey)) is None
+
+
+def test_reencoded_copy_is_a_duplicate(tmp_path):
+    rng = np.random.default_rng(1)
+    photo = Image.fromarray(rng.integers(0, 255, size=(32, 32, 3), dtype=np.uint8)).resize((256, 256))
+    copy = reencoded(photo)
+    index = EmbeddingIndex(str(tmp_path))
+    add(index, photo)
+    assert index.find_near_duplicate(dhash(copy), color_signature(copy), max_distance=4) == 0
+
+
+def test_rows_without_colours_never_match(tmp_path):
+    image = gradient(1)
+    index = EmbeddingIndex(str(tmp_path))
+    index.add(np.ones((1, DIM)), np.ones((1, len(CLASS_NAMES))), [dhash(image)])
+    assert index.find_near_duplicate(dhash(image), color_signature(image)) is None
+
+
+def test_max_rows_keeps_the_newest(tmp_path):
+    index = EmbeddingIndex(str(tmp_path), max_rows=10)
+    for i in range(12):
+        index.add(np.eye(DIM)[[i % DIM]], np.ones((1, len(CLASS_NAMES))), [np.uint64(i)], sources=[f"upload-{i}"])
+    assert len(index) <= 10
+    sources = [index.entry(row)["source"] for row in range(len(index))]
+    assert sources == [f"upload-{i}" for i in range(12 - len(index), 12)]
+    # A second reader sees the same rows
+    assert [EmbeddingIndex(str(tmp_path)).entry(row)["source"] for row in range(len(index))] == sources
+
+
+def test_reader_follows_another_process_dropping_rows(tmp_path):
+    writer = EmbeddingIndex(str(tmp_path), max_rows=10)
+    no_colour = np.zeros(len(color_signature(gradient(0))))
+
+    def add_row(i):
+        prediction = np.zeros((1, len(CLASS_NAMES)))
+        prediction[0, 0] = i
+        writer.add(np.eye(DIM)[[i % DIM]], prediction, [np.uint64(i)], sources=[f"upload-{i}"], colors=[no_colour])
+
+    for i in range(9):
+        add_row(i)
+    reader = EmbeddingIndex(str(tmp_path))
+    # The reader maps the columns and parses the labels before the writer truncates them
+    assert [reader.entry(row)["source"] for row in range(len(reader))] == [f"upload-{i}" for i in range(9)]
+    for i in range(9, 12):
+        add_row(i)
+
+    for row in range(len(reader)):
+        entry = reader.entry(row)
+        assert entry["source"] == f"upload-{int(entry['prediction'][0])}"
+    row = reader.find_near_duplicate(np.uint64(11), no_colour)
+    assert reader.entry(row)["source"] == "upload-11"
+    assert reader.entry(row)["prediction"][0] == 11
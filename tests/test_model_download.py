@@ -0,0 +1,127 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from model_download import ChecksumError, fetch
+
+PAYLOAD = bytes(range(256)) * 4096 * 3  # 3 MiB, three download chunks
+
+
+class ModelHandler(BaseHTTPRequestHandler):
+    """Serves PAYLOAD with Range support; truncate_to cuts the body short to simulate a dropped connection."""
+
+    payload = PAYLOAD
+    etag = None
+    truncate_to = None
+    always_416 = False
+    ranges = []
+
+    def do_GET(self):
+        requested = self.headers.get("Range")
+        type(self).ranges.append(requested)
+        start = int(requested.removeprefix("bytes=").rstrip("-")) if requested else 0
+        if start >= len(self.payload) or self.always_416:
+            self.send_response(416)
+            self.end_headers()
+            return
+        body = self.payload[start:]
+        self.send_response(206 if requested else 200)
+        self.send_header("Content-Length", str(len(body)))
+        if requested:
+            self.send_header("Content-Range", f"bytes {start}-{len(self.payload) - 1}/{len(self.payload)}")
+        if self.etag:
+            self.send_header("ETag", f'"{self.etag}"')
+        self.end_headers()
+        if self.truncate_to is not None:
+            body = body[:self.truncate_to]
+            self.close_connection = True
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    handler = type("Handler", (ModelHandler,), {"ranges": []})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield handler, f"http://127.0.0.1:{httpd.server_address[1]}/model.keras"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_installs_the_file(server, tmp_path):
+    handler, url = server
+    path = str(tmp_path / "model.keras")
+    assert fetch(url, path, hashlib.sha256(PAYLOAD).hexdigest()) == path
+    assert (tmp_path / "model.keras").read_bytes() == PAYLOAD
+    assert not (tmp_path / "model.keras.part").exists()
+
+
+def test_resumes_from_a_partial_file(server, tmp_path):
+    handler, url = server
+    half = len(PAYLOAD) // 2
+    (tmp_path / "model.keras.part").write_bytes(PAYLOAD[:half])
+    progress = []
+    fetch(url, str(tmp_path / "model.keras"), hashlib.sha256(PAYLOAD).hexdigest(),
+          progress=lambda done, total: progress.append((done, total)))
+    assert handler.ranges == [f"bytes={half}-"]
+    assert (tmp_path / "model.keras").read_bytes() == PAYLOAD
+    # The hash covers the bytes already on disk, and progress starts from them
+    assert progress[-1] == (len(PAYLOAD), len(PAYLOAD))
+
+
+def test_checksum_mismatch_installs_nothing(server, tmp_path):
+    handler, url = server
+    with pytest.raises(ChecksumError):
+        fetch(url, str(tmp_path / "model.keras"), "0" * 64)
+    assert not (tmp_path / "model.keras").exists()
+    assert not (tmp_path / "model.keras.part").exists()
+
+
+def test_checksum_from_the_etag(server, tmp_path):
+    handler, url = server
+    handler.etag = "f" * 64
+    with pytest.raises(ChecksumError):
+        fetch(url, str(tmp_path / "model.keras"))
+    assert not (tmp_path / "model.keras").exists()
+
+
+def test_interrupted_download_is_not_installed_then_resumes(server, tmp_path):
+    handler, url = server
+    path = str(tmp_path / "model.keras")
+    handler.truncate_to = len(PAYLOAD) * 5 // 6
+    with pytest.raises(Exception):
+        fetch(url, path, hashlib.sha256(PAYLOAD).hexdigest(), max_retries=0)
+    # Only the .part file holds the chunks that arrived; the model path is never half written
+    assert not (tmp_path / "model.keras").exists()
+    written = (tmp_path / "model.keras.part").stat().st_size
+    assert 0 < written < len(PAYLOAD)
+
+    handler.truncate_to = None
+    fetch(url, path, hashlib.sha256(PAYLOAD).hexdigest())
+    assert handler.ranges[-1] == f"bytes={written}-"
+    assert (tmp_path / "model.keras").read_bytes() == PAYLOAD
+
+
+def test_existing_file_is_not_downloaded_again(server, tmp_path):
+    handler, url = server
+    (tmp_path / "model.keras").write_bytes(b"installed")
+    fetch(url, str(tmp_path / "model.keras"))
+    assert handler.ranges == []
+
+
+def test_server_that_keeps_answering_416_fails_cleanly(server, tmp_path):
+    handler, url = server
+    handler.always_416 = True
+    (tmp_path / "model.keras.part").write_bytes(PAYLOAD[:1024])
+    with pytest.raises(requests.exceptions.HTTPError):
+        fetch(url, str(tmp_path / "model.keras"))
+    # The stale partial file is dropped and the download retried once from the start
+    assert handler.ranges == ["bytes=1024-", None]
+    assert not (tmp_path / "model.keras").exists()
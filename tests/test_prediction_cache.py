@@ -0,0 +1,64 @@
+import os
+import time
+
+import numpy as np
+
+from prediction_cache import PredictionCache, cache_key
+
+
+def prediction(value):
+    return np.full(3, value, dtype=np.float32)
+
+
+def test_memory_tier_is_lru(tmp_path):
+    cache = PredictionCache(max_entries=2, cache_dir=None)
+    cache.put("a", prediction(1))
+    cache.put("b", prediction(2))
+    cache.get("a")
+    cache.put("c", prediction(3))
+    assert cache.get("b") is None
+    np.testing.assert_array_equal(cache.get("a"), prediction(1))
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    PredictionCache(cache_dir=str(tmp_path)).put("a", prediction(1))
+    cache = PredictionCache(cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(cache.get("a"), prediction(1))
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_expired_entries_are_not_served(tmp_path):
+    cache = PredictionCache(ttl_seconds=60, cache_dir=str(tmp_path))
+    cache.put("a", prediction(1))
+    old = time.time() - 120
+    os.utime(tmp_path / "a.npy", (old, old))
+    cache.clear()
+    assert cache.get("a") is None
+    assert not (tmp_path / "a.npy").exists()
+
+
+def test_disk_tier_evicts_oldest_first(tmp_path):
+    cache = PredictionCache(cache_dir=str(tmp_path), disk_max_entries=10)
+    for i in range(11):
+        cache.put(f"k{i}", prediction(i))
+        stamp = time.time() - 100 + i
+        os.utime(tmp_path / f"k{i}.npy", (stamp, stamp))
+    remaining = sorted(p.stem for p in tmp_path.glob("*.npy"))
+    # Pruned down to 90% of the limit, oldest first
+    assert remaining == sorted(f"k{i}" for i in range(2, 11))
+    assert cache.stats()["disk_evictions"] == 2
+
+
+def test_disk_limit_counts_files_already_on_disk(tmp_path):
+    first = PredictionCache(cache_dir=str(tmp_path), disk_max_entries=4)
+    for i in range(4):
+        first.put(f"k{i}", prediction(i))
+    second = PredictionCache(cache_dir=str(tmp_path), disk_max_entries=4)
+    second.put("new", prediction(9))
+    assert len(list(tmp_path.glob("*.npy"))) <= 4
+    assert (tmp_path / "new.npy").exists()
+
+
+def test_cache_key_depends_on_model():
+    assert cache_key(b"image", "model-a") != cache_key(b"image", "model-b")
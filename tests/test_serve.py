@@ -0,0 +1,109 @@
+import asyncio
+import io
+
+import numpy as np
+from PIL import Image
+
+import metrics
+from classifier import CLASS_NAMES, IMAGE_SIZE
+from serve import InferenceServer, MicroBatcher, parse_top_k
+
+
+class RowModel:
+    """Stands in for the classifier: the score of class 0 is the image's pixel value, so rows can be told apart."""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        self.batch_sizes.append(len(batch))
+        scores = np.zeros((len(batch), len(CLASS_NAMES)), dtype=np.float32)
+        scores[:, 0] = batch[:, 0, 0, 0]
+        return scores
+
+
+def image(value):
+    return np.full((*IMAGE_SIZE, 3), value, dtype=np.uint8)
+
+
+def test_concurrent_requests_share_a_batch_and_get_their_own_row():
+    model = RowModel()
+
+    async def scenario():
+        batcher = MicroBatcher(model, max_batch_size=8, max_wait_ms=50)
+        runner = asyncio.create_task(batcher.run())
+        try:
+            return await asyncio.gather(*(batcher.predict(image(v)) for v in range(1, 6)))
+        finally:
+            runner.cancel()
+
+    results = asyncio.run(scenario())
+    assert [prediction[0] for prediction, _ in results] == [1, 2, 3, 4, 5]
+    assert model.batch_sizes == [5]
+
+
+def test_batches_are_capped_at_max_batch_size():
+    model = RowModel()
+
+    async def scenario():
+        batcher = MicroBatcher(model, max_batch_size=2, max_wait_ms=50)
+        runner = asyncio.create_task(batcher.run())
+        try:
+            await asyncio.gather(*(batcher.predict(image(v)) for v in range(5)))
+        finally:
+            runner.cancel()
+
+    asyncio.run(scenario())
+    assert sorted(model.batch_sizes) == [1, 2, 2]
+
+
+def test_model_errors_reach_every_request_in_the_batch(monkeypatch):
+    class Broken(RowModel):
+        def predict(self, batch, batch_size=None, verbose=0):
+            raise RuntimeError("model failed")
+
+    async def scenario():
+        batcher = MicroBatcher(Broken(), max_batch_size=4, max_wait_ms=20)
+        runner = asyncio.create_task(batcher.run())
+        try:
+            return await asyncio.gather(*(batcher.predict(image(v)) for v in range(3)), return_exceptions=True)
+        finally:
+            runner.cancel()
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(scenario()))
+
+    # Through the HTTP route every failed request is answered, counted and its trace closed
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    monkeypatch.setattr(metrics, "registry", metrics.Registry())
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64)).save(buffer, format="PNG")
+
+    async def through_route():
+        server = InferenceServer(MicroBatcher(Broken(), max_batch_size=4, max_wait_ms=20))
+        runner = asyncio.create_task(server.batcher.run())
+        try:
+            responses = await asyncio.gather(*(server.route("POST", "/predict", buffer.getvalue()) for _ in range(3)))
+        finally:
+            runner.cancel()
+        return server, responses
+
+    server, responses = asyncio.run(through_route())
+    assert [status for status, _ in responses] == [500] * 3
+    assert server.batcher.metrics.errors == 3
+    assert metrics.registry.histograms["request"].count == 3
+    assert [trace["error"] for trace in metrics.registry.recent_traces] == ["RuntimeError: model failed"] * 3
+
+
+def test_parse_top_k():
+    assert parse_top_k("") == 5
+    assert parse_top_k("top_k=3") == 3
+    assert parse_top_k(f"top_k={len(CLASS_NAMES)}") == len(CLASS_NAMES)
+    for bad in ("top_k=abc", "top_k=0", "top_k=-2", f"top_k={len(CLASS_NAMES) + 1}", "top_k=1.5"):
+        assert parse_top_k(bad) is None
+
+
+def test_bad_top_k_is_a_400():
+    server = InferenceServer(MicroBatcher(RowModel()))
+    status, payload = asyncio.run(server.route("POST", "/predict?top_k=abc", b"image"))
+    assert status == 400
+    assert "top_k" in payload["error"]
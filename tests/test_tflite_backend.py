@@ -0,0 +1,39 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from classifier import CLASS_NAMES, IMAGE_SIZE
+from tflite_backend import artifact_path, main
+
+keras = pytest.importorskip("keras")
+
+
+@pytest.fixture
+def tiny_model(tmp_path):
+    inputs = keras.Input((*IMAGE_SIZE, 3))
+    x = keras.layers.Conv2D(4, 3, strides=8, activation="relu")(inputs)
+    x = keras.layers.GlobalAveragePooling2D()(x)
+    outputs = keras.layers.Dense(len(CLASS_NAMES), activation="softmax")(x)
+    path = str(tmp_path / "tiny.keras")
+    keras.Model(inputs, outputs).save(path)
+    calibration = tmp_path / "calibration"
+    calibration.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(4):
+        Image.fromarray(rng.integers(0, 255, (300, 400, 3), dtype=np.uint8)).save(calibration / f"{i}.jpg")
+    return path, str(calibration)
+
+
+def test_conversion_cli_converts_the_keras_model(tiny_model):
+    # The serving defaults (compiled mode, cascade) must not leak into the converter's input
+    path, calibration = tiny_model
+    with pytest.raises(SystemExit):
+        main(["--mode", "dynamic", "--model", path, "--calibration-dir", calibration])
+    with open(artifact_path(path, "dynamic") + ".json") as f:
+        metadata = json.load(f)
+    assert metadata["mode"] == "dynamic"
+    assert metadata["parity"]["samples"] == 4
+    assert os.path.getsize(artifact_path(path, "dynamic")) > 0
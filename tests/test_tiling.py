@@ -0,0 +1,85 @@
+import numpy as np
+from PIL import Image
+
+from classifier import CLASS_NAMES, IMAGE_SIZE
+from tiling import detect, grid_shape, merge, tiles
+
+
+def one_hot(index, confidence=0.9):
+    prediction = np.full(len(CLASS_NAMES), (1 - confidence) / (len(CLASS_NAMES) - 1), dtype=np.float32)
+    prediction[index] = confidence
+    return prediction
+
+
+class ColourModel:
+    """Class 0 for mostly red tiles, class 1 for mostly blue ones, unsure about anything else."""
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        means = batch.reshape(len(batch), -1, 3).mean(axis=1)
+        predictions = []
+        for red, _, blue in means:
+            if red > blue + 40:
+                predictions.append(one_hot(0))
+            elif blue > red + 40:
+                predictions.append(one_hot(1))
+            else:
+                predictions.append(np.full(len(CLASS_NAMES), 1 / len(CLASS_NAMES), dtype=np.float32))
+        return np.array(predictions)
+
+
+def platter():
+    # Two textured "snacks" on a plain tray: red on the left, blue on the right
+    rng = np.random.default_rng(0)
+    pixels = np.full((768, 1024, 3), 200, dtype=np.uint8)
+    pixels[200:560, 60:420] = np.clip(rng.normal((220, 40, 40), 30, (360, 360, 3)), 0, 255)
+    pixels[200:560, 600:960] = np.clip(rng.normal((40, 40, 220), 30, (360, 360, 3)), 0, 255)
+    return Image.fromarray(pixels)
+
+
+def test_merge_labels_each_cell_from_the_tiles_covering_it():
+    size = (200, 100)
+    boxes = [(0, 0, 100, 100), (100, 0, 200, 100)]
+    _, label_map, confidence = merge(boxes, [one_hot(2), one_hot(5)], size, grid=4)
+    rows, cols = grid_shape(size, 4)
+    assert label_map.shape == (rows, cols)
+    assert (label_map[:, :cols // 2] == 2).all()
+    assert (label_map[:, cols // 2:] == 5).all()
+    assert np.allclose(confidence, 0.9)
+
+
+def test_merge_averages_overlaps_and_drops_unsure_and_background_cells():
+    size = (100, 100)
+    boxes = [(0, 0, 100, 100), (0, 0, 50, 100)]
+    predictions = [one_hot(2, 0.6), one_hot(5, 0.6)]
+    background = np.zeros(grid_shape(size, 4), dtype=bool)
+    background[0, -1] = True
+    _, label_map, _ = merge(boxes, predictions, size, grid=4, min_confidence=0.5, background=background)
+    # Where the two tiles overlap neither class reaches 0.5
+    assert (label_map[:, :2] == -1).all()
+    assert label_map[1, -1] == 2
+    assert label_map[0, -1] == -1
+
+
+def test_tiles_are_views_of_one_resized_array():
+    image = Image.new("RGB", (1024, 768))
+    for box, view in tiles(image, scales=(0.5,), overlap=0.5):
+        assert view.shape == (*IMAGE_SIZE, 3)
+        assert view.base is not None
+        left, top, right, bottom = box
+        assert 0 <= left < right <= 1024 and 0 <= top < bottom <= 768
+
+
+def test_detect_finds_both_snacks_and_skips_the_tray():
+    result = detect(ColourModel(), platter())
+    assert result["classified"] < result["tiles"]
+    assert set(result["snacks"]) == {CLASS_NAMES[0], CLASS_NAMES[1]}
+    boxes = {region["label"]: region["box"] for region in result["regions"]}
+    red_center = (boxes[CLASS_NAMES[0]][0] + boxes[CLASS_NAMES[0]][2]) / 2
+    blue_center = (boxes[CLASS_NAMES[1]][0] + boxes[CLASS_NAMES[1]][2]) / 2
+    assert red_center < 512 < blue_center
+
+
+def test_detect_on_an_empty_tray_classifies_nothing():
+    result = detect(ColourModel(), Image.new("RGB", (800, 600), (200, 200, 200)))
+    assert result["classified"] == 0
+    assert result["regions"] == []
@@ -0,0 +1,59 @@
+import threading
+
+import numpy as np
+import pytest
+
+from classifier import IMAGE_SIZE
+from worker_pool import InferencePool, PoolClosedError
+
+
+def image_batch(count=1):
+    return np.zeros((count, *IMAGE_SIZE, 3), dtype=np.uint8)
+
+
+def pool_with_slots(slots):
+    # No worker processes: jobs stay pending, which is the state close() has to clean up
+    pool = InferencePool(workers=1, path="unused.keras", max_batch_size=2)
+    for slot in range(slots):
+        pool._buffers.append(np.zeros((2, *IMAGE_SIZE, 3), dtype=np.uint8))
+        pool._free_slots.put(slot)
+    return pool
+
+
+def test_submit_after_close_raises():
+    pool = pool_with_slots(1)
+    pool.close()
+    with pytest.raises(PoolClosedError):
+        pool.submit(image_batch())
+
+
+def test_pending_jobs_fail_on_close():
+    pool = pool_with_slots(1)
+    future = pool.submit(image_batch())
+    pool.close()
+    assert isinstance(future.exception(timeout=1), PoolClosedError)
+
+
+def test_submit_waiting_for_a_slot_fails_on_close():
+    pool = pool_with_slots(0)
+    errors = []
+
+    def submit():
+        try:
+            pool.submit(image_batch())
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=submit)
+    thread.start()
+    thread.join(timeout=0.2)
+    assert thread.is_alive()
+    pool.close()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert isinstance(errors[0], PoolClosedError)
+
+
+def test_oversized_batch_is_rejected():
+    with pytest.raises(ValueError):
+        pool_with_slots(1).submit(image_batch(3))
@@ -0,0 +1,202 @@
+"""TFLite inference backend for CPU-only nodes.
+
+The Keras model is converted once per quantization mode and cached next to
+MODEL_PATH as ``<model>.<mode>.tflite`` with a ``.json`` sidecar holding the
+source model fingerprint and the parity report. A converted model is only used
+when its parity report against the Keras model passes; otherwise the Keras
+model is kept.
+
+Convert and check parity ahead of a rollout:
+    python tflite_backend.py --mode int8 --calibration-dir data/calibration
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from classifier import IMAGE_SIZE, MODEL_PATH, available_cpus, decode_image
+from prediction_cache import model_identity
+
+logger = logging.getLogger(__name__)
+
+MODES = ("dynamic", "float16", "int8")
+# Bump when the converted graph's contract changes (2: uint8 input with in-graph preprocessing)
+ARTIFACT_VERSION = 2
+NUM_THREADS = int(os.environ.get("TFLITE_NUM_THREADS", "0")) or available_cpus()
+CALIBRATION_DIR = os.environ.get("TFLITE_CALIBRATION_DIR")
+CALIBRATION_SAMPLES = int(os.environ.get("TFLITE_CALIBRATION_SAMPLES", "200"))
+# Parity gate: minimum top-1 agreement and maximum per-class probability drift
+MIN_TOP1_AGREEMENT = float(os.environ.get("TFLITE_MIN_TOP1_AGREEMENT", "0.99"))
+MAX_SCORE_DRIFT = float(os.environ.get("TFLITE_MAX_SCORE_DRIFT", "0.05"))
+
+
+def artifact_path(model_path, mode):
+    return f"{os.path.splitext(model_path)[0]}.{mode}.tflite"
+
+
+def load_calibration_set(directory, limit=CALIBRATION_SAMPLES):
+    arrays = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(directory, filename), "rb") as f:
+                arrays.append(decode_image(f.read()))
+            if len(arrays) == limit:
+                break
+    if not arrays:
+        raise ValueError(f"no calibration images found in {directory}")
+    return np.stack(arrays)
+
+
+def convert(model, mode, calibration=None):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == "int8":
+        if calibration is None:
+            raise ValueError("int8 quantization needs a calibration set")
+        converter.representative_dataset = lambda: ([sample[None]] for sample in calibration)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        # The uint8 image input stays as-is; only the output is quantized
+        converter.inference_output_type = tf.int8
+    elif mode != "dynamic":
+        raise ValueError(f"unknown TFLite mode {mode!r}, expected one of {MODES}")
+    return converter.convert()
+
+
+class TFLiteClassifier:
+    """Wraps a TFLite interpreter behind the subset of the Keras predict API we use."""
+
+    def __init__(self, model_content=None, model_path=None, num_threads=NUM_THREADS, backend="tflite"):
+        # Reported in the model identity, so cached scores never mix with the Keras model's
+        self.backend = backend
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:  # tf.lite.Interpreter is deprecated but still ships with TensorFlow
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(
+            model_content=model_content, model_path=model_path, num_threads=num_threads
+        )
+        self._input_index = self.interpreter.get_input_details()[0]["index"]
+        self._output_index = self.interpreter.get_output_details()[0]["index"]
+        self._batch_len = None
+        # Interpreter tidak thread-safe, sesi Streamlit berjalan di thread berbeda
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_len):
+        if batch_len != self._batch_len:
+            self.interpreter.resize_tensor_input(self._input_index, [batch_len, *IMAGE_SIZE, 3])
+            self.interpreter.allocate_tensors()
+            self._batch_len = batch_len
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        batch = np.asarray(batch)
+        with self._lock:
+            self._resize(len(batch))
+            input_details = self.interpreter.get_input_details()[0]
+            scale, zero_point = input_details["quantization"]
+            if scale and input_details["dtype"] != batch.dtype:
+                info = np.iinfo(input_details["dtype"])
+                batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max)
+            self.interpreter.set_tensor(self._input_index, batch.astype(input_details["dtype"]))
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output_index).copy()
+            scale, zero_point = self.interpreter.get_output_details()[0]["quantization"]
+        if scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+def check_parity(keras_model, tflite_model, images, batch_size=16):
+    expected = keras_model.predict(images, batch_size=batch_size, verbose=0)
+    actual = np.concatenate([
+        tflite_model.predict(images[start:start + batch_size])
+        for start in range(0, len(images), batch_size)
+    ])
+    drift = np.abs(expected - actual)
+    report = {
+        "samples": len(images),
+        "top1_agreement": float(np.mean(expected.argmax(axis=1) == actual.argmax(axis=1))),
+        "max_score_drift": float(drift.max()),
+        "mean_score_drift": float(drift.mean()),
+    }
+    report["passed"] = (report["top1_agreement"] >= MIN_TOP1_AGREEMENT
+                        and report["max_score_drift"] <= MAX_SCORE_DRIFT)
+    return report
+
+
+def build(keras_model, mode, model_path=MODEL_PATH, calibration_dir=CALIBRATION_DIR):
+    """Convert, parity-check and cache the artifact. Returns the parity report."""
+    if not calibration_dir:
+        raise ValueError("set TFLITE_CALIBRATION_DIR to a folder of labelled sample images "
+                         "so the converted model can be checked against the Keras model")
+    images = load_calibration_set(calibration_dir)
+    content = convert(keras_model, mode, images if mode == "int8" else None)
+    report = check_parity(keras_model, TFLiteClassifier(model_content=content), images)
+
+    path = artifact_path(model_path, mode)
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    with open(path + ".json", "w") as f:
+        json.dump({"version": ARTIFACT_VERSION, "source": model_identity(model_path),
+                   "mode": mode, "parity": report}, f, indent=2)
+    logger.info("converted %s to %s: %s", model_path, path, report)
+    return report
+
+
+def load_backend(keras_model, backend, model_path=MODEL_PATH, num_threads=0):
+    # backend: "tflite-dynamic", "tflite-float16" or "tflite-int8"; num_threads 0 = NUM_THREADS
+    num_threads = num_threads or NUM_THREADS
+    mode = backend.removeprefix("tflite-")
+    path = artifact_path(model_path, mode)
+    try:
+        with open(path + ".json") as f:
+            metadata = json.load(f)
+        if metadata["source"] != model_identity(model_path):
+            raise ValueError("artifact was converted from a different model file")
+        if metadata.get("version") != ARTIFACT_VERSION:
+            raise ValueError("artifact was converted by an older version of this backend")
+        report = metadata["parity"]
+    except (OSError, ValueError, KeyError):
+        try:
+            report = build(keras_model, mode, model_path)
+        except Exception:
+            logger.exception("TFLite %s conversion failed, using the Keras model", mode)
+            return keras_model
+
+    if not report["passed"]:
+        logger.warning("TFLite %s failed the parity gate (%s), using the Keras model", mode, report)
+        return keras_model
+    logger.info("using TFLite %s backend with %d threads", mode, num_threads)
+    return TFLiteClassifier(model_path=path, num_threads=num_threads, backend=backend)
+
+
+def main(argv=None):
+    from classifier import load_classifier
+
+    parser = argparse.ArgumentParser(description="Convert the classifier to TFLite and check parity")
+    parser.add_argument("--mode", choices=MODES, default="dynamic")
+    parser.add_argument("--model", default=MODEL_PATH, help="path to the .keras model")
+    parser.add_argument("--calibration-dir", default=CALIBRATION_DIR, required=CALIBRATION_DIR is None,
+                        help="folder of sample images used for int8 calibration and the parity check")
+    args = parser.parse_args(argv)
+
+    # The converter needs the Keras model itself, not the compiled or cascade wrapper around it
+    keras_model = load_classifier(args.model, backend="keras", serving_mode="predict", cascade=False)
+    report = build(keras_model, args.mode, args.model, args.calibration_dir)
+    print(json.dumps(report, indent=2))
+    raise SystemExit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
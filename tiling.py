@@ -0,0 +1,202 @@
+"""Several snacks in one photo: classify overlapping tiles and merge them into regions.
+
+    image = load_image(upload, draft_size=PLATTER_SIZE)
+    result = detect(model, image)
+    st.image(overlay(image, result))
+
+The photo is decoded once. For each scale it is resized once so that a tile
+is exactly the model's 256x256 input. Every tile is then a slice of that
+array, a view, with no per-tile resize or copy until it is written into the
+batch. Tiles whose pixels barely vary (empty tray, tablecloth) are skipped
+before inference. The remaining tiles go through the model in a single
+forward pass.
+
+Each tile's class scores are spread over a coarse grid and averaged where
+tiles overlap. Connected cells with the same confident label become a
+region.
+"""
+import os
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from classifier import CLASS_NAMES, IMAGE_SIZE, MAX_BATCH_SIZE, batch_pool, fill_batch
+
+# Platters are decoded at roughly this size; smaller tiles than this resolution allows would only be upscaled
+PLATTER_SIZE = (1024, 1024)
+# Tile side as a fraction of the photo's shorter side; one pass per scale
+TILE_SCALES = tuple(float(s) for s in os.environ.get("TILE_SCALES", "0.5,0.33").split(","))
+# Fraction of a tile shared with its neighbour
+TILE_OVERLAP = float(os.environ.get("TILE_OVERLAP", "0.5"))
+# Tiles with a pixel standard deviation below this (0-255) are background
+TILE_MIN_DETAIL = float(os.environ.get("TILE_MIN_DETAIL", "12"))
+# The most detailed tiles are kept up to this many; the default fits one pooled batch buffer
+TILE_MAX_TILES = int(os.environ.get("TILE_MAX_TILES", str(MAX_BATCH_SIZE)))
+# Cells whose averaged top score is below this are left unlabelled
+TILE_MIN_CONFIDENCE = float(os.environ.get("TILE_MIN_CONFIDENCE", "0.5"))
+# Regions smaller than this share of the grid are dropped
+TILE_MIN_REGION = 0.02
+GRID_CELLS = 16
+# Pixels sampled per side by the background test
+DETAIL_SAMPLES = 32
+OVERLAY_ALPHA = 96
+PALETTE = [
+    (230, 25, 75), (60, 180, 75), (255, 225, 25), (0, 130, 200), (245, 130, 48), (145, 30, 180), (70, 240, 240),
+    (240, 50, 230), (210, 245, 60), (250, 190, 212), (0, 128, 128), (220, 190, 255), (170, 110, 40), (128, 0, 0),
+]
+
+
+def _positions(length, tile, stride):
+    positions = list(range(0, max(1, length - tile + 1), stride))
+    if positions[-1] + tile < length:
+        positions.append(length - tile)  # Last tile flush with the edge
+    return positions
+
+
+def tiles(image, scales=TILE_SCALES, overlap=TILE_OVERLAP):
+    """Yield (box, view): box (left, top, right, bottom) in image pixels, view a 256x256x3 uint8 slice."""
+    tile = IMAGE_SIZE[0]
+    stride = max(1, round(tile * (1 - overlap)))
+    for scale in scales:
+        factor = tile / (scale * min(image.size))
+        # Never below the model's input; a tile can not be bigger than the photo
+        size = (max(tile, round(image.width * factor)), max(tile, round(image.height * factor)))
+        array = np.asarray(image.resize(size, Image.BILINEAR))
+        ratio_x, ratio_y = image.width / size[0], image.height / size[1]
+        for top in _positions(size[1], tile, stride):
+            for left in _positions(size[0], tile, stride):
+                box = (left * ratio_x, top * ratio_y, (left + tile) * ratio_x, (top + tile) * ratio_y)
+                yield box, array[top:top + tile, left:left + tile]
+
+
+def detail(view):
+    step = max(1, len(view) // DETAIL_SAMPLES)
+    return float(view[::step, ::step].std())
+
+
+def _regions(label_map, confidence, min_cells):
+    # 4-connected components of equal labels; the grid is small enough for a plain BFS
+    rows, cols = label_map.shape
+    seen = np.zeros_like(label_map, dtype=bool)
+    regions = []
+    for y in range(rows):
+        for x in range(cols):
+            label = label_map[y, x]
+            if seen[y, x] or label < 0:
+                continue
+            cells, queue = [], deque([(y, x)])
+            seen[y, x] = True
+            while queue:
+                cy, cx = queue.popleft()
+                cells.append((cy, cx))
+                for ny, nx in ((cy - 1, cx), (cy + 1, cx), (cy, cx - 1), (cy, cx + 1)):
+                    if 0 <= ny < rows and 0 <= nx < cols and not seen[ny, nx] and label_map[ny, nx] == label:
+                        seen[ny, nx] = True
+                        queue.append((ny, nx))
+            if len(cells) < min_cells:
+                for cell in cells:
+                    label_map[cell] = -1
+                continue
+            ys, xs = zip(*cells)
+            regions.append({
+                "label": CLASS_NAMES[label],
+                "confidence": float(np.mean([confidence[c] for c in cells])),
+                "cells": (min(ys), min(xs), max(ys) + 1, max(xs) + 1),
+                "area": len(cells) / label_map.size,
+            })
+    return sorted(regions, key=lambda r: -r["area"])
+
+
+def grid_shape(size, grid=GRID_CELLS):
+    width, height = size
+    cell = min(width, height) / grid
+    return max(1, round(height / cell)), max(1, round(width / cell))
+
+
+def cell_details(image, shape, pixels=8):
+    # The background test per grid cell, on a copy shrunk to a few pixels per cell
+    rows, cols = shape
+    array = np.asarray(image.resize((cols * pixels, rows * pixels), Image.BILINEAR), dtype=np.float32)
+    return array.reshape(rows, pixels, cols, pixels, -1).std(axis=(1, 3, 4))
+
+
+def merge(boxes, predictions, size, grid=GRID_CELLS, min_confidence=TILE_MIN_CONFIDENCE, background=None):
+    """Average tile scores over a grid; returns (scores, label_map, confidence) per cell.
+
+    Cells marked in background stay unlabelled even when a large tile covering them was confident.
+    """
+    width, height = size
+    rows, cols = grid_shape(size, grid)
+    scores = np.zeros((rows, cols, len(CLASS_NAMES)), dtype=np.float32)
+    coverage = np.zeros((rows, cols, 1), dtype=np.float32)
+    for (left, top, right, bottom), prediction in zip(boxes, predictions):
+        y0, y1 = int(top / height * rows), max(int(top / height * rows) + 1, round(bottom / height * rows))
+        x0, x1 = int(left / width * cols), max(int(left / width * cols) + 1, round(right / width * cols))
+        scores[y0:y1, x0:x1] += prediction
+        coverage[y0:y1, x0:x1] += 1
+    scores /= np.maximum(coverage, 1)
+    confidence = scores.max(axis=2)
+    labelled = (coverage[..., 0] > 0) & (confidence >= min_confidence)
+    if background is not None:
+        labelled &= ~background
+    label_map = np.where(labelled, scores.argmax(axis=2), -1)
+    return scores, label_map, confidence
+
+
+def detect(model, image, scales=TILE_SCALES, overlap=TILE_OVERLAP, min_detail=TILE_MIN_DETAIL,
+           max_tiles=TILE_MAX_TILES, slot=nullcontext):
+    """Find the snacks on a platter photo (PIL RGB). slot() is entered around the forward pass."""
+    candidates = list(tiles(image, scales, overlap))
+    details = [detail(view) for _, view in candidates]
+    kept = [i for i in np.argsort(details)[::-1] if details[i] >= min_detail][:max_tiles]
+    result = {"tiles": len(candidates), "classified": len(kept), "regions": [], "snacks": {}}
+    if not kept:
+        return result
+
+    boxes = [candidates[i][0] for i in kept]
+    with slot(), batch_pool.batch(len(kept)) as batch:
+        fill_batch(batch, [candidates[i][1] for i in kept])
+        # One forward pass for every tile
+        predictions = model.predict(batch, batch_size=len(kept), verbose=0)
+
+    background = cell_details(image, grid_shape(image.size)) < min_detail
+    scores, label_map, confidence = merge(boxes, predictions, image.size, background=background)
+    rows, cols = label_map.shape
+    cell_w, cell_h = image.width / cols, image.height / rows
+    for region in _regions(label_map, confidence, max(1, round(TILE_MIN_REGION * label_map.size))):
+        y0, x0, y1, x1 = region.pop("cells")
+        region["box"] = (x0 * cell_w, y0 * cell_h, x1 * cell_w, y1 * cell_h)
+        result["regions"].append(region)
+        best = result["snacks"].get(region["label"], 0.0)
+        result["snacks"][region["label"]] = max(best, region["confidence"])
+    result.update(label_map=label_map, scores=scores)
+    return result
+
+
+def overlay(image, result, alpha=OVERLAY_ALPHA):
+    """The photo with each region tinted in its class colour and outlined with its label."""
+    base = image.convert("RGBA")
+    if "label_map" not in result:
+        return base.convert("RGB")
+    label_map = result["label_map"]
+    tint = np.zeros((*label_map.shape, 4), dtype=np.uint8)
+    for region in result["regions"]:
+        index = CLASS_NAMES.index(region["label"])
+        tint[label_map == index] = (*PALETTE[index % len(PALETTE)], alpha)
+    base.alpha_composite(Image.fromarray(tint, "RGBA").resize(image.size, Image.NEAREST))
+    draw = ImageDraw.Draw(base)
+    try:
+        font = ImageFont.load_default(size=max(12, image.width // 60))
+    except TypeError:  # Pillow < 10.1 only has the small bitmap font
+        font = ImageFont.load_default()
+    for region in result["regions"]:
+        color = PALETTE[CLASS_NAMES.index(region["label"]) % len(PALETTE)]
+        draw.rectangle(region["box"], outline=color, width=max(2, image.width // 300))
+        text = f"{region['label'].replace('_', ' ').title()} {region['confidence'] * 100:.0f}%"
+        left, top = region["box"][:2]
+        text_box = draw.textbbox((left + 4, top + 4), text, font=font)
+        draw.rectangle(text_box, fill=color)
+        draw.text((left + 4, top + 4), text, fill=(0, 0, 0), font=font)
+    return base.convert("RGB")
@@ -0,0 +1,350 @@
+"""Pool of inference worker processes fed through shared memory.
+
+    pool = InferencePool(workers=4).start()
+    predictions = pool.predict(batch)              # blocking, same contract as model.predict
+    future = pool.submit(batch, embeddings=True)   # concurrent.futures.Future
+
+Each worker process loads its own copy of the model with a fixed number of
+intra-op threads, pinned to its own cores when there are enough of them, so
+concurrent sessions run side by side instead of queueing on one interpreter.
+Batches are written into preallocated multiprocessing.shared_memory slots and
+only the slot number crosses the pipe; the results (a few KB of scores) come
+back pickled. A supervisor thread hands jobs to idle workers and restarts any
+worker that dies.
+
+Enable in the app and in serve.py with INFERENCE_WORKERS=<n>.
+"""
+import atexit
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import types
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from classifier import IMAGE_SIZE, MAX_BATCH_SIZE, MODEL_PATH, MODEL_URL, available_cpus, download_model
+
+# 0 keeps inference in the calling process
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "0"))
+# Intra-op threads per worker; 0 splits the available cores evenly
+THREADS_PER_WORKER = int(os.environ.get("INFERENCE_THREADS_PER_WORKER", "0"))
+PIN_WORKERS = os.environ.get("INFERENCE_PIN_WORKERS", "1") == "1"
+MAX_RESTART_DELAY = 30.0
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCrashedError(RuntimeError):
+    pass
+
+
+class PoolClosedError(RuntimeError):
+    pass
+
+
+def _cpu_ids():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+@contextmanager
+def _bare_main_module():
+    # Streamlit runs app.py as __main__, and spawn would re-run it in every worker; the
+    # worker entry point lives in this module, so the children need no __main__ at all
+    main_module = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main_module
+
+
+def _worker_main(conn, slot_names, max_batch_size, path, url, threads, cpus):
+    # Ctrl+C reaches the whole process group; the parent shuts workers down through close()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    try:
+        from classifier import load_classifier, serving_backend, supports_embeddings, warm_up
+        slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+        batches = [np.ndarray((max_batch_size, *IMAGE_SIZE, 3), dtype=np.uint8, buffer=slot.buf)
+                   for slot in slots]
+        # Satu inter-op thread: paralelisme antar request datang dari jumlah worker
+        model = load_classifier(path, url, intra_op_threads=threads, inter_op_threads=1)
+        warm_up(model)
+    except Exception as e:
+        conn.send(("failed", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", supports_embeddings(model), getattr(model, "cascade_identity", None),
+               serving_backend(model)))
+
+    batch = None
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        job_id, slot, count, embeddings = job
+        batch = batches[slot][:count]
+        try:
+            if embeddings:
+                result = model.predict_with_embeddings(batch)
+            else:
+                result = model.predict(batch, batch_size=count, verbose=0)
+        except Exception as e:
+            conn.send(("error", job_id, f"{type(e).__name__}: {e}"))
+        else:
+            conn.send(("done", job_id, result))
+    del batch, batches
+    for slot in slots:
+        slot.close()
+
+
+class _Worker:
+    def __init__(self, index, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.ready = False
+        self.job = None
+        self.failure = None
+
+
+class InferencePool:
+    def __init__(self, workers=None, threads_per_worker=THREADS_PER_WORKER, path=MODEL_PATH, url=MODEL_URL,
+                 max_batch_size=MAX_BATCH_SIZE, pin=PIN_WORKERS):
+        self.workers = workers or INFERENCE_WORKERS or 1
+        cpus = _cpu_ids()
+        self.threads_per_worker = threads_per_worker or max(1, available_cpus() // self.workers)
+        self.path = path
+        self.url = url
+        self.max_batch_size = max_batch_size
+        # Only pin when every worker can get cores of its own
+        self._cpu_sets = [None] * self.workers
+        if pin and self.workers * self.threads_per_worker <= len(cpus):
+            t = self.threads_per_worker
+            self._cpu_sets = [cpus[i * t:(i + 1) * t] for i in range(self.workers)]
+        self.supports_embeddings = False
+        self.cascade_identity = None
+        self.backend = "keras"
+        self.restarts = 0
+        self._context = mp.get_context("spawn")  # TensorFlow is not fork-safe
+        self._slots = []
+        self._buffers = []
+        self._free_slots = queue.Queue()
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._wake_lock = threading.Lock()
+        self._job_ids = itertools.count()
+        self._workers = [None] * self.workers
+        self._restart_at = [None] * self.workers
+        self._restart_delay = [1.0] * self.workers
+        self._ready = threading.Event()
+        self._startup_error = None
+        self._closed = False
+        self._wake_recv, self._wake_send = self._context.Pipe(duplex=False)
+        self._supervisor = None
+
+    @property
+    def concurrency(self):
+        return self.workers
+
+    def start(self, timeout=None):
+        if not os.path.exists(self.path):
+            # Download once here rather than racing in every worker
+            download_model(self.url, self.path)
+        # Two slots per worker: one being filled while the other is being scored
+        size = self.max_batch_size * IMAGE_SIZE[0] * IMAGE_SIZE[1] * 3
+        for _ in range(2 * self.workers):
+            slot = shared_memory.SharedMemory(create=True, size=size)
+            self._slots.append(slot)
+            self._buffers.append(np.ndarray((self.max_batch_size, *IMAGE_SIZE, 3), dtype=np.uint8, buffer=slot.buf))
+            self._free_slots.put(len(self._slots) - 1)
+        for index in range(self.workers):
+            self._spawn(index)
+        self._supervisor = threading.Thread(target=self._supervise, name="inference-pool", daemon=True)
+        self._supervisor.start()
+        # The app never closes its pool explicitly; still stop the workers and free the segments on exit
+        atexit.register(self.close)
+        if not self._ready.wait(timeout) or self._startup_error is not None:
+            error = self._startup_error or "timed out"
+            self.close()
+            raise RuntimeError(f"Inference workers failed to start: {error}")
+        return self
+
+    def _spawn(self, index):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main, name=f"inference-worker-{index}", daemon=True,
+            args=(child_conn, [slot.name for slot in self._slots], self.max_batch_size, self.path, self.url,
+                  self.threads_per_worker, self._cpu_sets[index]),
+        )
+        with _bare_main_module():
+            process.start()
+        child_conn.close()
+        self._workers[index] = _Worker(index, process, parent_conn)
+        self._restart_at[index] = None
+
+    def _wake(self):
+        with self._wake_lock:
+            self._wake_send.send_bytes(b"\0")
+
+    def submit(self, batch, embeddings=False):
+        count = len(batch)
+        if count > self.max_batch_size:
+            raise ValueError(f"Batch of {count} is larger than the pool's max_batch_size {self.max_batch_size}")
+        # Blocks when every slot is in use, which throttles producers to the pool's throughput
+        while True:
+            if self._closed:
+                raise PoolClosedError("Inference pool is closed")
+            try:
+                slot = self._free_slots.get(timeout=0.5)
+                break
+            except queue.Empty:
+                pass  # Look at _closed again; a closed pool never frees a slot
+        future = Future()
+        # Under the lock, close() can not clear the buffers or drain the queue between the check and the append
+        with self._lock:
+            if self._closed:
+                self._free_slots.put(slot)
+                raise PoolClosedError("Inference pool is closed")
+            self._buffers[slot][:count] = batch
+            self._pending.append((next(self._job_ids), slot, count, embeddings, future))
+        self._wake()
+        return future
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        # Chunks are submitted together, so a big batch is spread over all workers
+        futures = [self.submit(batch[start:start + self.max_batch_size])
+                   for start in range(0, len(batch), self.max_batch_size)]
+        return np.concatenate([future.result() for future in futures])
+
+    def predict_with_embeddings(self, batch):
+        futures = [self.submit(batch[start:start + self.max_batch_size], embeddings=True)
+                   for start in range(0, len(batch), self.max_batch_size)]
+        results = [future.result() for future in futures]
+        return (np.concatenate([predictions for predictions, _ in results]),
+                np.concatenate([embeddings for _, embeddings in results]))
+
+    def _finish(self, worker, outcome, result):
+        _, slot, _, _, future = worker.job
+        worker.job = None
+        self._free_slots.put(slot)
+        if outcome == "done":
+            future.set_result(result)
+        else:
+            future.set_exception(result)
+
+    def _on_message(self, worker, message):
+        kind = message[0]
+        if kind == "ready":
+            worker.ready = True
+            self.supports_embeddings, self.cascade_identity, self.backend = message[1:4]
+            self._restart_delay[worker.index] = 1.0
+            if all(w is not None and w.ready for w in self._workers):
+                self._ready.set()
+        elif kind == "failed":
+            worker.failure = message[1]
+        elif kind == "done":
+            self._finish(worker, "done", message[2])
+        elif kind == "error":
+            self._finish(worker, "error", RuntimeError(message[2]))
+
+    def _on_exit(self, worker):
+        index = worker.index
+        failure = worker.failure or f"exit code {worker.process.exitcode}"
+        worker.conn.close()
+        self._workers[index] = None
+        if worker.job is not None:
+            self._finish(worker, "error", WorkerCrashedError(f"Inference worker {index} died ({failure})"))
+        if self._closed:
+            return
+        if not self._ready.is_set():
+            # A worker that cannot even start (missing model, bad config) will not get better by retrying
+            self._startup_error = failure
+            self._ready.set()
+            return
+        delay = self._restart_delay[index]
+        self._restart_delay[index] = min(delay * 2, MAX_RESTART_DELAY)
+        self._restart_at[index] = time.monotonic() + delay
+        self.restarts += 1
+        logger.warning("inference worker %d died (%s); restarting in %.0fs", index, failure, delay)
+
+    def _dispatch(self):
+        idle = [w for w in self._workers if w is not None and w.ready and w.job is None]
+        while idle:
+            with self._lock:
+                if not self._pending:
+                    return
+                job = self._pending.popleft()
+            worker = idle.pop()
+            worker.job = job
+            try:
+                worker.conn.send(job[:4])
+            except OSError:
+                pass  # Worker is dying; _on_exit fails the job
+
+    def _supervise(self):
+        while not self._closed:
+            now = time.monotonic()
+            for index, restart_at in enumerate(self._restart_at):
+                if restart_at is not None and now >= restart_at:
+                    self._spawn(index)
+            workers = [w for w in self._workers if w is not None]
+            handles = [self._wake_recv] + [w.conn for w in workers] + [w.process.sentinel for w in workers]
+            ready = set(wait(handles, timeout=0.5))
+            if self._wake_recv in ready:
+                while self._wake_recv.poll():
+                    self._wake_recv.recv_bytes()
+            for worker in workers:
+                # Read the last messages before handling the exit, so finished work is not lost
+                try:
+                    while worker.conn.poll():
+                        self._on_message(worker, worker.conn.recv())
+                except (EOFError, OSError):
+                    pass
+                if worker.process.sentinel in ready:
+                    worker.process.join()
+                    self._on_exit(worker)
+            self._dispatch()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wake()
+        if self._supervisor is not None:
+            self._supervisor.join()
+        for worker in self._workers:
+            if worker is None:
+                continue
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            if worker.job is not None:
+                self._finish(worker, "error", PoolClosedError("Inference pool closed"))
+        with self._lock:
+            pending, self._pending = list(self._pending), deque()
+            self._buffers.clear()
+        for _, _, _, _, future in pending:
+            if not future.done():
+                future.set_exception(PoolClosedError("Inference pool closed"))
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()